@@ -0,0 +1,405 @@
+"""
+In-process fake of a vSphere inventory, used as the stub of the pyVmomi managed objects.
+Every method and property read is a round trip: it is counted in calls and delayed by latency.
+"""
+import itertools
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from pyVmomi import vim, vmodl
+
+from vCenterScripter import metrics
+
+PC = vmodl.query.PropertyCollector
+
+
+def _resolve(value, path: str):
+    for name in path.split('.'):
+        if value is None:
+            return None
+        value = getattr(value, name, None)
+    return value
+
+
+class FakeVSphere:
+    """
+    Fake vCenter answering the SOAP calls of the managed objects bound to it.
+    Supported: ContainerView and ListView, the PropertyCollector (paged RetrievePropertiesEx,
+    filters and WaitForUpdatesEx), tasks completing after task_time seconds and the
+    VM, snapshot and registration methods used by the benchmarks.
+    """
+    def __init__(self, latency: float = 0.0, task_time: float = 0.01):
+        """
+        :param latency: seconds added to every call
+        :param task_time: seconds a task runs before completing
+        """
+        self.latency = latency
+        self.task_time = task_time
+        self.calls = Counter()
+        self.objects = {}
+        self.props = {}
+        self.views = {}
+        self.filters = {}
+        self.results = {}
+        self.removed = {}
+        self.lock = threading.RLock()
+        self._ids = itertools.count(1)
+
+        self.si = vim.ServiceInstance('ServiceInstance', self)
+        self.root = self.add(vim.Folder, 'group-d1', name='Datacenters')
+        self.content = vim.ServiceInstanceContent(
+            rootFolder=self.root,
+            propertyCollector=PC('propertyCollector', self),
+            viewManager=vim.view.ViewManager('ViewManager', self),
+            about=vim.AboutInfo(name='FakeVSphere'))
+
+    @property
+    def round_trips(self) -> int:
+        """
+        Number of calls received
+        """
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        """
+        Forget the calls counted so far
+        """
+        with self.lock:
+            self.calls.clear()
+
+    def add(self, type_obj, moid: str = None, **props):
+        """
+        Add an object to the inventory
+        :param type_obj: type, for example vim.VirtualMachine
+        :param moid: moId of the object. Standard a new one
+        :param props: properties of the object
+        :return: the managed object, bound to this fake
+        """
+        moid = moid or '%s-%d' % (type_obj.__name__.split('.')[-1].lower(), next(self._ids))
+        obj = type_obj(moid, self)
+        with self.lock:
+            self.objects[moid] = obj
+            self.props[moid] = props
+        return obj
+
+    def remove(self, obj):
+        """
+        Remove an object from the inventory
+        :param obj: the managed object
+        """
+        with self.lock:
+            self.removed[obj._moId] = self.objects.pop(obj._moId, obj)
+
+    def get(self, obj, path: str):
+        """
+        Get a property of an object
+        :param obj: the managed object
+        :param path: property path, for example 'summary.config.name'
+        :return: the value, None if unset
+        """
+        name, _, rest = path.partition('.')
+        if name == 'view' and obj._moId in self.views:
+            value = self._view_members(obj)
+        else:
+            value = self.props.get(obj._moId, {}).get(name)
+        return _resolve(value, rest) if rest else value
+
+    def _count(self, name: str):
+        with self.lock:
+            self.calls[name] += 1
+        metrics.record_soap_call()
+        if self.latency:
+            time.sleep(self.latency)
+
+    # pyVmomi stub interface
+
+    def InvokeAccessor(self, mo, info):
+        self._count('Fetch')
+        return self.get(mo, info.name)
+
+    def InvokeMethod(self, mo, info, args):
+        self._count(info.wsdlName)
+        handler = getattr(self, 'do_' + info.wsdlName, None)
+        if handler is None:
+            if info.wsdlName.endswith('_Task'):
+                return self._task(mo, info.wsdlName, args)
+            raise vmodl.fault.NotSupported()
+        return handler(mo, *args)
+
+    # ServiceInstance
+
+    def do_RetrieveContent(self, mo):
+        return self.content
+
+    do_RetrieveServiceContent = do_RetrieveContent
+
+    def do_CurrentTime(self, mo):
+        return time.time()
+
+    # Views
+
+    def do_CreateContainerView(self, mo, container, type, recursive):
+        view = self.add(vim.view.ContainerView)
+        self.views[view._moId] = ('container', tuple(type))
+        return view
+
+    def do_CreateListView(self, mo, obj):
+        view = self.add(vim.view.ListView)
+        self.views[view._moId] = ('list', list(obj or []))
+        return view
+
+    def do_ModifyListView(self, mo, add, remove):
+        with self.lock:
+            members = self.views[mo._moId][1]
+            members.extend(add or [])
+            for obj in remove or []:
+                if obj in members:
+                    members.remove(obj)
+        return []
+
+    def do_DestroyView(self, mo):
+        self.views.pop(mo._moId, None)
+        self.remove(mo)
+
+    def _view_members(self, view) -> list:
+        kind, members = self.views[view._moId]
+        if kind == 'list':
+            return list(members)
+        with self.lock:
+            return [obj for obj in self.objects.values()
+                    if isinstance(obj, members) and obj is not self.root]
+
+    # PropertyCollector
+
+    def _filter_objects(self, spec) -> list:
+        objects = []
+        for object_spec in spec.objectSet:
+            if object_spec.selectSet and object_spec.obj._moId in self.views:
+                objects.extend(self._view_members(object_spec.obj))
+            if not object_spec.skip:
+                objects.append(object_spec.obj)
+        return objects
+
+    def _object_contents(self, spec, objects: list) -> list:
+        contents = []
+        for obj in objects:
+            for property_spec in spec.propSet:
+                if isinstance(obj, property_spec.type):
+                    values = ((path, self.get(obj, path)) for path in property_spec.pathSet)
+                    contents.append(PC.ObjectContent(obj=obj, propSet=[
+                        vmodl.DynamicProperty(name=path, val=value) for path, value in values if value is not None]))
+        return contents
+
+    def _page(self, contents: list, page_size: int):
+        if not contents:
+            return None
+        token = None
+        if len(contents) > page_size:
+            token = str(next(self._ids))
+            self.results[token] = (contents[page_size:], page_size)
+        return PC.RetrieveResult(objects=contents[:page_size], token=token)
+
+    def do_RetrievePropertiesEx(self, mo, specSet, options):
+        contents = []
+        for spec in specSet:
+            contents.extend(self._object_contents(spec, self._filter_objects(spec)))
+        return self._page(contents, (options and options.maxObjects) or 100)
+
+    def do_ContinueRetrievePropertiesEx(self, mo, token):
+        contents, page_size = self.results.pop(token)
+        return self._page(contents, page_size)
+
+    def do_CancelRetrievePropertiesEx(self, mo, token):
+        self.results.pop(token, None)
+
+    def do_CreatePropertyCollector(self, mo):
+        return PC('session[%d]propertyCollector' % next(self._ids), self)
+
+    def do_DestroyPropertyCollector(self, mo):
+        pass
+
+    def do_CreateFilter(self, mo, spec, partialUpdates):
+        property_filter = PC.Filter('filter-%d' % next(self._ids), self)
+        self.filters[property_filter._moId] = (mo._moId, spec, {})
+        return property_filter
+
+    def do_DestroyPropertyFilter(self, mo):
+        self.filters.pop(mo._moId, None)
+
+    def do_CancelWaitForUpdates(self, mo):
+        pass
+
+    def do_WaitForUpdatesEx(self, mo, version, options):
+        deadline = time.monotonic() + ((options and options.maxWaitSeconds) or 0)
+        while True:
+            filter_updates = []
+            with self.lock:
+                for filter_id, (collector, spec, seen) in list(self.filters.items()):
+                    if collector == mo._moId:
+                        updates = self._filter_updates(spec, seen)
+                        if updates:
+                            filter_updates.append(PC.FilterUpdate(filter=PC.Filter(filter_id, self), objectSet=updates))
+            if filter_updates:
+                return PC.UpdateSet(version=str(next(self._ids)), filterSet=filter_updates)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.005)
+
+    def _filter_updates(self, spec, seen: dict) -> list:
+        # Diff the properties of the objects of the filter with the ones sent before
+        objects = self._filter_objects(spec)
+        updates = []
+        for content in self._object_contents(spec, objects):
+            values = {prop.name: prop.val for prop in content.propSet}
+            old = seen.get(content.obj._moId)
+            if old is None:
+                updates.append(PC.ObjectUpdate(kind='enter', obj=content.obj, changeSet=[
+                    PC.Change(name=name, op='assign', val=value) for name, value in values.items()]))
+            elif old != values:
+                updates.append(PC.ObjectUpdate(kind='modify', obj=content.obj, changeSet=[
+                    PC.Change(name=name, op='assign', val=value) for name, value in values.items()
+                    if old.get(name) != value] + [PC.Change(name=name, op='remove') for name in old if name not in values]))
+            seen[content.obj._moId] = values
+
+        current = {obj._moId for obj in objects}
+        for moid in [moid for moid in seen if moid not in current]:
+            del seen[moid]
+            obj = self.removed.get(moid) or self.objects.get(moid)
+            updates.append(PC.ObjectUpdate(kind='leave', obj=obj, changeSet=[]))
+        return updates
+
+    # Tasks
+
+    def _task(self, mo, name: str, args: tuple) -> vim.Task:
+        task = self.add(vim.Task)
+        # Snapshots aren't managed entities: their tasks have no entity
+        entity = mo if isinstance(mo, vim.ManagedEntity) else None
+        info = vim.TaskInfo(key=task._moId, task=task, descriptionId=name, entity=entity, state='running',
+                            cancelled=False, cancelable=False, progress=0)
+        self.props[task._moId]['info'] = info
+
+        def complete():
+            try:
+                result = getattr(self, 'result_' + name, lambda mo, args: None)(mo, args)
+            except vmodl.MethodFault as e:
+                with self.lock:
+                    info.state = 'error'
+                    info.error = e
+                return
+            with self.lock:
+                info.state = 'success'
+                info.result = result
+
+        timer = threading.Timer(self.task_time, complete)
+        timer.daemon = True
+        timer.start()
+        return task
+
+    def result_RegisterVM_Task(self, folder, args):
+        path, name = args[0], args[1] or args[0].rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        return add_vm(self, name, path, args[4])
+
+    def result_PowerOffVM_Task(self, vm, args):
+        self.props[vm._moId]['runtime'].powerState = 'poweredOff'
+
+    def result_PowerOnVM_Task(self, vm, args):
+        self.props[vm._moId]['runtime'].powerState = 'poweredOn'
+
+    def do_UnregisterVM(self, vm):
+        self.remove(vm)
+
+
+def add_vm(fake: FakeVSphere, name: str, path: str, host: vim.HostSystem = None,
+           datastore: vim.Datastore = None, connection_state: str = 'connected') -> vim.VirtualMachine:
+    """
+    Add a VM to the fake inventory
+    :param fake: FakeVSphere
+    :param name: Name of the VM
+    :param path: Path of the VMX, for example '[ds1] vm1/vm1.vmx'
+    :param host: Host of the VM
+    :param datastore: Datastore of the VM
+    :param connection_state: 'connected', 'orphaned', ...
+    :return: the VM
+    """
+    runtime = vim.vm.RuntimeInfo(host=host, connectionState=connection_state, powerState='poweredOn')
+    summary = vim.vm.Summary(
+        config=vim.vm.Summary.ConfigSummary(name=name, vmPathName=path, numCpu=2, memorySizeMB=4096),
+        runtime=runtime,
+        guest=vim.vm.Summary.GuestSummary(toolsStatus='toolsOk'))
+    return fake.add(vim.VirtualMachine, name=name, summary=summary, runtime=runtime,
+                    datastore=vim.Datastore.Array([datastore] if datastore is not None else []))
+
+
+def add_snapshots(fake: FakeVSphere, vm: vim.VirtualMachine, count: int, depth: int = 3):
+    """
+    Add a tree of snapshots to a VM: chains of depth snapshots named 'snap-<n>'
+    :param fake: FakeVSphere
+    :param vm: the VM
+    :param count: number of snapshots
+    :param depth: length of each chain
+    """
+    roots = []
+    parent = None
+    for i in range(count):
+        snapshot = fake.add(vim.vm.Snapshot)
+        tree = vim.vm.SnapshotTree(name='snap-%d' % i, snapshot=snapshot, vm=vm, id=i,
+                                   createTime=datetime.now(timezone.utc), state='poweredOn', quiesced=False,
+                                   childSnapshotList=[])
+        if parent is None or i % depth == 0:
+            roots.append(tree)
+        else:
+            parent.childSnapshotList.append(tree)
+        parent = tree
+    fake.props[vm._moId]['snapshot'] = vim.vm.SnapshotInfo(rootSnapshotList=roots)
+
+
+def build_inventory(fake: FakeVSphere, vms: int, hosts: int = None, datastores: int = None,
+                    snapshots_per_vm: int = 0, orphans: int = 0) -> dict:
+    """
+    Fill the fake with a synthetic inventory: hosts in clusters of 8, each cluster with its
+    resource pools, datastores and VMs spread over them.
+    :param fake: FakeVSphere
+    :param vms: number of VMs
+    :param hosts: number of hosts. Standard one every 30 VMs
+    :param datastores: number of datastores. Standard one every 100 VMs
+    :param snapshots_per_vm: snapshots of each VM
+    :param orphans: number of orphaned VMs, among the first ones
+    :return: a dict with the lists of 'hosts', 'datastores', 'vms' and 'clusters'
+    """
+    hosts = hosts or max(1, vms // 30)
+    datastores = datastores or max(1, vms // 100)
+
+    host_objects = []
+    for i in range(hosts):
+        name = 'esx%04d.example.com' % i
+        host_objects.append(fake.add(vim.HostSystem, name=name,
+                                     summary=vim.host.Summary(config=vim.host.Summary.ConfigSummary(name=name))))
+
+    clusters = []
+    for i in range(0, hosts, 8):
+        members = host_objects[i:i + 8]
+        cluster = fake.add(vim.ClusterComputeResource, name='cluster%d' % (i // 8),
+                           host=vim.HostSystem.Array(members))
+        clusters.append(cluster)
+        for pool_name in ('Resources', 'prod', 'test'):
+            fake.add(vim.ResourcePool, name=pool_name, owner=cluster)
+
+    datastore_objects = []
+    for i in range(datastores):
+        name = 'ds%03d' % i
+        datastore_objects.append(fake.add(vim.Datastore, name=name, summary=vim.Datastore.Summary(
+            name=name, accessible=True, type='VMFS', capacity=1 << 42, freeSpace=1 << 41)))
+
+    vm_objects = []
+    for i in range(vms):
+        name = 'vm%05d' % i
+        datastore = datastore_objects[i % datastores]
+        vm = add_vm(fake, name, '[%s] %s/%s.vmx' % (datastore.name, name, name), host_objects[i % hosts],
+                    datastore, 'orphaned' if i < orphans else 'connected')
+        if snapshots_per_vm:
+            add_snapshots(fake, vm, snapshots_per_vm)
+        vm_objects.append(vm)
+
+    return {'hosts': host_objects, 'datastores': datastore_objects, 'vms': vm_objects, 'clusters': clusters}
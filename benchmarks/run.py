@@ -0,0 +1,155 @@
+"""
+Benchmarks of the helpers against the in-process fake vSphere, with no vCenter needed.
+Every case reports the wall-clock time and the round trips made to the fake:
+
+    python -m benchmarks.run --vms 100,1000,10000 --latency 0.001
+    python -m benchmarks.run --vms 50000 --cases list_vm_names,get_vm --format json
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks.fake_vsphere import FakeVSphere, build_inventory
+from vCenterScripter.common import connection_state
+from vCenterScripter.host import list_resource_pool_host
+from vCenterScripter.logger import print_report
+from vCenterScripter.storage import delete_snapshots_older_than, get_snapshot_indexes
+from vCenterScripter.vm import get_vm, list_vm_names, register_vm, register_vms, run_batch
+
+# Lookups made by the cases working on a sample of the inventory
+SAMPLE_SIZE = 100
+# VMs registered by each registration case
+REGISTRATIONS = 20
+# VMs of the batch case
+BATCH_SIZE = 200
+
+REPORT_COLUMNS = [
+    ("Case", 'case'),
+    ("VMs", 'vms'),
+    ("Seconds", 'seconds'),
+    ("Round trips", 'round_trips'),
+]
+
+
+def bench_list_vm_names(fake: FakeVSphere, inventory: dict):
+    list_vm_names(fake.si)
+
+
+def bench_get_vm(fake: FakeVSphere, inventory: dict):
+    for vm in random.sample(inventory['vms'], min(SAMPLE_SIZE, len(inventory['vms']))):
+        get_vm(fake.si, fake.props[vm._moId]['name'])
+
+
+def bench_list_resource_pool_host(fake: FakeVSphere, inventory: dict):
+    for host in inventory['hosts']:
+        list_resource_pool_host(fake.si, host)
+
+
+def _orphans(fake: FakeVSphere, inventory: dict, first: int) -> list:
+    vms = inventory['vms'][first:first + REGISTRATIONS]
+    return [(fake.props[vm._moId]['summary'].config.vmPathName, fake.props[vm._moId]['name']) for vm in vms]
+
+
+def bench_register_vm(fake: FakeVSphere, inventory: dict):
+    host = inventory['hosts'][0]
+    for path, name in _orphans(fake, inventory, 0):
+        register_vm(fake.si, fake.root, path, name, host, None)
+
+
+def bench_register_vms(fake: FakeVSphere, inventory: dict):
+    paths = [path for path, _ in _orphans(fake, inventory, REGISTRATIONS)]
+    register_vms(fake.si, paths, fake.root, inventory['hosts'][0])
+
+
+def bench_snapshot_lookup(fake: FakeVSphere, inventory: dict):
+    vms = random.sample(inventory['vms'], min(SAMPLE_SIZE, len(inventory['vms'])))
+    for index in get_snapshot_indexes(fake.si, vms).values():
+        index.find('snap-4')
+
+
+def bench_delete_snapshots(fake: FakeVSphere, inventory: dict):
+    delete_snapshots_older_than(fake.si, timedelta(0), inventory['vms'][:BATCH_SIZE], max_concurrency=50)
+
+
+def bench_run_batch(fake: FakeVSphere, inventory: dict):
+    run_batch('PowerOffVM_Task', inventory['vms'][:BATCH_SIZE], max_concurrency=50)
+
+
+CASES = {
+    'list_vm_names': bench_list_vm_names,
+    'get_vm': bench_get_vm,
+    'list_resource_pool_host': bench_list_resource_pool_host,
+    'register_vm': bench_register_vm,
+    'register_vms': bench_register_vms,
+    'snapshot_lookup': bench_snapshot_lookup,
+    'delete_snapshots': bench_delete_snapshots,
+    'run_batch': bench_run_batch,
+}
+
+
+def cold_start(fake: FakeVSphere):
+    """
+    Forget the caches of the connection, so that every case starts from a new session
+    :param fake: FakeVSphere
+    """
+    state = connection_state(fake.si)
+    if state.tasks is not None:
+        state.tasks.close()
+    if state.views is not None:
+        state.views.close()
+    state.reset_session()
+
+
+def run(sizes: list, cases: list, latency: float = 0.0, snapshots: int = 6, repeat: int = 1):
+    """
+    Run the cases on inventories of each size
+    :param sizes: numbers of VMs
+    :param cases: names of the cases
+    :param latency: seconds added to every round trip
+    :param snapshots: snapshots of each VM
+    :param repeat: runs of each case, the fastest one is reported
+    :return: an iterator of result dicts {'case', 'vms', 'seconds', 'round_trips'}
+    """
+    for size in sizes:
+        fake = FakeVSphere()
+        inventory = build_inventory(fake, size, snapshots_per_vm=snapshots, orphans=2 * REGISTRATIONS)
+        fake.latency = latency
+        for case in cases:
+            best = None
+            for _ in range(repeat):
+                cold_start(fake)
+                fake.reset_calls()
+                start = time.perf_counter()
+                CASES[case](fake, inventory)
+                seconds = time.perf_counter() - start
+                if best is None or seconds < best[0]:
+                    best = (seconds, fake.round_trips)
+            yield {'case': case, 'vms': size, 'seconds': round(best[0], 4), 'round_trips': best[1]}
+        cold_start(fake)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Benchmark vCenterScripter against a fake vSphere")
+    parser.add_argument('--vms', default='100,1000,10000', help="comma separated inventory sizes")
+    parser.add_argument('--cases', default=','.join(CASES), help="comma separated cases")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every round trip")
+    parser.add_argument('--snapshots', type=int, default=6, help="snapshots of each VM")
+    parser.add_argument('--repeat', type=int, default=1, help="runs of each case, the fastest is reported")
+    parser.add_argument('--format', default='plain', choices=('plain', 'tsv', 'json'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(',')
+    for case in cases:
+        if case not in CASES:
+            parser.error("unknown case %r" % case)
+    random.seed(args.seed)
+    sizes = [int(size) for size in args.vms.split(',')]
+    print_report(run(sizes, cases, args.latency, args.snapshots, args.repeat), REPORT_COLUMNS,
+                 sys.stdout, args.format)
+
+
+if __name__ == '__main__':
+    main()
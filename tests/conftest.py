@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from benchmarks.fake_vsphere import FakeVSphere, build_inventory
+from vCenterScripter.common import connection_state
+
+
+def wait_until(condition, timeout: float = 5.0):
+    """
+    Wait for a condition to become true
+    :param condition: function with no arguments
+    :param timeout: max seconds to wait
+    :return: True if the condition became true in time
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def fake():
+    """
+    Empty fake vSphere, its connection state is closed at the end of the test
+    """
+    fake = FakeVSphere()
+    yield fake
+    state = connection_state(fake.si)
+    if state.tasks is not None:
+        state.tasks.close()
+    if state.views is not None:
+        state.views.close()
+
+
+@pytest.fixture
+def inventory(fake):
+    """
+    Inventory of 50 VMs on 2 hosts and 1 datastore
+    """
+    return build_inventory(fake, 50)
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fake_vsphere import build_inventory
+from vCenterScripter.aio import await_task, vm
+from vCenterScripter.tasks import track_task
+
+
+def test_await_task(fake, inventory):
+    task = inventory['vms'][0].PowerOffVM_Task()
+    asyncio.run(await_task(task, timeout=5))
+    assert fake.props[inventory['vms'][0]._moId]['runtime'].powerState == 'poweredOff'
+
+
+def test_timeout_leaves_shared_future(fake, inventory):
+    fake.task_time = 0.3
+    task = inventory['vms'][0].PowerOffVM_Task()
+    shared = track_task(task)
+
+    async def wait_both():
+        with pytest.raises(asyncio.TimeoutError):
+            await await_task(task, timeout=0.01, cancel_task=False)
+        await shared
+
+    asyncio.run(wait_both())
+    assert not shared.cancelled()
+    assert shared.exception() is None
+
+
+def test_register_vm_clears_miss(fake):
+    inventory = build_inventory(fake, 10, orphans=1)
+    path = fake.props[inventory['vms'][0]._moId]['summary'].config.vmPathName
+    assert asyncio.run(vm.get_vm(fake.si, 'fresh')) is None
+
+    asyncio.run(vm.register_vm(fake.si, fake.root, path, 'fresh', inventory['hosts'][0], None, timeout=5))
+    assert asyncio.run(vm.get_vm(fake.si, 'fresh')) is not None
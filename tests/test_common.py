@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+from pyVmomi import vim
+
+from benchmarks.fake_vsphere import add_vm
+from tests.conftest import wait_until
+from vCenterScripter.common import (DuplicateNameError, connection_state, get_object, get_view_manager,
+                                    invalidate_inventory, list_obj_names)
+from vCenterScripter.inventory import disable_inventory_cache, enable_inventory_cache
+from vCenterScripter.tasks import get_task_tracker
+
+
+def test_lookup(fake, inventory):
+    assert get_object(fake.si, vim.VirtualMachine, 'vm00007') is inventory['vms'][7]
+    assert get_object(fake.si, vim.VirtualMachine, 'missing') is None
+
+    add_vm(fake, 'vm00007', '[ds000] copy/copy.vmx')
+    invalidate_inventory(fake.si, vim.VirtualMachine)
+    with pytest.raises(DuplicateNameError):
+        get_object(fake.si, vim.VirtualMachine, 'vm00007')
+
+
+def test_miss_remembered_until_invalidated(fake, inventory):
+    assert get_object(fake.si, vim.VirtualMachine, 'late') is None
+    late = add_vm(fake, 'late', '[ds000] late/late.vmx')
+
+    # A helper creating the VM drops the miss
+    fake.reset_calls()
+    assert get_object(fake.si, vim.VirtualMachine, 'late') is None
+    assert fake.round_trips == 0
+    invalidate_inventory(fake.si, vim.VirtualMachine)
+    assert get_object(fake.si, vim.VirtualMachine, 'late') is late
+
+
+def test_reset_session(fake, inventory):
+    cache = enable_inventory_cache(fake.si, max_wait_seconds=1)
+    tracker = get_task_tracker(fake.si)
+    future = tracker.track(inventory['vms'][0].PowerOffVM_Task())
+    future.result(5)
+    views = get_view_manager(fake.si)
+    views.get_view([vim.Datastore])
+
+    state = connection_state(fake.si)
+    state.reset_session()
+    assert state.index is None
+    assert state.tasks is None
+    assert state.views is None
+    assert state.content is None
+
+    assert wait_until(lambda: views.live_views == 0 and cache._filter is None)
+    # The inventory cache is started again on the new session
+    assert wait_until(lambda: state.index is not None)
+    restarted = state.index
+    assert restarted is not cache
+    assert restarted.ready.is_set()
+    assert restarted.cached_types == cache.cached_types
+    disable_inventory_cache(fake.si)
+    assert wait_until(lambda: not fake.filters)
+    assert not fake.views
+    # A new session starts from scratch
+    assert len(list_obj_names(fake.si, vim.VirtualMachine)) == 50
+    assert get_task_tracker(fake.si) is not tracker
+
+
+def test_reset_session_after_disable(fake, inventory):
+    enable_inventory_cache(fake.si, max_wait_seconds=1)
+    state = connection_state(fake.si)
+    state.reset_session()
+    disable_inventory_cache(fake.si)
+    assert wait_until(lambda: not any(thread.name == 'vcs-session-reset' for thread in threading.enumerate()))
+    assert state.index is None
+    assert not fake.filters
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+from pyVmomi import vim
+
+from benchmarks.fake_vsphere import FakeVSphere
+from vCenterScripter import connection
+from vCenterScripter.connection import SessionPool
+
+
+class FakeSessionStub:
+    """
+    Session stub over a FakeVSphere, logging in at the first call like VimSessionOrientedStub
+    """
+    STATE_UNAUTHENTICATED = 0
+    STATE_AUTHENTICATED = 1
+
+    def __init__(self, soap_stub, login):
+        self.soapStub = soap_stub
+        self.login = login
+        self.lock = threading.Lock()
+        self.state = self.STATE_UNAUTHENTICATED
+
+    @staticmethod
+    def makeUserLoginMethod(user, pwd):
+        return lambda stub: None
+
+    def _login(self):
+        with self.lock:
+            if self.state == self.STATE_UNAUTHENTICATED:
+                self.login(self.soapStub)
+                self.state = self.STATE_AUTHENTICATED
+
+    def InvokeMethod(self, mo, info, args):
+        self._login()
+        return self.soapStub.InvokeMethod(mo, info, args)
+
+    def InvokeAccessor(self, mo, info):
+        self._login()
+        return self.soapStub.InvokeAccessor(mo, info)
+
+
+class FakeSoapStub(FakeVSphere):
+    def __init__(self):
+        super().__init__()
+        self.content.sessionManager = vim.SessionManager('SessionManager', self)
+        self.props['SessionManager'] = {'currentSession': vim.UserSession(key='1', userName='admin')}
+        self.dropped = False
+
+    def DropConnections(self):
+        self.dropped = True
+
+    def do_Logout(self, mo):
+        self.props['SessionManager']['currentSession'] = None
+
+
+class StubList(list):
+    pass
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """
+    The SOAP stubs opened by the pools, each opening takes 0.1 seconds
+    """
+    stubs = StubList()
+    lock = threading.Lock()
+    opening = [0, 0]
+
+    def smart_stub_adapter(host, port, **kwargs):
+        with lock:
+            opening[0] += 1
+            opening[1] = max(opening)
+        time.sleep(0.1)
+        with lock:
+            opening[0] -= 1
+            stub = FakeSoapStub()
+            stubs.append(stub)
+        return stub
+
+    monkeypatch.setattr(connection.connect, 'SmartStubAdapter', smart_stub_adapter)
+    monkeypatch.setattr(connection.connect, 'VimSessionOrientedStub', FakeSessionStub)
+    stubs.peak_opening = lambda: opening[1]
+    return stubs
+
+
+def test_sessions_opened_concurrently(stubs):
+    pool = SessionPool('vcenter', 'admin', 'secret', max_sessions=4)
+    contents = []
+
+    def work():
+        contents.append(pool.RetrieveContent())
+
+    threads = [threading.Thread(target=work) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(contents) == 12
+    assert pool.sessions == 4
+    assert len(stubs) == 4
+    assert stubs.peak_opening() > 1
+    pool.close()
+    assert all(stub.dropped for stub in stubs)
+    assert all(stub.props['SessionManager']['currentSession'] is None for stub in stubs)
+
+
+def test_keepalive_takes_stub_lock(stubs):
+    pool = SessionPool('vcenter', 'admin', 'secret', max_sessions=1)
+    pool.RetrieveContent()
+    session = pool._acquire()
+    stubs[0].props['SessionManager']['currentSession'] = None
+
+    with session.stub.lock:
+        thread = threading.Thread(target=session.keepalive)
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        assert session.stub.state == session.stub.STATE_AUTHENTICATED
+    thread.join(5)
+    assert not thread.is_alive()
+    pool.close()
+
+
+def test_closed_pool(stubs):
+    pool = SessionPool('vcenter', 'admin', 'secret')
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.service_instance()
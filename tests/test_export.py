@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+
+import pytest
+from pyVmomi import vim
+
+from vCenterScripter.export import ColumnarWriter, EXPORT_COLUMNS, available_formats, export_inventory
+from vCenterScripter.logger import plain_value, print_processes_list, print_report
+
+
+def test_export_inventory(fake, inventory, tmp_path):
+    counts = export_inventory(fake.si, str(tmp_path), available_formats())
+    assert counts == {vim.VirtualMachine: 50, vim.HostSystem: 1, vim.Datastore: 1}
+
+    with open(tmp_path / 'vm.csv', newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['name'] for row in rows] == ['vm%05d' % i for i in range(50)]
+    assert rows[0]['host'] == inventory['hosts'][0]._moId
+    with open(tmp_path / 'host.jsonl') as file:
+        assert json.loads(file.readline())['name'] == 'esx0000.example.com'
+
+    if 'parquet' in available_formats():
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(str(tmp_path / 'vm.parquet'))
+        assert table.num_rows == 50
+        assert table.column_names == ['moid'] + [column.name for column in EXPORT_COLUMNS[vim.VirtualMachine]]
+
+
+def test_columnar_writer_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        ColumnarWriter(str(tmp_path / 'rows'), [])
+
+
+def test_report_values(fake, inventory):
+    host = inventory['hosts'][0]
+    assert plain_value(host) == host._moId
+    assert plain_value(3) == 3
+    assert plain_value(None) is None
+
+    output = io.StringIO()
+    rows = [{'name': 'vm1', 'host': host, 'cpu': 2}]
+    print_report(rows, [("Name", 'name'), ("Host", 'host'), ("CPU", 'cpu')], output, 'json')
+    assert json.loads(output.getvalue()) == {'Name': 'vm1', 'Host': host._moId, 'CPU': 2}
+
+
+def test_print_processes_list(capsys):
+    processes = [vim.vm.guest.ProcessManager.ProcessInfo(name='sleep', pid=42, owner='root', cmdLine='/bin/sleep 5'),
+                 vim.vm.guest.ProcessManager.ProcessInfo(name='true', pid=7, owner='root', cmdLine='/bin/true',
+                                                         exitCode=0)]
+    print_processes_list(processes, None)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['Name', 'PID', 'Owner', 'cmdLine', 'StartTime', 'EndTime', 'ExitCode']
+    assert lines[2].split() == ['sleep', '42', 'root', '/bin/sleep', '5']
+    assert lines[3].split() == ['true', '7', 'root', '/bin/true', '0']
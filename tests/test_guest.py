@@ -0,0 +1,171 @@
+import os
+import threading
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pyVmomi import vim
+
+from vCenterScripter import vm
+from vCenterScripter.guest import GuestProcessWaiter, GuestTransfer, HttpConnectionPool, _transfer_url, transfer_many
+
+ProcessInfo = vim.vm.guest.ProcessManager.ProcessInfo
+
+
+class FakeProcessManager:
+    """
+    ListProcessesInGuest answering from a list of polls, each a {pid: ProcessInfo}
+    """
+    def __init__(self, polls: list):
+        self.polls = list(polls)
+        self.calls = 0
+
+    def StartProgramInGuest(self, vm, auth, spec):
+        return 7
+
+    def ListProcessesInGuest(self, vm, auth, pids):
+        self.calls += 1
+        processes = self.polls.pop(0) if len(self.polls) > 1 else self.polls[0]
+        return [proc for pid, proc in processes.items() if pid in pids]
+
+
+def _process(pid: int, exit_code: int = None) -> ProcessInfo:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2024, 1, 1, 0, 0, 3, tzinfo=timezone.utc) if exit_code is not None else None
+    return ProcessInfo(pid=pid, name='prog', owner='root', cmdLine='prog', startTime=start,
+                       endTime=end, exitCode=exit_code)
+
+
+def _waiter(polls: list, missing_seconds: float = 0.05) -> GuestProcessWaiter:
+    return GuestProcessWaiter(FakeProcessManager(polls), None, None, initial_interval=0.001, max_interval=0.001,
+                              missing_seconds=missing_seconds)
+
+
+def test_wait_completed():
+    waiter = _waiter([{1: _process(1), 2: _process(2)},
+                      {1: _process(1, 0), 2: _process(2)},
+                      {1: _process(1, 0), 2: _process(2, 3)}])
+    results = waiter.wait([1, 2])
+    assert results[1].exit_code == 0
+    assert results[1].duration == 3
+    assert results[2].exit_code == 3
+
+
+def test_missing_pid_completes():
+    waiter = _waiter([{}])
+    results = waiter.wait([7])
+    assert results[7].pid == 7
+    assert results[7].exit_code is None
+    assert waiter.process_manager.calls > 2
+
+
+def test_missing_pid_waits_for_missing_seconds():
+    # Many fast polls in a row are not enough to report a missing PID completed
+    waiter = _waiter([{}], missing_seconds=5)
+    with pytest.raises(TimeoutError):
+        waiter.wait([7], timeout=0.2)
+    assert waiter.process_manager.calls > 10
+
+
+def test_missing_pid_found_again():
+    waiter = _waiter([{}, {7: _process(7)}, {}, {7: _process(7, 0)}])
+    assert waiter.wait([7])[7].exit_code == 0
+
+
+def test_run_program_returns_pid(monkeypatch):
+    manager = FakeProcessManager([{7: _process(7)}, {7: _process(7, 0)}])
+    monkeypatch.setattr(vm, 'check_vmware_tools', lambda *args, **kwargs: True)
+    monkeypatch.setattr(vm, 'get_process_manager', lambda si: manager)
+
+    assert vm.run_program(None, None, None, 'prog', async_run=True) == 7
+    assert manager.calls == 0
+    assert vm.run_program(None, None, None, 'prog') == 7
+    assert manager.calls == 2
+
+    result = vm.run_program_result(None, None, None, 'prog')
+    assert result.pid == 7
+    assert result.exit_code == 0
+
+
+class GuestFileHandler(BaseHTTPRequestHandler):
+    """
+    Guest file transfer endpoint of an ESXi: PUT stores the body, GET returns it, over keep-alive connections
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        self.server.requests.append(self.client_address)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.files[urllib.parse.urlsplit(self.path).query] = body
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(self.client_address)
+        body = self.server.files[urllib.parse.urlsplit(self.path).query]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def guest_files(fake):
+    """
+    Local HTTP server of the guest files, with the FileManager of the fake answering its URLs
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GuestFileHandler)
+    server.files = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = 'http://*:%d/guestFile?%%s' % server.server_address[1]
+    fake.content.guestOperationsManager = vim.vm.guest.GuestOperationsManager('guestOperationsManager', fake)
+    fake.props['guestOperationsManager'] = {'fileManager': vim.vm.guest.FileManager('guestFileManager', fake)}
+    fake.do_InitiateFileTransferToGuest = lambda mo, vm, auth, guest_path, attributes, size, overwrite: \
+        url % guest_path
+    fake.do_InitiateFileTransferFromGuest = lambda mo, vm, auth, guest_path: \
+        vim.vm.guest.FileManager.FileTransferInformation(url=url % guest_path, size=len(server.files[guest_path]))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_transfer_many(fake, inventory, guest_files, tmp_path):
+    vm = inventory['vms'][0]
+    credentials = vim.vm.guest.NamePasswordAuthentication(username='root', password='secret')
+    pool = HttpConnectionPool()
+    contents = {'file%d' % i: os.urandom(1000 + i) for i in range(10)}
+
+    uploads = [GuestTransfer('upload', vm, credentials, name, content) for name, content in contents.items()]
+    results = transfer_many(fake.si, uploads, max_concurrency=2, host='127.0.0.1', pool=pool)
+    assert [result.error for result in results] == [None] * 10
+    assert guest_files.files == contents
+    assert [result.stats.bytes for result in results] == [len(content) for content in contents.values()]
+    assert all(result.stats.guest_path == result.transfer.guest_path for result in results)
+
+    downloads = [GuestTransfer('download', vm, credentials, name, str(tmp_path / name)) for name in contents]
+    results = transfer_many(fake.si, downloads, max_concurrency=2, host='127.0.0.1', pool=pool)
+    assert all(result.error is None for result in results)
+    assert all((tmp_path / name).read_bytes() == content for name, content in contents.items())
+    assert sum(result.stats.bytes for result in results) == sum(len(content) for content in contents.values())
+
+    # 20 requests over at most one connection per worker
+    assert len(guest_files.requests) == 20
+    assert len(set(guest_files.requests)) <= 2
+    pool.close()
+
+
+def test_transfer_url_ipv6(fake):
+    fake.host = '[fd00::10]:443'
+    assert _transfer_url(fake.si, 'https://*:443/guestFile?id=1') == ('https', '[fd00::10]:443', '/guestFile?id=1')
+    fake.host = 'vcenter.example.com:443'
+    assert _transfer_url(fake.si, 'https://*/guestFile') == ('https', 'vcenter.example.com', '/guestFile')
+    assert _transfer_url(fake.si, 'https://esx1:443/guestFile', 'fd00::20') == ('https', 'esx1:443', '/guestFile')
+    assert _transfer_url(fake.si, 'https://*:443/guestFile', 'fd00::20') == ('https', '[fd00::20]:443', '/guestFile')
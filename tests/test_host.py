@@ -0,0 +1,34 @@
+from pyVmomi import vim
+
+from vCenterScripter.host import get_resource_pool_host, get_resource_pool_index, list_resource_pool_host
+
+
+def test_list_resource_pool_host(fake, inventory):
+    host = inventory['hosts'][0]
+    assert list_resource_pool_host(fake.si, host) == {'Resources', 'prod', 'test'}
+    fake.reset_calls()
+    assert isinstance(get_resource_pool_host(fake.si, host, 'prod'), vim.ResourcePool)
+    assert fake.round_trips == 0
+
+
+def test_misses_rate_limited(fake, inventory):
+    standalone = fake.add(vim.HostSystem, name='standalone')
+    index = get_resource_pool_index(fake.si)
+    fake.reset_calls()
+    for _ in range(10):
+        assert list_resource_pool_host(fake.si, standalone) == set()
+        assert get_resource_pool_host(fake.si, inventory['hosts'][0], 'missing') is None
+    assert fake.round_trips == 0
+
+    index.loaded -= index.miss_ttl
+    assert get_resource_pool_host(fake.si, inventory['hosts'][0], 'missing') is None
+    assert fake.calls['RetrievePropertiesEx'] == 1
+
+
+def test_refresh(fake, inventory):
+    host = inventory['hosts'][0]
+    index = get_resource_pool_index(fake.si)
+    fake.add(vim.ResourcePool, name='new', owner=index.owner(host))
+    assert 'new' not in list_resource_pool_host(fake.si, host)
+    get_resource_pool_index(fake.si, refresh=True)
+    assert 'new' in list_resource_pool_host(fake.si, host)
@@ -0,0 +1,124 @@
+import pytest
+from pyVmomi import vim, vmodl
+
+from benchmarks.fake_vsphere import add_vm
+from tests.conftest import wait_until
+from vCenterScripter.common import get_object, invalidate_inventory, list_obj_names
+from vCenterScripter.inventory import InventoryCache, disable_inventory_cache, enable_inventory_cache
+
+PC = vmodl.query.PropertyCollector
+
+
+@pytest.fixture
+def cache(fake, inventory):
+    cache = enable_inventory_cache(fake.si, max_wait_seconds=1)
+    yield cache
+    disable_inventory_cache(fake.si)
+
+
+def _rename(fake, vm, name):
+    # A new Summary, so that the fake sees the change
+    summary = fake.props[vm._moId]['summary']
+    fake.props[vm._moId]['summary'] = vim.vm.Summary(
+        config=vim.vm.Summary.ConfigSummary(name=name, vmPathName=summary.config.vmPathName),
+        runtime=summary.runtime, guest=summary.guest)
+
+
+def test_initial_load(fake, inventory, cache):
+    assert cache.ready.is_set()
+    assert list_obj_names(fake.si, vim.VirtualMachine) == {'vm%05d' % i for i in range(50)}
+
+    fake.reset_calls()
+    assert get_object(fake.si, vim.VirtualMachine, 'vm00007') is inventory['vms'][7]
+    assert fake.round_trips == 0
+
+
+def test_initial_load_truncated(fake, inventory, monkeypatch):
+    wait_for_updates = fake.do_WaitForUpdatesEx
+    pending = []
+    ready_before_rest = []
+
+    def truncated(mo, version, options):
+        # The first update set comes in two halves
+        if pending:
+            ready_before_rest.append(cache.ready.is_set())
+            return pending.pop()
+        update_set = wait_for_updates(mo, version, options)
+        if update_set is not None and version is None:
+            filter_update = update_set.filterSet[0]
+            objects = filter_update.objectSet
+            half = len(objects) // 2
+            pending.append(PC.UpdateSet(version=update_set.version, filterSet=[
+                PC.FilterUpdate(filter=filter_update.filter, objectSet=objects[half:])]))
+            filter_update.objectSet = objects[:half]
+            update_set.truncated = True
+        return update_set
+
+    monkeypatch.setattr(fake, 'do_WaitForUpdatesEx', truncated)
+    cache = InventoryCache(fake.si, max_wait_seconds=1)
+    cache.start()
+    try:
+        assert ready_before_rest == [False]
+        assert cache.names(vim.VirtualMachine) == {'vm%05d' % i for i in range(50)}
+    finally:
+        cache.stop()
+
+
+def test_update_sets(fake, inventory, cache):
+    vms = inventory['vms']
+    added = add_vm(fake, 'added', '[ds000] added/added.vmx')
+    fake.remove(vms[0])
+    _rename(fake, vms[1], 'renamed')
+
+    assert wait_until(lambda: 'added' in cache.names(vim.VirtualMachine))
+    assert wait_until(lambda: 'renamed' in cache.names(vim.VirtualMachine))
+    assert wait_until(lambda: 'vm00000' not in cache.names(vim.VirtualMachine))
+    fake.reset_calls()
+    assert get_object(fake.si, vim.VirtualMachine, 'added') is added
+    assert get_object(fake.si, vim.VirtualMachine, 'renamed') is vms[1]
+    assert 'vm00001' not in list_obj_names(fake.si, vim.VirtualMachine)
+    assert fake.round_trips == 0
+
+
+def test_invalid_collector_version(fake, inventory, cache, monkeypatch):
+    wait_for_updates = fake.do_WaitForUpdatesEx
+    failed = []
+
+    def invalid_version(mo, version, options):
+        if version is not None and not failed:
+            # The session was re-established: the filters start again, the removal is not notified
+            failed.append(version)
+            fake.remove(inventory['vms'][2])
+            for _, _, seen in fake.filters.values():
+                seen.clear()
+            raise vmodl.query.InvalidCollectorVersion()
+        return wait_for_updates(mo, version, options)
+
+    monkeypatch.setattr(fake, 'do_WaitForUpdatesEx', invalid_version)
+    assert wait_until(lambda: failed and 'vm00002' not in cache.names(vim.VirtualMachine))
+    assert wait_until(lambda: cache.version is not None)
+    assert len(cache.names(vim.VirtualMachine)) == 49
+    assert cache.error is None
+
+
+def test_stop_keeps_given_collector(fake, inventory):
+    collector = fake.content.propertyCollector.CreatePropertyCollector()
+    cache = InventoryCache(fake.si, property_collector=collector, max_wait_seconds=1)
+    cache.start()
+    cache.stop()
+    assert fake.calls['CancelWaitForUpdates'] == 0
+    assert fake.calls['DestroyPropertyCollector'] == 0
+
+    cache = InventoryCache(fake.si, max_wait_seconds=1)
+    cache.start()
+    cache.stop()
+    assert fake.calls['CancelWaitForUpdates'] == 1
+    assert fake.calls['DestroyPropertyCollector'] == 1
+
+
+def test_invalidate_drops_misses(fake, inventory, cache):
+    assert get_object(fake.si, vim.VirtualMachine, 'late') is None
+    assert cache._missing(vim.VirtualMachine, 'late')
+
+    invalidate_inventory(fake.si, vim.VirtualMachine)
+    assert not cache._missing(vim.VirtualMachine, 'late')
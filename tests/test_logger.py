@@ -0,0 +1,55 @@
+from vCenterScripter.logger import Logger, print_
+
+
+def test_logger_writes_queued_messages(tmp_path):
+    path = tmp_path / 'log.txt'
+    with Logger(str(path), echo=False) as logger:
+        for i in range(100):
+            logger.print("message %d" % i)
+    assert path.read_text().splitlines() == ["message %d" % i for i in range(100)]
+
+
+def test_logger_writes_messages_after_close(tmp_path, capsys):
+    path = tmp_path / 'log.txt'
+    logger = Logger(str(path))
+    logger.print("before")
+    logger.close()
+    logger.print("after")
+    logger.record('power_on_vm', 'vm1')
+
+    assert path.read_text().splitlines() == ["before", "after", "power_on_vm vm1: ok"]
+    assert capsys.readouterr().out.splitlines() == ["\t<D>:before", "\t<D>:after", "\t<D>:power_on_vm vm1: ok"]
+
+
+def test_print_to_any_logger():
+    class ListLogger:
+        def __init__(self):
+            self.lines = []
+
+        def print(self, string):
+            self.lines.append(string)
+
+    logger = ListLogger()
+    print_("message", logger)
+    assert logger.lines == ["message"]
+
+
+def test_logger_survives_write_errors(tmp_path, capsys):
+    path = tmp_path / 'log.txt'
+    logger = Logger(str(path), echo=False)
+    write = logger._write
+
+    def failing_write(lines):
+        if any('bad' in line for line, _ in lines):
+            raise OSError("write failed")
+        write(lines)
+
+    logger._write = failing_write
+    for message in ("first", "bad", "second"):
+        logger.print(message)
+    logger.flush()
+    logger.print("third")
+    logger.close()
+
+    assert path.read_text().splitlines() == ["first", "second", "third"]
+    assert "write failed" in capsys.readouterr().err
@@ -0,0 +1,28 @@
+from pyVmomi import vim
+
+from vCenterScripter import metrics
+from vCenterScripter.common import iter_properties
+
+
+def test_generator_helpers_are_measured(fake, inventory):
+    with metrics.profile() as registry:
+        properties = iter_properties(fake.si, vim.VirtualMachine, ['name'])
+        assert registry.summary() == {}
+        names = [props['name'] for _, props in properties]
+
+    assert len(names) == 50
+    summary = registry.summary()
+    for helper in ('common.iter_properties', 'common.iter_properties_of_types'):
+        assert summary[helper]['calls'] == 1
+        assert summary[helper]['errors'] == 0
+        assert summary[helper]['soap_calls'] > 0
+        assert summary[helper]['seconds'] > 0
+
+
+def test_generator_stopped_early(fake, inventory):
+    with metrics.profile() as registry:
+        properties = iter_properties(fake.si, vim.VirtualMachine, ['name'])
+        next(properties)
+        properties.close()
+    assert registry.summary()['common.iter_properties']['calls'] == 1
+    assert registry.summary()['common.iter_properties']['errors'] == 0
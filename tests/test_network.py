@@ -0,0 +1,244 @@
+import pytest
+from pyVmomi import vim
+
+from vCenterScripter.network import portgroup, vswitch
+from vCenterScripter.network.netconfig import get_host_network, get_host_networks
+from vCenterScripter.network.reconcile import (HostNetworkState, PortgroupState, SwitchState, VnicState,
+                                               plan_host_network, reconcile_host_networks)
+from vCenterScripter.network.vswitch import Nic_Teaming, UplinkChange, change_uplinks, merge_uplink_changes
+
+
+def make_network() -> vim.host.NetworkInfo:
+    """
+    Network of a host with vSwitch0 on vmnic0, the portgroups 'VM Network' and 'Management' and vmk0
+    """
+    teaming = vim.host.NetworkPolicy.NicTeamingPolicy(
+        policy='loadbalance_srcid', nicOrder=vim.host.NetworkPolicy.NicOrderPolicy(activeNic=['vmnic0']))
+    switch = vim.host.VirtualSwitch(
+        name='vSwitch0', key='key-vim.host.VirtualSwitch-vSwitch0',
+        spec=vim.host.VirtualSwitch.Specification(
+            numPorts=128, mtu=1500, bridge=vim.host.VirtualSwitch.BondBridge(nicDevice=['vmnic0']),
+            policy=vim.host.NetworkPolicy(nicTeaming=teaming)))
+    portgroups = []
+    for name, vlan_id in (('VM Network', 0), ('Management', 5)):
+        policy = vim.host.NetworkPolicy(security=vim.host.NetworkPolicy.SecurityPolicy())
+        portgroups.append(vim.host.PortGroup(
+            key='key-vim.host.PortGroup-%s' % name,
+            spec=vim.host.PortGroup.Specification(name=name, vswitchName='vSwitch0', vlanId=vlan_id, policy=policy)))
+    vnic = vim.host.VirtualNic(
+        device='vmk0', key='key-vim.host.VirtualNic-vmk0', portgroup='Management',
+        spec=vim.host.VirtualNic.Specification(
+            mtu=1500, ip=vim.host.IpConfig(dhcp=False, ipAddress='10.0.0.10', subnetMask='255.255.255.0')))
+    pnics = [vim.host.PhysicalNic(device=device, key='key-vim.host.PhysicalNic-%s' % device)
+             for device in ('vmnic0', 'vmnic1')]
+    return vim.host.NetworkInfo(vswitch=[switch], portgroup=portgroups, vnic=[vnic], pnic=pnics)
+
+
+def add_network_hosts(fake, count: int) -> list:
+    """
+    Add hosts with the network of make_network
+    :return: the hosts
+    """
+    return [fake.add(vim.HostSystem, name='esx%d' % i, config=vim.host.ConfigInfo(network=make_network()),
+                     configManager=vim.host.ConfigManager(networkSystem=fake.add(vim.host.NetworkSystem)))
+            for i in range(count)]
+
+
+def test_plan_unchanged():
+    desired = HostNetworkState(switches=[SwitchState('vSwitch0', num_ports=128, mtu=1500, nics=['vmnic0'])],
+                               portgroups=[PortgroupState('VM Network', 'vSwitch0'),
+                                           PortgroupState('Management', 'vSwitch0', 5)],
+                               vnics=[VnicState('Management', mtu=1500)],
+                               remove_portgroups=['missing'], remove_switches=['vSwitch9'])
+    assert plan_host_network(make_network(), desired) is None
+    assert plan_host_network(make_network(), HostNetworkState()) is None
+
+
+def test_plan_switches():
+    network = make_network()
+    desired = HostNetworkState(switches=[
+        SwitchState('vSwitch0', nics=['vmnic0', 'vmnic1'], standby_nics=['vmnic1'],
+                    teaming=Nic_Teaming.failover_explicit),
+        SwitchState('vSwitch1', mtu=9000)])
+    config = plan_host_network(network, desired)
+
+    assert [(switch.changeOperation, switch.name) for switch in config.vswitch] == [('edit', 'vSwitch0'),
+                                                                                    ('add', 'vSwitch1')]
+    spec = config.vswitch[0].spec
+    assert list(spec.bridge.nicDevice) == ['vmnic0', 'vmnic1']
+    assert spec.policy.nicTeaming.policy == 'failover_explicit'
+    assert list(spec.policy.nicTeaming.nicOrder.activeNic) == ['vmnic0']
+    assert list(spec.policy.nicTeaming.nicOrder.standbyNic) == ['vmnic1']
+    assert config.vswitch[1].spec.numPorts == 128
+    assert config.vswitch[1].spec.mtu == 9000
+    assert not config.portgroup and not config.vnic
+
+    # The current network is left as it is
+    assert list(network.vswitch[0].spec.bridge.nicDevice) == ['vmnic0']
+    assert network.vswitch[0].spec.policy.nicTeaming.policy == 'loadbalance_srcid'
+
+
+def test_plan_portgroups():
+    desired = HostNetworkState(portgroups=[PortgroupState('VM Network', 'vSwitch0', 0, allow_promiscuous=False),
+                                           PortgroupState('Management', 'vSwitch0', 6),
+                                           PortgroupState('vlan10', 'vSwitch0', 10)])
+    config = plan_host_network(make_network(), desired)
+
+    assert [(portgroup.changeOperation, portgroup.spec.name, portgroup.spec.vlanId)
+            for portgroup in config.portgroup] == [('edit', 'VM Network', 0), ('edit', 'Management', 6),
+                                                   ('add', 'vlan10', 10)]
+    assert config.portgroup[0].spec.policy.security.allowPromiscuous is False
+    assert config.portgroup[2].spec.vswitchName == 'vSwitch0'
+
+
+def test_plan_vnics():
+    ip = vim.host.IpConfig(dhcp=False, ipAddress='10.0.0.11', subnetMask='255.255.255.0')
+    desired = HostNetworkState(vnics=[VnicState('Management', ip=ip, device='vmk0'),
+                                      VnicState('vMotion', mtu=9000)])
+    config = plan_host_network(make_network(), desired)
+
+    assert [(vnic.changeOperation, vnic.device, vnic.portgroup) for vnic in config.vnic] == [
+        ('edit', 'vmk0', 'Management'), ('add', None, 'vMotion')]
+    assert config.vnic[0].spec.ip.ipAddress == '10.0.0.11'
+    assert config.vnic[0].spec.mtu == 1500
+    assert config.vnic[1].spec.mtu == 9000
+
+    # A VMkernel NIC moved to another portgroup, matched by device
+    config = plan_host_network(make_network(), HostNetworkState(vnics=[VnicState('VM Network', device='vmk0')]))
+    assert [(vnic.changeOperation, vnic.device, vnic.spec.portgroup) for vnic in config.vnic] == [
+        ('edit', 'vmk0', 'VM Network')]
+
+
+def test_plan_removals():
+    desired = HostNetworkState(remove_portgroups=['VM Network', 'missing'], remove_switches=['vSwitch0'])
+    config = plan_host_network(make_network(), desired)
+    assert [(portgroup.changeOperation, portgroup.spec.name) for portgroup in config.portgroup] == [
+        ('remove', 'VM Network')]
+    assert [(switch.changeOperation, switch.name) for switch in config.vswitch] == [('remove', 'vSwitch0')]
+
+
+@pytest.mark.parametrize('dry_run', [True, False])
+def test_reconcile_host_networks(fake, dry_run):
+    hosts = add_network_hosts(fake, 3)
+    updates = []
+    fake.do_UpdateNetworkConfig = lambda mo, config, changeMode: updates.append((mo, config, changeMode))
+    desired = HostNetworkState(portgroups=[PortgroupState('vlan10', 'vSwitch0', 10)])
+
+    fake.reset_calls()
+    results = reconcile_host_networks(fake.si, {host: desired for host in hosts}, dry_run=dry_run)
+    assert [result.host for result in results] == hosts
+    assert all(result.error is None and len(result.config.portgroup) == 1 for result in results)
+    assert fake.calls['RetrievePropertiesEx'] == 1
+    assert len(updates) == (0 if dry_run else 3)
+    assert all(mode == 'modify' for _, _, mode in updates)
+
+
+def add_disconnected_host(fake):
+    return fake.add(vim.HostSystem, name='esx-down',
+                    configManager=vim.host.ConfigManager(networkSystem=fake.add(vim.host.NetworkSystem)))
+
+
+def test_disconnected_hosts(fake):
+    hosts = add_network_hosts(fake, 2)
+    down = add_disconnected_host(fake)
+    assert set(get_host_networks(fake.si, hosts + [down])) == set(hosts)
+    with pytest.raises(LookupError):
+        get_host_network(down)
+
+    fake.do_UpdateNetworkConfig = lambda mo, config, changeMode: None
+    desired = HostNetworkState(portgroups=[PortgroupState('vlan10', 'vSwitch0', 10)])
+    results = reconcile_host_networks(fake.si, {host: desired for host in [hosts[0], down, hosts[1]]})
+    assert [result.error is None for result in results] == [True, False, True]
+    assert isinstance(results[1].error, LookupError)
+
+    fake.do_UpdateVirtualSwitch = lambda mo, vswitchName, spec: None
+    results = change_uplinks(fake.si, [UplinkChange(host, 'vSwitch0', 'vmnic1') for host in [down] + hosts])
+    assert [result.error is None for result in results] == [False, True, True]
+    assert isinstance(results[0].error, LookupError)
+
+
+def test_reconcile_invalidates_after_update(fake):
+    host = add_network_hosts(fake, 1)[0]
+
+    def update(mo, config, changeMode):
+        # A concurrent reader caching the network while the update runs
+        get_host_network(host)
+        raise vim.fault.PlatformConfigFault(text="failed")
+
+    fake.do_UpdateNetworkConfig = update
+    desired = HostNetworkState(portgroups=[PortgroupState('vlan10', 'vSwitch0', 10)])
+    result = reconcile_host_networks(fake.si, {host: desired})[0]
+    assert isinstance(result.error, vim.fault.PlatformConfigFault)
+
+    fake.reset_calls()
+    get_host_network(host)
+    assert fake.calls['RetrievePropertiesEx'] == 1
+
+
+def test_list_host_portgroups(fake):
+    host = add_network_hosts(fake, 1)[0]
+    assert portgroup.list_host_portgroups(host) == {'VM Network', 'Management'}
+
+
+def test_change_uplinks_reads_current_switches(fake):
+    host = add_network_hosts(fake, 1)[0]
+    get_host_network(host)
+    # Changed by others after the network was cached
+    fake.props[host._moId]['config'] = vim.host.ConfigInfo(network=make_network())
+    fake.props[host._moId]['config'].network.vswitch[0].spec.mtu = 9000
+
+    specs = []
+    fake.do_UpdateVirtualSwitch = lambda mo, vswitchName, spec: specs.append(spec)
+    results = change_uplinks(fake.si, [UplinkChange(host, 'vSwitch0', 'vmnic1')])
+    assert results[0].error is None
+    assert specs[0].mtu == 9000
+    assert list(specs[0].bridge.nicDevice) == ['vmnic0', 'vmnic1']
+
+
+def test_merge_uplink_changes():
+    spec = make_network().vswitch[0].spec
+    changes = [UplinkChange(None, 'vSwitch0', 'vmnic1', 'standby'),
+               UplinkChange(None, 'vSwitch0', 'vmnic0', 'remove'),
+               UplinkChange(None, 'vSwitch0', 'vmnic1', 'active'),
+               UplinkChange(None, 'vSwitch0', teaming=Nic_Teaming.failover_explicit)]
+    merged = merge_uplink_changes(spec, changes)
+    assert list(merged.bridge.nicDevice) == ['vmnic1']
+    assert list(merged.policy.nicTeaming.nicOrder.activeNic) == ['vmnic1']
+    assert list(merged.policy.nicTeaming.nicOrder.standbyNic) == []
+    assert merged.policy.nicTeaming.policy == 'failover_explicit'
+    # The current spec is left as it is
+    assert list(spec.bridge.nicDevice) == ['vmnic0']
+    assert spec.policy.nicTeaming.policy == 'loadbalance_srcid'
+
+    merged = merge_uplink_changes(vim.host.VirtualSwitch.Specification(numPorts=128),
+                                  [UplinkChange(None, 'vSwitch1', 'vmnic1', 'standby')])
+    assert list(merged.bridge.nicDevice) == ['vmnic1']
+    assert list(merged.policy.nicTeaming.nicOrder.standbyNic) == ['vmnic1']
+
+    with pytest.raises(ValueError):
+        merge_uplink_changes(spec, [UplinkChange(None, 'vSwitch0', 'vmnic1', 'primary')])
+
+
+def test_merge_uplink_changes_simple_bridge():
+    spec = vim.host.VirtualSwitch.Specification(numPorts=128,
+                                                bridge=vim.host.VirtualSwitch.SimpleBridge(nicDevice='vmnic0'))
+    with pytest.raises(ValueError, match='SimpleBridge'):
+        merge_uplink_changes(spec, [UplinkChange(None, 'vSwitch0', 'vmnic1')])
+    merged = merge_uplink_changes(spec, [UplinkChange(None, 'vSwitch0', teaming=Nic_Teaming.failover_explicit)])
+    assert merged.bridge.nicDevice == 'vmnic0'
+    assert merged.policy.nicTeaming.policy == 'failover_explicit'
+
+
+def test_update_switch_reads_current_spec(fake):
+    host = add_network_hosts(fake, 1)[0]
+    updates = []
+    fake.do_UpdateVirtualSwitch = lambda mo, vswitchName, spec: updates.append(spec)
+    switch = vswitch.get_host_switch(host, 'vSwitch0')
+
+    # Changed by someone else after the view was cached
+    network = make_network()
+    network.vswitch[0].spec.bridge.nicDevice = ['vmnic0', 'vmnic2']
+    fake.props[host._moId]['config'] = vim.host.ConfigInfo(network=network)
+
+    vswitch.add_nic_switch(host, switch, network.pnic[1])
+    assert list(updates[0].bridge.nicDevice) == ['vmnic0', 'vmnic2', 'vmnic1']
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pyVmomi import vim
+
+from benchmarks.fake_vsphere import build_inventory
+from vCenterScripter.storage import delete_revert_snapshot, delete_snapshots_older_than
+
+
+def test_delete_snapshots_older_than(fake):
+    inventory = build_inventory(fake, 10, snapshots_per_vm=2)
+    cutoff = datetime.now(timezone(timedelta(hours=2))) + timedelta(minutes=1)
+    removals = delete_snapshots_older_than(fake.si, cutoff, inventory['vms'], max_concurrency=5)
+    assert len(removals) == 20
+    assert all(removal.error is None for removal in removals)
+    assert [removal.name for removal in removals] == ['snap-0'] * 10 + ['snap-1'] * 10
+
+
+def test_delete_snapshots_naive_cutoff(fake):
+    inventory = build_inventory(fake, 10, snapshots_per_vm=2)
+    with pytest.raises(ValueError):
+        delete_snapshots_older_than(fake.si, datetime.now(), inventory['vms'])
+    assert delete_snapshots_older_than(fake.si, timedelta(days=1), inventory['vms']) == []
+
+
+class ListLogger:
+    def __init__(self):
+        self.lines = []
+
+    def print(self, string):
+        self.lines.append(string)
+
+
+def test_delete_revert_snapshot_ambiguous_name(fake):
+    inventory = build_inventory(fake, 1, snapshots_per_vm=2)
+    vm = inventory['vms'][0]
+    fake.props[vm._moId]['config'] = vim.vm.ConfigInfo(name='vm00000')
+    logger = ListLogger()
+
+    delete_revert_snapshot(fake.si, vm, 'snap-2', True, logger)
+    assert logger.lines[-1] == "No snapshots found with name: snap-2 on VM: vm00000"
+
+    fake.props[vm._moId]['snapshot'].rootSnapshotList[0].childSnapshotList[0].name = 'snap-0'
+    delete_revert_snapshot(fake.si, vm, 'snap-0', True, logger)
+    assert logger.lines[-1] == "2 snapshots named snap-0 on VM: vm00000, none of them changed"
+    assert fake.calls['RemoveSnapshot_Task'] == 0
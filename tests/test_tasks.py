@@ -0,0 +1,78 @@
+import pytest
+from pyVmomi import vim, vmodl
+
+from vCenterScripter import tasks
+from vCenterScripter.tasks import TaskTracker, wait_for_tasks, wait_task
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(tasks, 'RETRY_INTERVAL', 0.01)
+
+
+def _failing_waits(fake, monkeypatch, error, times):
+    wait_for_updates = fake.do_WaitForUpdatesEx
+    failures = []
+
+    def failing(mo, version, options):
+        if len(failures) < times:
+            failures.append(version)
+            raise error
+        return wait_for_updates(mo, version, options)
+
+    monkeypatch.setattr(fake, 'do_WaitForUpdatesEx', failing)
+    return failures
+
+
+def test_wait_for_tasks(fake, inventory):
+    vms = inventory['vms'][:20]
+    outcomes = wait_for_tasks(fake.si, [vm.PowerOffVM_Task() for vm in vms])
+    assert [outcome.state for outcome in outcomes] == ['success'] * 20
+    assert fake.calls['CreateFilter'] == 1
+
+
+def test_task_error(fake, inventory):
+    def fail(vm, args):
+        raise vim.fault.InvalidState()
+
+    fake.result_PowerOffVM_Task = fail
+    with pytest.raises(vim.fault.InvalidState):
+        wait_task(inventory['vms'][0].PowerOffVM_Task(), timeout=5)
+
+
+def test_transient_error_rebuilds_filter(fake, inventory, monkeypatch):
+    failures = _failing_waits(fake, monkeypatch, vmodl.fault.SystemError(reason='connection reset'), 2)
+    tracker = TaskTracker(fake.si, max_wait_seconds=1)
+    try:
+        futures = tracker.track_all([vm.PowerOffVM_Task() for vm in inventory['vms'][:10]])
+        assert all(future.exception(5) is None for future in futures)
+        assert len(failures) == 2
+        assert fake.calls['CreateFilter'] == 3
+        assert fake.calls['DestroyPropertyFilter'] == 2
+    finally:
+        tracker.close()
+
+
+def test_retries_exhausted(fake, inventory, monkeypatch):
+    error = vmodl.fault.SystemError(reason='connection reset')
+    _failing_waits(fake, monkeypatch, error, tasks.WAIT_RETRIES + 1)
+    tracker = TaskTracker(fake.si, max_wait_seconds=1)
+    try:
+        future = tracker.track(inventory['vms'][0].PowerOffVM_Task())
+        assert future.exception(5) is error
+    finally:
+        tracker.close()
+
+
+def test_session_lost(fake, inventory, monkeypatch):
+    error = vim.fault.NotAuthenticated()
+    failures = _failing_waits(fake, monkeypatch, error, 1)
+    tracker = TaskTracker(fake.si, max_wait_seconds=1)
+    try:
+        future = tracker.track(inventory['vms'][0].PowerOffVM_Task())
+        assert future.exception(5) is error
+        assert len(failures) == 1
+        # A new filter for the next tasks
+        assert tracker.track(inventory['vms'][1].PowerOffVM_Task()).exception(5) is None
+    finally:
+        tracker.close()
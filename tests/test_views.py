@@ -0,0 +1,53 @@
+from pyVmomi import vim
+
+from vCenterScripter.common import get_view_manager, iter_properties
+from vCenterScripter.views import ViewManager
+
+
+def test_shared_view(fake, inventory):
+    views = ViewManager(fake.si)
+    view = views.get_view([vim.VirtualMachine])
+    assert views.get_view([vim.VirtualMachine]) is view
+    assert fake.calls['CreateContainerView'] == 1
+    assert len(view.view) == 50
+    views.close()
+    assert views.live_views == 0
+    assert view._moId not in fake.views
+
+
+def test_eviction_waits_for_users(fake, inventory):
+    views = ViewManager(fake.si, max_views=1)
+    with views.using([vim.VirtualMachine]) as view:
+        views.get_view([vim.HostSystem])
+        # Evicted while in use: still alive on the server
+        assert view._moId in fake.views
+        assert len(view.view) == 50
+        assert views.live_views == 2
+    assert view._moId not in fake.views
+    assert views.live_views == 1
+    views.close()
+
+
+def test_nested_users(fake, inventory):
+    views = ViewManager(fake.si)
+    first = views.acquire([vim.VirtualMachine])
+    second = views.acquire([vim.VirtualMachine])
+    assert first is second
+    views.release([vim.VirtualMachine])
+    views.release_view(first)
+    assert first._moId in fake.views
+    views.release_view(second)
+    assert first._moId not in fake.views
+
+
+def test_close_while_iterating(fake, inventory):
+    views = get_view_manager(fake.si)
+
+    names = []
+    for vm, props in iter_properties(fake.si, vim.VirtualMachine, ['name'], page_size=10):
+        if not names:
+            views.close()
+        names.append(props['name'])
+    assert len(names) == 50
+    assert views.live_views == 0
+    assert not fake.views
@@ -0,0 +1,214 @@
+import threading
+from collections import Counter
+
+import pytest
+from pyVmomi import vim
+
+from benchmarks.fake_vsphere import add_vm, build_inventory
+from tests.conftest import wait_until
+from vCenterScripter.vm import (DiskChange, VmHardware, add_disk_spec, change_disks, get_names_disk_vm, get_vm,
+                                get_vm_path_index, invalidate_vm_hardware, plan_disk_changes, reconfig_spec_vm,
+                                register_vm, resize_disk_spec, run_batch)
+
+
+def test_run_batch(fake, inventory):
+    vms = inventory['vms'][:20]
+    results = run_batch('PowerOffVM_Task', vms, max_concurrency=5)
+    assert [result.vm for result in results] == vms
+    assert all(result.error is None for result in results)
+    assert all(fake.props[vm._moId]['runtime'].powerState == 'poweredOff' for vm in vms)
+
+
+def test_run_batch_per_datastore(fake, inventory):
+    vms = inventory['vms'][:30]
+    datastore_of = {vm: fake.props[vm._moId]['datastore'][0] for vm in vms}
+    lock = threading.Lock()
+    running = Counter()
+    peak = Counter()
+
+    def power_off(vm):
+        with lock:
+            running[datastore_of[vm]] += 1
+            peak[datastore_of[vm]] = max(peak[datastore_of[vm]], running[datastore_of[vm]])
+        return vm.PowerOffVM_Task()
+
+    def completed(vm, args):
+        with lock:
+            running[datastore_of[vm]] -= 1
+
+    fake.result_PowerOffVM_Task = completed
+    results = run_batch(power_off, vms, max_concurrency=10, max_per_datastore=3)
+    assert all(result.error is None for result in results)
+    assert max(peak.values()) <= 3
+
+
+def test_run_batch_errors(fake, inventory):
+    vms = inventory['vms'][:3]
+
+    def operation(vm):
+        if vm is vms[1]:
+            raise vim.fault.InvalidState()
+        return None if vm is vms[2] else vm.PowerOffVM_Task()
+
+    results = run_batch(operation, vms)
+    assert results[0].error is None
+    assert isinstance(results[1].error, vim.fault.InvalidState)
+    assert results[2] == (vms[2], None, None)
+
+
+@pytest.mark.parametrize('limits', [{'max_concurrency': 0}, {'max_per_host': 0}, {'max_per_datastore': -1}])
+def test_run_batch_limits(fake, inventory, limits):
+    with pytest.raises(ValueError):
+        run_batch('PowerOffVM_Task', inventory['vms'][:2], **limits)
+
+
+def test_register_vm_refreshes_on_miss(fake):
+    inventory = build_inventory(fake, 30, orphans=5)
+    host = inventory['hosts'][0]
+    orphans = [fake.props[vm._moId]['summary'].config.vmPathName for vm in inventory['vms'][:5]]
+    get_vm_path_index(fake.si)
+
+    fake.reset_calls()
+    for path in orphans:
+        register_vm(fake.si, fake.root, path, None, host, None)
+    # Only the connection states of the VMs of each path are read again
+    assert fake.calls['RetrievePropertiesEx'] == 5
+    assert fake.calls['UnregisterVM'] == 5
+    assert get_vm_path_index(fake.si).orphans() == []
+
+    # A VMX unknown to the index
+    add_vm(fake, 'late', '[ds000] late/late.vmx', host, connection_state='orphaned')
+    fake.reset_calls()
+    register_vm(fake.si, fake.root, '[ds000] late/late.vmx', 'late', host, None)
+    assert fake.calls['RetrievePropertiesEx'] == 1
+    assert fake.calls['UnregisterVM'] == 1
+
+
+def test_register_vm_reads_current_states(fake):
+    inventory = build_inventory(fake, 10, orphans=1)
+    host = inventory['hosts'][0]
+    recovered, orphaned = inventory['vms'][0], inventory['vms'][1]
+    get_vm_path_index(fake.si)
+
+    # Changed since the index was loaded
+    fake.props[recovered._moId]['summary'].runtime.connectionState = 'connected'
+    fake.props[orphaned._moId]['summary'].runtime.connectionState = 'orphaned'
+    fake.reset_calls()
+    for vm in (recovered, orphaned):
+        register_vm(fake.si, fake.root, fake.props[vm._moId]['summary'].config.vmPathName, None, host, None)
+    assert fake.calls['UnregisterVM'] == 1
+    assert recovered in get_vm_path_index(fake.si).vms(fake.props[recovered._moId]['summary'].config.vmPathName)
+
+
+def test_register_vm_clears_miss(fake):
+    inventory = build_inventory(fake, 10, orphans=1)
+    path = fake.props[inventory['vms'][0]._moId]['summary'].config.vmPathName
+    assert get_vm(fake.si, 'fresh') is None
+
+    register_vm(fake.si, fake.root, path, 'fresh', inventory['hosts'][0], None)
+    assert get_vm(fake.si, 'fresh') is not None
+
+
+def make_devices(disks: int) -> list:
+    """
+    Devices of a VM with two SCSI controllers, a CD-ROM and disks 'Hard disk <n>' of 1 GB on the first controller
+    """
+    devices = [vim.vm.device.ParaVirtualSCSIController(key=1001, busNumber=1, scsiCtlrUnitNumber=7,
+                                                       deviceInfo=vim.Description(label='SCSI controller 1')),
+               vim.vm.device.ParaVirtualSCSIController(key=1000, busNumber=0, scsiCtlrUnitNumber=7,
+                                                       deviceInfo=vim.Description(label='SCSI controller 0')),
+               vim.vm.device.VirtualCdrom(key=3000, controllerKey=200, unitNumber=0,
+                                          deviceInfo=vim.Description(label='CD/DVD drive 1'))]
+    units = [unit for unit in range(16) if unit != 7][:disks]
+    for i, unit in enumerate(units):
+        backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(fileName='[ds] vm/vm_%d.vmdk' % i,
+                                                                diskMode='persistent')
+        devices.append(vim.vm.device.VirtualDisk(key=2000 + i, controllerKey=1000, unitNumber=unit,
+                                                 capacityInKB=1024 * 1024, backing=backing,
+                                                 deviceInfo=vim.Description(label='Hard disk %d' % (i + 1))))
+    return devices
+
+
+def test_plan_disk_changes():
+    hardware = VmHardware(None, make_devices(2))
+    spec = plan_disk_changes(hardware, [DiskChange('add', size_gb=5),
+                                        DiskChange('add', size_gb=6, thin=True),
+                                        DiskChange('resize', 'Hard disk 1', 2),
+                                        DiskChange('remove', 'Hard disk 2', delete_disk=True)])
+    changes = [(change.operation, change.fileOperation, change.device.key, change.device.controllerKey,
+                change.device.unitNumber, change.device.capacityInKB) for change in spec.deviceChange]
+    assert changes == [('add', 'create', -101, 1000, 2, 5 * 1024 * 1024),
+                       ('add', 'create', -102, 1000, 3, 6 * 1024 * 1024),
+                       ('edit', None, 2000, 1000, 0, 2 * 1024 * 1024),
+                       ('remove', 'destroy', 2001, 1000, 1, 1024 * 1024)]
+    assert spec.deviceChange[1].device.backing.thinProvisioned is True
+    assert spec.deviceChange[2].device.backing.fileName == '[ds] vm/vm_0.vmdk'
+
+
+def test_plan_disk_changes_units():
+    # The unit 7 of the controller is skipped, a full controller gives the next bus
+    spec = plan_disk_changes(VmHardware(None, make_devices(6)), [DiskChange('add', size_gb=1)] * 2)
+    assert [(change.device.controllerKey, change.device.unitNumber) for change in spec.deviceChange] == [
+        (1000, 6), (1000, 8)]
+    spec = plan_disk_changes(VmHardware(None, make_devices(15)), [DiskChange('add', size_gb=1)] * 2)
+    assert [(change.device.controllerKey, change.device.unitNumber) for change in spec.deviceChange] == [
+        (1001, 0), (1001, 1)]
+    spec = plan_disk_changes(VmHardware(None, make_devices(0)), [DiskChange('add', size_gb=1, controller_key=1001)])
+    assert spec.deviceChange[0].device.controllerKey == 1001
+
+
+@pytest.mark.parametrize('changes, error', [
+    ([DiskChange('resize', 'Hard disk 1', 0)], ValueError),
+    ([DiskChange('resize', 'Hard disk 16', 2)], LookupError),
+    ([DiskChange('resize', 'Hard disk 1', 2), DiskChange('remove', 'Hard disk 1')], ValueError),
+    ([DiskChange('detach', 'Hard disk 1')], ValueError),
+    ([DiskChange('add', size_gb=1, controller_key=1002)], LookupError),
+    ([DiskChange('add', size_gb=1)] * 16, LookupError),
+])
+def test_plan_disk_changes_errors(changes, error):
+    with pytest.raises(error):
+        plan_disk_changes(VmHardware(None, make_devices(15)), changes)
+
+
+def test_disk_spec_errors(fake, inventory):
+    virtual_machine = inventory['vms'][0]
+    fake.props[virtual_machine._moId]['config'] = vim.vm.ConfigInfo(
+        hardware=vim.vm.VirtualHardware(device=vim.vm.device.VirtualDevice.Array(make_devices(1))))
+    lines = []
+
+    class ListLogger:
+        def print(self, string):
+            lines.append(string)
+
+    assert resize_disk_spec(virtual_machine, 'Hard disk 1', 0, ListLogger()) is None
+    assert resize_disk_spec(virtual_machine, 'Hard disk 2', 2, ListLogger()) is None
+    assert lines == ["VM vm00000: Disk Hard disk 1 can't shrink", "VM vm00000: Disk Hard disk 2 not found"]
+    assert resize_disk_spec(virtual_machine, 'Hard disk 1', 2).deviceChange[0].device.key == 2000
+
+
+def test_disk_helpers_share_the_cached_devices(fake, inventory):
+    virtual_machine = inventory['vms'][0]
+    fake.props[virtual_machine._moId]['config'] = vim.vm.ConfigInfo(
+        hardware=vim.vm.VirtualHardware(device=vim.vm.device.VirtualDevice.Array(make_devices(1))))
+    assert get_names_disk_vm(virtual_machine) == {'Hard disk 1'}
+
+    # Changed outside the helpers: the cached devices are used until the VM is invalidated
+    fake.props[virtual_machine._moId]['config'] = vim.vm.ConfigInfo(
+        hardware=vim.vm.VirtualHardware(device=vim.vm.device.VirtualDevice.Array(make_devices(2))))
+    fake.reset_calls()
+    assert add_disk_spec(virtual_machine, 1).deviceChange[0].device.unitNumber == 1
+    assert fake.calls['RetrievePropertiesEx'] == 0
+    invalidate_vm_hardware(virtual_machine)
+    assert add_disk_spec(virtual_machine, 1).deviceChange[0].device.unitNumber == 2
+    assert get_names_disk_vm(virtual_machine) == {'Hard disk 1', 'Hard disk 2'}
+
+    # A reconfigure drops the cached devices once its task completes
+    fake.props[virtual_machine._moId]['config'] = vim.vm.ConfigInfo(
+        hardware=vim.vm.VirtualHardware(device=vim.vm.device.VirtualDevice.Array(make_devices(3))))
+    reconfig_spec_vm(virtual_machine, num_cpus=2)
+    assert wait_until(lambda: len(get_names_disk_vm(virtual_machine)) == 3)
+
+    fake.props[virtual_machine._moId]['config'] = vim.vm.ConfigInfo(
+        hardware=vim.vm.VirtualHardware(device=vim.vm.device.VirtualDevice.Array(make_devices(4))))
+    change_disks(fake.si, {virtual_machine: [DiskChange('resize', 'Hard disk 1', 2)]})
+    assert len(get_names_disk_vm(virtual_machine)) == 4
@@ -0,0 +1,92 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vim
+
+from vCenterScripter.tasks import track_task
+
+# Max number of blocking SOAP calls running at the same time for the asyncio API
+MAX_WORKERS = 32
+
+_executor = None
+
+
+def set_executor(executor: ThreadPoolExecutor):
+    """
+    Set the executor running the blocking SOAP calls of the asyncio API
+    :param executor: the executor
+    """
+    global _executor
+    _executor = executor
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Get the executor running the blocking SOAP calls of the asyncio API, creating it if needed
+    :return: the executor
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="vcs-aio")
+    return _executor
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run a blocking call in the executor of the asyncio API
+    :param func: the function
+    :return: the result of func(*args, **kwargs)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def await_task(task: vim.Task, timeout: float = None, cancel_task: bool = True):
+    """
+    Wait for a task to complete without blocking a thread, using the TaskTracker of its connection
+    :param task: the Task
+    :param timeout: max seconds to wait. None to wait forever
+    :param cancel_task: True to cancel the task on the vCenter when the wait is cancelled or timed out
+    :return: the result of the task
+    :raise: the error of the task if it failed, asyncio.TimeoutError if timeout expired
+    """
+    # A waiter of its own: the timeout cancels it, not the TaskFuture shared with the other waiters
+    future = asyncio.wrap_future(track_task(task).waiter())
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        if cancel_task:
+            get_executor().submit(_cancel_task, task)
+        raise
+
+
+def _cancel_task(task: vim.Task):
+    try:
+        task.CancelTask()
+    except Exception:
+        # Already completed or not cancelable
+        pass
+
+
+async def submit_and_wait(method, *args, timeout: float = None, **kwargs):
+    """
+    Call a method returning a Task in the executor, then await the task
+    :param method: the method, for example virtual_machine.PowerOnVM_Task
+    :param timeout: max seconds to wait for the task. None to wait forever
+    :return: the result of the task
+    """
+    task = await run_sync(method, *args, **kwargs)
+    return await await_task(task, timeout)
+
+
+def wrap(func):
+    """
+    Build the coroutine function running a blocking helper in the executor
+    :param func: the helper, for example vCenterScripter.vm.get_vm
+    :return: the coroutine function, with the same name and docstring
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(func, *args, **kwargs)
+    return wrapper
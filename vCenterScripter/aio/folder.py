@@ -0,0 +1,18 @@
+from pyVmomi import vim
+
+from vCenterScripter import folder
+from vCenterScripter.aio import submit_and_wait, wrap
+
+list_folder_names = wrap(folder.list_folder_names)
+get_folder = wrap(folder.get_folder)
+create_folder = wrap(folder.create_folder)
+
+
+async def move_to_folder_vm(virtual_machine: vim.VirtualMachine, dest_folder: vim.Folder, timeout: float = None):
+    """
+    Move a VM to another folder
+    :param virtual_machine: the virtual Machine
+    :param dest_folder: Destination folder
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    await submit_and_wait(dest_folder.MoveIntoFolder_Task, [virtual_machine], timeout=timeout)
@@ -0,0 +1,10 @@
+from vCenterScripter import host
+from vCenterScripter.aio import wrap
+
+list_host = wrap(host.list_host)
+get_host = wrap(host.get_host)
+refresh_host = wrap(host.refresh_host)
+enter_maintenance = wrap(host.enter_maintenance)
+exit_maintenance = wrap(host.exit_maintenance)
+list_resource_pool_host = wrap(host.list_resource_pool_host)
+get_resource_pool_host = wrap(host.get_resource_pool_host)
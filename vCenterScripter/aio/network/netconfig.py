@@ -0,0 +1,6 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import netconfig
+from vCenterScripter.network.netconfig import HostNetwork, invalidate_host_network
+
+get_host_network = wrap(netconfig.get_host_network)
+get_host_networks = wrap(netconfig.get_host_networks)
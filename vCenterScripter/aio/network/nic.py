@@ -0,0 +1,5 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import nic
+
+list_host_nics = wrap(nic.list_host_nics)
+get_host_nic = wrap(nic.get_host_nic)
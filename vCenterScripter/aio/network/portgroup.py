@@ -0,0 +1,9 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import portgroup
+
+list_host_portgroups = wrap(portgroup.list_host_portgroups)
+get_host_portgroup = wrap(portgroup.get_host_portgroup)
+delete_host_portgroup = wrap(portgroup.delete_host_portgroup)
+add_host_portgroup = wrap(portgroup.add_host_portgroup)
+update_host_portgroup_vlan = wrap(portgroup.update_host_portgroup_vlan)
+update_host_portgroup_flags = wrap(portgroup.update_host_portgroup_flags)
@@ -0,0 +1,6 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import reconcile
+from vCenterScripter.network.reconcile import (HostNetworkState, NetworkResult, PortgroupState, SwitchState,
+                                               VnicState, plan_host_network)
+
+reconcile_host_networks = wrap(reconcile.reconcile_host_networks)
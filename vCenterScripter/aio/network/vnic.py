@@ -0,0 +1,7 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import vnic
+
+list_host_vnics = wrap(vnic.list_host_vnics)
+get_host_nic = wrap(vnic.get_host_nic)
+add_host_vmnic_ip = wrap(vnic.add_host_vmnic_ip)
+delete_host_vmnic = wrap(vnic.delete_host_vmnic)
@@ -0,0 +1,12 @@
+from vCenterScripter.aio import wrap
+from vCenterScripter.network import vswitch
+from vCenterScripter.network.vswitch import Nic_Teaming, UplinkChange, UplinkResult, merge_uplink_changes
+
+list_host_switches = wrap(vswitch.list_host_switches)
+get_host_switch = wrap(vswitch.get_host_switch)
+add_host_switch = wrap(vswitch.add_host_switch)
+delete_host_switch = wrap(vswitch.delete_host_switch)
+add_nic_switch = wrap(vswitch.add_nic_switch)
+remove_nic_switch = wrap(vswitch.remove_nic_switch)
+change_teaming_nic_switch = wrap(vswitch.change_teaming_nic_switch)
+change_uplinks = wrap(vswitch.change_uplinks)
@@ -0,0 +1,75 @@
+from pyVmomi import vim
+
+from vCenterScripter import storage
+from vCenterScripter.aio import run_sync, submit_and_wait, wrap
+from vCenterScripter.aio.vm import refresh_vm
+from vCenterScripter.logger import Logger, print_
+from vCenterScripter.vm import invalidate_vm_hardware
+
+list_datastores = wrap(storage.list_datastores)
+get_datastore = wrap(storage.get_datastore)
+get_snapshot_index = wrap(storage.get_snapshot_index)
+get_snapshot_indexes = wrap(storage.get_snapshot_indexes)
+create_snapshots = wrap(storage.create_snapshots)
+delete_snapshots_older_than = wrap(storage.delete_snapshots_older_than)
+consolidate_vms = wrap(storage.consolidate_vms)
+
+
+async def generate_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, name: str, desc: str = "",
+                            logger: Logger = None, quiesce: bool = False, memory: bool = False,
+                            timeout: float = None) -> vim.VirtualMachine:
+    """
+    Generate a snapshot for a VM
+    :param conn: To refresh VM once executed the operation
+    :param vm: Virtual Machine
+    :param logger: Logger
+    :param name: Name of snapshot
+    :param desc: Description of the snapshot
+    :param quiesce: Quiesce
+    :param memory: Memory
+    :param timeout: max seconds to wait for the task. None to wait forever
+    :return: Virtual Machine refreshed
+    """
+    try:
+        await submit_and_wait(vm.CreateSnapshot_Task, name=name, description=desc, memory=memory, quiesce=quiesce,
+                              timeout=timeout)
+    finally:
+        invalidate_vm_hardware(vm)
+    print_("Snapshot %s generated" % name, logger)
+    return await refresh_vm(conn, vm)
+
+
+async def delete_revert_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, name: str,
+                                 delete: bool, logger: Logger = None,
+                                 timeout: float = None, index: storage.SnapshotIndex = None) -> vim.VirtualMachine:
+    """
+    Delete or revert a snapshot
+    :param conn: To refresh VM once executed the operation
+    :param vm: Virtual Machine
+    :param name: Name of the snapshot to revert or to be removed
+    :param delete: True for deletion, False for revert
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    :param index: SnapshotIndex of the VM, to skip reading its snapshot tree
+    :return: Virtual Machine refreshed
+    """
+    if index is None:
+        index = await run_sync(storage.get_snapshot_index, vm)
+    snap_obj = index.find(name)
+    if len(snap_obj) == 1:
+        snap_obj = snap_obj[0].snapshot
+        try:
+            if delete:
+                print_("Removing snapshot %s" % name, logger)
+                await submit_and_wait(snap_obj.RemoveSnapshot_Task, True, timeout=timeout)
+            else:
+                print_("Reverting to snapshot %s" % name, logger)
+                await submit_and_wait(snap_obj.RevertToSnapshot_Task, timeout=timeout)
+        finally:
+            invalidate_vm_hardware(vm)
+    elif snap_obj:
+        print_("%d snapshots named %s on VM: %s, none of them changed" % (len(snap_obj), name, vm.name), logger)
+    else:
+        print_("No snapshots found with name: %s on VM: %s" % (name, vm.name), logger)
+
+    return await refresh_vm(conn, vm)
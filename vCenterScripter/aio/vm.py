@@ -0,0 +1,355 @@
+import asyncio
+from typing import Dict, List
+
+from pyVmomi import vim
+
+from vCenterScripter import vm
+from vCenterScripter.aio import await_task, run_sync, submit_and_wait, wrap
+from vCenterScripter.common import get_process_manager, invalidate_inventory
+from vCenterScripter.guest import GuestProcessWaiter, ProcessResult, backoff_intervals
+from vCenterScripter.logger import Logger, print_
+
+list_vm_names = wrap(vm.list_vm_names)
+refresh_vm = wrap(vm.refresh_vm)
+get_vm = wrap(vm.get_vm)
+check_vmware_tools = wrap(vm.check_vmware_tools)
+terminate_pid = wrap(vm.terminate_pid)
+get_info_pid = wrap(vm.get_info_pid)
+get_info_processes = wrap(vm.get_info_processes)
+unregister_vm = wrap(vm.unregister_vm)
+unregister_orphans = wrap(vm.unregister_orphans)
+register_vms = wrap(vm.register_vms)
+change_disks = wrap(vm.change_disks)
+get_vm_hardware = wrap(vm.get_vm_hardware)
+get_vm_hardwares = wrap(vm.get_vm_hardwares)
+get_config_info_vm = wrap(vm.get_config_info_vm)
+reconfig_spec_vm = wrap(vm.reconfig_spec_vm)
+get_names_disk_vm = wrap(vm.get_names_disk_vm)
+destroy_vm = wrap(vm.destroy_vm)
+
+
+async def run_program(si: vim.ServiceInstance,
+                      virtual_machine: vim.VirtualMachine,
+                      credentials: vim.vm.guest.NamePasswordAuthentication,
+                      program_path: str,
+                      logger: Logger = None,
+                      program_arguments: str = None,
+                      working_directory: str = "",
+                      envVariables=None,
+                      async_run: bool = False,
+                      timeout: float = None) -> int:
+    """
+    Run a program inside the VM using VMWare tools, awaiting its end.
+    The process is polled fast at first, then slower, without blocking a thread between polls.
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param program_path: Path of the program to run
+    :param logger: Logger
+    :param program_arguments: Program Arguments if needed
+    :param working_directory: Where to run the program
+    :param envVariables: Environment Variables.
+    :param async_run: True to return once the program is started
+    :param timeout: max seconds to wait for the end of the program. None to wait forever
+    :return: The PID of the process. Use run_program_result to get its exit code.
+    :raise asyncio.TimeoutError: if timeout expired
+    """
+    pid = await run_sync(vm.run_program, si, virtual_machine, credentials, program_path, logger,
+                         program_arguments, working_directory, envVariables, True)
+    if not async_run:
+        await _wait_program(si, virtual_machine, credentials, pid, logger, timeout)
+    return pid
+
+
+async def run_program_result(si: vim.ServiceInstance,
+                             virtual_machine: vim.VirtualMachine,
+                             credentials: vim.vm.guest.NamePasswordAuthentication,
+                             program_path: str,
+                             logger: Logger = None,
+                             program_arguments: str = None,
+                             working_directory: str = "",
+                             envVariables=None,
+                             timeout: float = None) -> ProcessResult:
+    """
+    Run a program inside the VM using VMWare tools, awaiting its end
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param program_path: Path of the program to run
+    :param logger: Logger
+    :param program_arguments: Program Arguments if needed
+    :param working_directory: Where to run the program
+    :param envVariables: Environment Variables.
+    :param timeout: max seconds to wait for the end of the program. None to wait forever
+    :return: the ProcessResult of the program
+    :raise asyncio.TimeoutError: if timeout expired
+    """
+    pid = await run_sync(vm.run_program, si, virtual_machine, credentials, program_path, logger,
+                         program_arguments, working_directory, envVariables, True)
+    return await _wait_program(si, virtual_machine, credentials, pid, logger, timeout)
+
+
+async def _wait_program(si: vim.ServiceInstance, virtual_machine: vim.VirtualMachine,
+                        credentials: vim.vm.guest.NamePasswordAuthentication, pid: int,
+                        logger: Logger, timeout: float) -> ProcessResult:
+    result = (await wait_for_processes(si, virtual_machine, credentials, [pid], timeout))[pid]
+    vm.print_process_result(result, logger)
+    return result
+
+
+async def wait_for_processes(si: vim.ServiceInstance,
+                             virtual_machine: vim.VirtualMachine,
+                             credentials: vim.vm.guest.NamePasswordAuthentication,
+                             pids: List[int],
+                             timeout: float = None) -> Dict[int, ProcessResult]:
+    """
+    Wait for processes running inside the VM, with a single ListProcessesInGuest call per poll
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param pids: the PIDs
+    :param timeout: max seconds to wait. None to wait forever
+    :return: a dict {pid: ProcessResult}
+    :raise asyncio.TimeoutError: if some processes are still running at timeout
+    """
+    process_manager = await run_sync(get_process_manager, si)
+    waiter = GuestProcessWaiter(process_manager, virtual_machine, credentials)
+    return await asyncio.wait_for(_wait_processes(waiter, pids), timeout)
+
+
+async def _wait_processes(waiter: GuestProcessWaiter, pids: List[int]) -> Dict[int, ProcessResult]:
+    results = {}
+    running = set(pids)
+    intervals = backoff_intervals(waiter.initial_interval, waiter.max_interval)
+    while True:
+        pids = list(running)
+        for result in waiter.completed(pids, await run_sync(waiter.poll, pids)):
+            running.discard(result.pid)
+            results[result.pid] = result
+        if not running:
+            return results
+        await asyncio.sleep(next(intervals))
+
+
+async def relocate_vm(virtual_machine: vim.VirtualMachine,
+                      logger: Logger = None,
+                      dest_host: vim.HostSystem = None,
+                      dest_pool: vim.ResourcePool = None,
+                      dest_datastore: vim.Datastore = None,
+                      timeout: float = None):
+    """
+    Relocate a VM in a new host
+    :param virtual_machine: VM to be relocated
+    :param logger: logger
+    :param dest_host: Destination host for the VM
+    :param dest_pool: Destination Pool for the VM
+    :param dest_datastore: Datastore to migrate the disk to. (moveAllDiskBackingsAndDisallowSharing)
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    relocate_spec = vim.vm.RelocateSpec(host=dest_host, datastore=dest_datastore, pool=dest_pool)
+    try:
+        await submit_and_wait(virtual_machine.RelocateVM_Task, relocate_spec, timeout=timeout)
+    finally:
+        if dest_datastore is not None:
+            vm.invalidate_vm_hardware(virtual_machine)
+    print_("VM:" + virtual_machine.name + " relocated.", logger)
+
+
+async def power_off_vm(virtual_machine: vim.VirtualMachine,
+                       logger: Logger = None,
+                       timeout: float = None):
+    """
+    Power off a VM
+    :param virtual_machine: The VM
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    await submit_and_wait(virtual_machine.PowerOffVM_Task, timeout=timeout)
+    print_("VM" + virtual_machine.name + "Powered off", logger)
+
+
+async def power_on_vm(virtual_machine: vim.VirtualMachine,
+                      logger: Logger = None,
+                      host: vim.HostSystem = None,
+                      timeout: float = None):
+    """
+    Power on a VM
+    :param virtual_machine: The VM
+    :param logger: Logger
+    :param host The host were to power on the machine. None if were is registered
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    await submit_and_wait(virtual_machine.PowerOnVM_Task, host, timeout=timeout)
+    print_("VM " + virtual_machine.name + "Powered on.", logger)
+
+
+async def reload_vm(virtual_machine: vim.VirtualMachine, datastore_path: str,
+                    logger: Logger = None,
+                    timeout: float = None):
+    """
+    Unregister and register a VM on the same Head
+    :param datastore_path: The path of the VM on the Datastore
+    :param virtual_machine: The VM
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    try:
+        await submit_and_wait(virtual_machine.reloadVirtualMachineFromPath_Task, datastore_path, timeout=timeout)
+    finally:
+        vm.invalidate_vm_hardware(virtual_machine)
+    print_("VM " + virtual_machine.name + "reloaded.", logger)
+
+
+async def register_vm(si: vim.ServiceInstance,
+                      folder: vim.Folder,
+                      datastore_path: str,
+                      name_vm: str,
+                      dest_host: vim.HostSystem,
+                      dest_pool: vim.ResourcePool,
+                      as_Template: bool = False,
+                      logger: Logger = None,
+                      timeout: float = None) -> vim.VirtualMachine:
+    """
+    Register a VM to a host
+    :param si: Connection to the vCenter
+    :param folder: folder of Destination
+    :param datastore_path: Path to the VM Disk
+    :param name_vm: Name of the VM
+    :param dest_host: Destination host for the VM
+    :param dest_pool: Destination Pool for the VM
+    :param as_Template: True if it is a template
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    :return: the registered VM
+    """
+    await run_sync(vm.unregister_orphans, si, datastore_path, logger)
+    try:
+        registered = await submit_and_wait(folder.RegisterVM_Task, path=datastore_path, name=name_vm,
+                                           asTemplate=as_Template, host=dest_host, pool=dest_pool, timeout=timeout)
+    finally:
+        # The name may have been remembered as missing
+        invalidate_inventory(si, vim.VirtualMachine)
+    print_("VM " + datastore_path + "registered.", logger)
+    return registered
+
+
+async def _reconfig_devices(virtual_machine: vim.VirtualMachine, spec: vim.vm.ConfigSpec, timeout: float = None):
+    try:
+        await submit_and_wait(virtual_machine.ReconfigVM_Task, spec=spec, timeout=timeout)
+    finally:
+        vm.invalidate_vm_hardware(virtual_machine)
+
+
+async def resize_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, disk_size_gb: int,
+                         logger: Logger = None, timeout: float = None):
+    """
+    Resize the disk of a VM
+    :param disk_name: The name of the disk
+    :param virtual_machine: Virtual Machine
+    :param disk_size_gb: size in GB
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    spec = await run_sync(vm.resize_disk_spec, virtual_machine, disk_name, disk_size_gb, logger)
+    if spec is not None:
+        await _reconfig_devices(virtual_machine, spec, timeout)
+
+
+async def remove_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, delete_disk: bool = False,
+                         logger: Logger = None, timeout: float = None):
+    """
+    Remove a disk from a VM
+    :param disk_name: The name of the disk
+    :param virtual_machine: Virtual Machine
+    :param delete_disk: True if you want also to delete it from the Datastore
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    spec = await run_sync(vm.remove_disk_spec, virtual_machine, disk_name, delete_disk, logger)
+    if spec is not None:
+        await _reconfig_devices(virtual_machine, spec, timeout)
+
+
+async def add_disk_to_vm(virtual_machine: vim.VirtualMachine, disk_size_gb: int,
+                         logger: Logger = None, timeout: float = None):
+    """
+    Add a disk to a VM of size disk_size_gb
+    :param virtual_machine: Virtual Machine
+    :param disk_size_gb: size in GB
+    :param logger: Logger
+    :param timeout: max seconds to wait for the task. None to wait forever
+    """
+    spec = await run_sync(vm.add_disk_spec, virtual_machine, disk_size_gb, logger)
+    if spec is None:
+        return -1
+    await _reconfig_devices(virtual_machine, spec, timeout)
+    print_("%sGB disk added to %s" % (disk_size_gb, virtual_machine.name), logger)
+
+
+async def clone_vm(virtual_machine: vim.VirtualMachine,
+                   datastore: vim.Datastore,
+                   folder: vim.Folder,
+                   dest_host: vim.HostSystem,
+                   dest_pool: vim.ResourcePool,
+                   name: str,
+                   num_cpus: int, num_cores_per_socket: int,
+                   memory_gb: int,
+                   timeout: float = None) -> vim.VirtualMachine:
+    """
+    Clone a VM.
+    :param virtual_machine: Virtual Machine to be cloned.
+    :param datastore: Datastore of destination.
+    :param folder: Folder of destination.
+    :param dest_host: Host of destination.
+    :param dest_pool: Pool of destination.
+    :param name: Name of VM.
+    :param num_cpus: Number of CPUs.
+    :param num_cores_per_socket: Number of cores for socket.
+    :param memory_gb: GB of RAM Memory.
+    :param timeout: max seconds to wait for the task. None to wait forever
+    :return: the new VM
+    """
+    clone_spec = vm.clone_spec_vm(datastore, dest_host, dest_pool, name, num_cpus, num_cores_per_socket, memory_gb)
+    try:
+        return await submit_and_wait(virtual_machine.CloneVM_Task, folder=folder, name=name, spec=clone_spec,
+                                     timeout=timeout)
+    finally:
+        invalidate_inventory(virtual_machine, vim.VirtualMachine)
+
+
+async def run_batch(operation, vms: List[vim.VirtualMachine],
+                    max_concurrency: int = 10,
+                    timeout: float = None,
+                    logger: Logger = None) -> List[vm.BatchResult]:
+    """
+    Run an operation returning a Task on many VMs at once, awaiting all the tasks
+    :param operation: Name of the VM method returning a Task, like 'PowerOffVM_Task', or a callable vm -> Task
+    :param vms: The Virtual Machines
+    :param max_concurrency: max number of tasks running at the same time
+    :param timeout: max seconds to wait for each task. None to wait forever
+    :param logger: Logger
+    :return: a BatchResult for each VM, in the same order of vms
+    """
+    if isinstance(operation, str):
+        method_name = operation
+
+        def operation(virtual_machine):
+            return getattr(virtual_machine, method_name)()
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(virtual_machine):
+        async with semaphore:
+            try:
+                task = await run_sync(operation, virtual_machine)
+                result = await await_task(task, timeout) if task is not None else None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return vm.BatchResult(virtual_machine, None, e)
+            return vm.BatchResult(virtual_machine, result, None)
+
+    results = await asyncio.gather(*[run_one(virtual_machine) for virtual_machine in vms])
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Batch: %d VMs completed, %d failed." % (len(results) - failed, failed), logger)
+    return results
@@ -1,6 +1,212 @@
-from pyVmomi import vim
+import threading
+import time
+from typing import Iterator, Tuple
+
+from pyVmomi import vim, vmodl
+
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.views import ViewManager
 __version__ = '1.0'
 
+# Objects returned by each RetrievePropertiesEx / ContinueRetrievePropertiesEx page
+RETRIEVE_PAGE_SIZE = 1000
+
+# Property path holding the display name of each managed object type
+NAME_PROPERTIES = {
+    vim.VirtualMachine: 'summary.config.name',
+    vim.HostSystem: 'summary.config.name',
+    vim.Datastore: 'summary.name',
+}
+
+# Seconds a name not found is remembered as missing before the type is reloaded again
+MISS_TTL = 30
+
+# Per-connection state is an attribute of the SOAP stub shared by si and all its objects:
+# it lives and dies with the stub, even if it refers back to it
+_STATE_ATTRIBUTE = '_vcs_connection_state'
+_connections_lock = threading.Lock()
+
+
+class DuplicateNameError(LookupError):
+    """
+    More objects of the same type share the name looked up
+    """
+    def __init__(self, type_obj: vim, name: str, objects: list):
+        super().__init__("%d objects of type %s are named %r" % (len(objects), type_obj.__name__, name))
+        self.type_obj = type_obj
+        self.name = name
+        self.objects = objects
+
+
+class ConnectionState:
+    """
+    Caches attached to a single connection to the vCenter
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.index = None
+        self.views = None
+        self.tasks = None
+        self.content = None
+        self.managers = {}
+        self.indexes = {}
+        self.restarting = None
+
+    def reset_session(self):
+        """
+        Forget the ServiceContent, the managers and the server-side objects of the session:
+        called when the connection logs in again.
+        The task tracker and the views are closed and an inventory cache is stopped in a background
+        thread: this runs while the stub logs in, their calls to the server wait for the login.
+        The same thread then starts a new inventory cache on the new session.
+        """
+        with self.lock:
+            closers = [obj.close for obj in (self.tasks, self.views) if obj is not None]
+            stop = getattr(self.index, 'stop', None)
+            if stop is not None:
+                closers.append(stop)
+            restart = self.restarting = getattr(self.index, 'restarted', None)
+            self.content = None
+            self.managers = {}
+            self.indexes = {}
+            self.views = None
+            self.tasks = None
+            self.index = None
+        if closers:
+            threading.Thread(target=self._reset_in_background, args=(closers, restart),
+                             name="vcs-session-reset", daemon=True).start()
+
+    def _reset_in_background(self, closers: list, restart):
+        _close_all(closers)
+        if restart is None:
+            return
+        index = restart()
+        try:
+            index.start()
+        except Exception:
+            # The on-demand index keeps answering the lookups
+            _close_all([index.stop])
+            return
+        with self.lock:
+            # The cache may have been disabled or enabled again in the meantime
+            current = self.restarting is restart
+            if current:
+                self.restarting = None
+                self.index = index
+        if not current:
+            _close_all([index.stop])
+
+
+def _close_all(closers: list):
+    for close in closers:
+        try:
+            close()
+        except Exception:
+            # The server-side objects are gone with the previous session
+            pass
+
+
+def connection_state(obj) -> ConnectionState:
+    """
+    Get the state attached to the connection of obj
+    :param obj: Connection to vCenter Server or any managed object retrieved from it
+    :return: the ConnectionState
+    """
+    stub = getattr(obj, '_stub', None) or obj
+    state = getattr(stub, _STATE_ATTRIBUTE, None)
+    if state is None:
+        with _connections_lock:
+            state = getattr(stub, _STATE_ATTRIBUTE, None)
+            if state is None:
+                state = ConnectionState()
+                setattr(stub, _STATE_ATTRIBUTE, state)
+    return state
+
+
+def get_content(si: vim.ServiceInstance) -> vim.ServiceInstanceContent:
+    """
+    Get the ServiceContent of the connection, retrieved once per session
+    :param si: Connection to vCenter Server
+    :return: the ServiceContent
+    """
+    state = connection_state(si)
+    content = state.content
+    if content is None:
+        content = si.RetrieveContent()
+        with state.lock:
+            state.content = content
+    return content
+
+
+def get_manager(si: vim.ServiceInstance, path: str):
+    """
+    Get a manager of the connection, retrieved once per session
+    :param si: Connection to vCenter Server
+    :param path: path of the manager from the ServiceContent, for example 'propertyCollector'
+        or 'guestOperationsManager.processManager'
+    :return: the manager
+    """
+    state = connection_state(si)
+    manager = state.managers.get(path)
+    if manager is None:
+        manager = get_content(si)
+        for name in path.split('.'):
+            manager = getattr(manager, name)
+        with state.lock:
+            state.managers[path] = manager
+    return manager
+
+
+def get_property_collector(si: vim.ServiceInstance) -> vmodl.query.PropertyCollector:
+    """
+    Get the PropertyCollector of the connection
+    :param si: Connection to vCenter Server
+    :return: the PropertyCollector
+    """
+    return get_manager(si, 'propertyCollector')
+
+
+def get_process_manager(si: vim.ServiceInstance) -> vim.vm.guest.ProcessManager:
+    """
+    Get the guest ProcessManager of the connection
+    :param si: Connection to vCenter Server
+    :return: the ProcessManager
+    """
+    return get_manager(si, 'guestOperationsManager.processManager')
+
+
+def get_file_manager(si: vim.ServiceInstance) -> vim.vm.guest.FileManager:
+    """
+    Get the guest FileManager of the connection
+    :param si: Connection to vCenter Server
+    :return: the FileManager
+    """
+    return get_manager(si, 'guestOperationsManager.fileManager')
+
+
+def get_view_manager(si: vim.ServiceInstance) -> ViewManager:
+    """
+    Get the manager of the shared ContainerViews of the connection, creating it if needed
+    :param si: Connection to vCenter Server
+    :return: the ViewManager
+    """
+    state = connection_state(si)
+    with state.lock:
+        if state.views is None:
+            state.views = ViewManager(si, content=get_content(si))
+        return state.views
+
+
+def close_views(si: vim.ServiceInstance):
+    """
+    Destroy all the shared ContainerViews of the connection
+    :param si: Connection to vCenter Server
+    """
+    views = connection_state(si).views
+    if views is not None:
+        views.close()
+
+
 def list_obj(si: vim.ServiceInstance, type_obj: vim):
     """
     Get a list of object type_obj
@@ -8,71 +214,305 @@ def list_obj(si: vim.ServiceInstance, type_obj: vim):
     :param type_obj:  Set of type_obj names
     :return: a list of type_obj
     """
-    content = si.RetrieveContent()
-    container = content.rootFolder
-    view_type = [type_obj]
-    container_view = content.viewManager.CreateContainerView(container, view_type, True)
-    return container_view.view
+    with get_view_manager(si).using([type_obj]) as container_view:
+        return container_view.view
 
 
-def list_obj_names(si: vim.ServiceInstance, type_obj: vim) -> set:
+def name_property(type_obj: vim) -> str:
     """
-    Get names of the type_obj in the vCenter
+    Get the property path holding the name of the type_obj
     :param type_obj: type, for example vim.VirtualMachine
+    :return: the property path, for example 'summary.config.name'
+    """
+    return NAME_PROPERTIES.get(type_obj, 'name')
+
+
+def iter_properties(si: vim.ServiceInstance, type_obj: vim, path_set: list,
+                    container=None, recursive: bool = True,
+                    page_size: int = RETRIEVE_PAGE_SIZE) -> Iterator[Tuple[vim.ManagedEntity, dict]]:
+    """
+    Retrieve in bulk the properties path_set of every type_obj under container.
+    A single RetrievePropertiesEx call is made over the shared ContainerView, the
+    following pages are read with ContinueRetrievePropertiesEx.
     :param si: Connection to vCenter Server
-    :return: Set of type_obj names
+    :param type_obj: type, for example vim.VirtualMachine
+    :param path_set: property paths to fetch, for example ['name', 'runtime.host']
+    :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+    :param recursive: True to look also into the children of container
+    :param page_size: max number of objects returned by each page
+    :return: an iterator of (object, {path: value}). Unset properties are missing from the dict.
+    """
+    yield from iter_properties_of_types(si, {type_obj: path_set}, container, recursive, page_size)
+
+
+def iter_properties_of_types(si: vim.ServiceInstance, path_sets: dict,
+                             container=None, recursive: bool = True,
+                             page_size: int = RETRIEVE_PAGE_SIZE) -> Iterator[Tuple[vim.ManagedEntity, dict]]:
+    """
+    Retrieve in bulk the properties of the objects of many types under container, with a
+    single RetrievePropertiesEx call over the shared ContainerView of all the types
+    :param si: Connection to vCenter Server
+    :param path_sets: {type: property paths}, for example {vim.ResourcePool: ['name', 'owner']}
+    :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+    :param recursive: True to look also into the children of container
+    :param page_size: max number of objects returned by each page
+    :return: an iterator of (object, {path: value}). Unset properties are missing from the dict.
+    """
+    with get_view_manager(si).using(list(path_sets), container, recursive) as container_view:
+        property_collector = get_property_collector(si)
+        token = None
+
+        try:
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+                name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+            object_spec = vmodl.query.PropertyCollector.ObjectSpec(
+                obj=container_view, skip=True, selectSet=[traversal_spec])
+            property_specs = [vmodl.query.PropertyCollector.PropertySpec(
+                type=type_obj, pathSet=list(path_set), all=False) for type_obj, path_set in path_sets.items()]
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[object_spec], propSet=property_specs)
+            options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+
+            result = property_collector.RetrievePropertiesEx([filter_spec], options)
+            while result is not None:
+                token = result.token
+                for obj_content in result.objects:
+                    yield obj_content.obj, {prop.name: prop.val for prop in obj_content.propSet}
+                if token is None:
+                    break
+                result = property_collector.ContinueRetrievePropertiesEx(token)
+                token = None
+        finally:
+            # The caller stopped before the last page: free the result set on the server
+            if token is not None:
+                property_collector.CancelRetrievePropertiesEx(token)
+
+
+def retrieve_properties(si: vim.ServiceInstance, type_obj: vim, path_set: list,
+                        container=None, recursive: bool = True) -> dict:
+    """
+    Retrieve in bulk the properties path_set of every type_obj under container
+    :param si: Connection to vCenter Server
+    :param type_obj: type, for example vim.VirtualMachine
+    :param path_set: property paths to fetch
+    :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+    :param recursive: True to look also into the children of container
+    :return: a dict {object: {path: value}}
+    """
+    return dict(iter_properties(si, type_obj, path_set, container, recursive))
+
+
+class InventoryIndex:
     """
-    children = list_obj(si, type_obj)
-    set_names = set()
+    Index {type: {name: [objects]}} of a connection.
+    Each type is loaded with a single bulk retrieval the first time it is looked up, then reused.
+    The names not found are remembered for miss_ttl seconds, so that they don't reload the type at each lookup.
+    """
+    def __init__(self, si: vim.ServiceInstance, miss_ttl: float = MISS_TTL):
+        """
+        :param si: Connection to vCenter Server
+        :param miss_ttl: seconds a name not found is remembered as missing
+        """
+        self.si = si
+        self.miss_ttl = miss_ttl
+        self._lock = threading.RLock()
+        self._types = {}
+        self._misses = {}
+
+    def _load(self, type_obj: vim) -> dict:
+        with self._lock:
+            names = self._types.get(type_obj)
+        if names is None:
+            names = self.refresh(type_obj)
+        return names
+
+    def refresh(self, type_obj: vim) -> dict:
+        """
+        Reload the names of type_obj from the vCenter
+        :param type_obj: type, for example vim.VirtualMachine
+        :return: the {name: [objects]} of type_obj
+        """
+        path = name_property(type_obj)
+        names = {}
+        for obj, props in iter_properties(self.si, type_obj, [path]):
+            if path in props:
+                names.setdefault(props[path], []).append(obj)
+
+        with self._lock:
+            self._types[type_obj] = names
+            for key in [key for key in self._misses if key[0] is type_obj]:
+                del self._misses[key]
+        return names
 
-    for child in children:
+    def invalidate(self, type_obj: vim = None):
+        """
+        Drop the index of type_obj, it will be reloaded at the next lookup
+        :param type_obj: type, for example vim.VirtualMachine. None for all the types
+        """
+        with self._lock:
+            if type_obj is None:
+                self._types.clear()
+                self._misses.clear()
+            else:
+                self._types.pop(type_obj, None)
+                for key in [key for key in self._misses if key[0] is type_obj]:
+                    del self._misses[key]
+
+    def discard(self, obj):
+        """
+        Remove a destroyed or unregistered object from the index
+        :param obj: the object
+        """
+        with self._lock:
+            for names in self._types.values():
+                for name, objects in list(names.items()):
+                    if obj in objects:
+                        objects.remove(obj)
+                        if not objects:
+                            del names[name]
+
+    def names(self, type_obj: vim) -> set:
+        """
+        Get the names of type_obj
+        :param type_obj: type, for example vim.VirtualMachine
+        :return: Set of type_obj names
+        """
+        return set(self._load(type_obj))
+
+    def _missing(self, type_obj: vim, name: str) -> bool:
+        with self._lock:
+            missed = self._misses.get((type_obj, name))
+            if missed is not None and time.monotonic() - missed < self.miss_ttl:
+                return True
+            self._misses.pop((type_obj, name), None)
+            return False
+
+    def _verified(self, type_obj: vim, name: str, obj) -> bool:
+        # The object may have been renamed or removed outside this connection since the load
+        path = name_property(type_obj)
         try:
-            name = child.summary.config.name
-        except AttributeError:
-            try:
-                name = child.summary.name
-            except AttributeError:
-                name = child.name
+            return get_properties(self.si, [obj], [path])[obj].get(path) == name
+        except vmodl.fault.ManagedObjectNotFound:
+            return False
 
-        set_names.add(name)
+    def lookup(self, type_obj: vim, name: str):
+        """
+        Get the object of type_obj named name. The name of a hit is checked on the vCenter,
+        the type is reloaded once when the name is missing or the hit is stale.
+        :param type_obj: type, for example vim.VirtualMachine
+        :param name: name
+        :return: the object or None
+        :raise DuplicateNameError: if more objects have that name
+        """
+        objects = self._load(type_obj).get(name)
+        if objects and len(objects) == 1 and not self._verified(type_obj, name, objects[0]):
+            objects = None
+        if not objects and not self._missing(type_obj, name):
+            objects = self.refresh(type_obj).get(name)
+            if not objects:
+                with self._lock:
+                    self._misses[(type_obj, name)] = time.monotonic()
+        if not objects:
+            return None
+        if len(objects) > 1:
+            raise DuplicateNameError(type_obj, name, list(objects))
+        return objects[0]
 
-    return set_names
+
+def get_inventory_index(si: vim.ServiceInstance) -> InventoryIndex:
+    """
+    Get the name index of the connection, creating it if needed
+    :param si: Connection to vCenter Server
+    :return: the InventoryIndex
+    """
+    state = connection_state(si)
+    with state.lock:
+        if state.index is None:
+            state.index = InventoryIndex(si)
+        return state.index
+
+
+def invalidate_inventory(obj, type_obj: vim = None):
+    """
+    Drop the name index of a connection
+    :param obj: Connection to vCenter Server or any managed object retrieved from it
+    :param type_obj: type to be dropped, for example vim.VirtualMachine. None for all the types
+    """
+    index = connection_state(obj).index
+    if index is not None:
+        index.invalidate(type_obj)
+
+
+def forget_object(obj):
+    """
+    Remove a destroyed or unregistered object from the name index of its connection
+    :param obj: the object
+    """
+    index = connection_state(obj).index
+    if index is not None:
+        index.discard(obj)
+
+
+def service_instance(obj) -> vim.ServiceInstance:
+    """
+    Get the ServiceInstance of the connection of a managed object
+    :param obj: any managed object retrieved from the vCenter
+    :return: the ServiceInstance
+    """
+    if isinstance(obj, vim.ServiceInstance):
+        return obj
+    return vim.ServiceInstance('ServiceInstance', obj._stub)
+
+
+def get_properties(si: vim.ServiceInstance, objects: list, path_set: list) -> dict:
+    """
+    Retrieve in bulk the properties path_set of a list of objects, with a single RetrievePropertiesEx call
+    :param si: Connection to vCenter Server
+    :param objects: the managed objects, all of the same type
+    :param path_set: property paths to fetch, for example ['runtime.host', 'datastore']
+    :return: a dict {object: {path: value}}. Unset properties are missing from the dict.
+    """
+    objects = list(objects)
+    if not objects:
+        return {}
+    property_collector = get_property_collector(si)
+    object_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj in objects]
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(
+        type=type(objects[0]), pathSet=list(path_set), all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=object_specs, propSet=[property_spec])
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=RETRIEVE_PAGE_SIZE)
+
+    properties = {obj: {} for obj in objects}
+    result = property_collector.RetrievePropertiesEx([filter_spec], options)
+    while result is not None:
+        for obj_content in result.objects:
+            properties[obj_content.obj] = {prop.name: prop.val for prop in obj_content.propSet}
+        if result.token is None:
+            break
+        result = property_collector.ContinueRetrievePropertiesEx(result.token)
+    return properties
+
+
+def list_obj_names(si: vim.ServiceInstance, type_obj: vim) -> set:
+    """
+    Get names of the type_obj in the vCenter. The name index of type_obj is refreshed.
+    :param type_obj: type, for example vim.VirtualMachine
+    :param si: Connection to vCenter Server
+    :return: Set of type_obj names
+    """
+    return set(get_inventory_index(si).refresh(type_obj))
 
 
 def get_object(si: vim.ServiceInstance, type_obj: vim, name: str = ""):
     """
-    Get an object of type_obj with a specified name
+    Get an object of type_obj with a specified name, using the name index of the connection
     :param si: Connection to vCenter
     :param type_obj: type, for example vim.VirtualMachine
     :param name: name
     :return: The type_object with the specified name
+    :raise DuplicateNameError: if more objects of type_obj have that name
     """
-    children = list_obj(si, type_obj)
-
-    i = 0
-    found = False
-    child = children[i]
-    number_children = len(children)
-    while (not found) and (i < number_children):
-        child = children[i]
-
-        try:
-            child_name = child.summary.config.name
-        except AttributeError:
-            try:
-                child_name = child.summary.name
-            except AttributeError:
-                child_name = child.name
-
-        if child_name == name:
-            found = True
-        else:
-            i += 1
-
-    if found:
-        return child
-    else:
-        return None
+    return get_inventory_index(si).lookup(type_obj, name)
 
 
 def list_host_objects(objs) -> set:
@@ -104,3 +544,4 @@ def get_host_object(objs, name:str) -> set:
     return None
 
 
+instrument_module(__name__)
@@ -0,0 +1,281 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from pyVim import connect
+
+from vCenterScripter.common import *
+
+# Max number of sessions opened by a pool for each vCenter
+MAX_SESSIONS = 4
+# Seconds between two keepalive rounds of the idle sessions
+KEEPALIVE_INTERVAL = 300
+# Seconds a session can stay unused before it is logged out
+IDLE_TIMEOUT = 1800
+
+# Shared pools, keyed by (host, port, user)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PooledSession:
+    """
+    A logged in session of a SessionPool.
+    The stub logs in again by itself when a call fails with NotAuthenticated.
+    """
+    def __init__(self, pool, stub):
+        self.pool = pool
+        self.stub = stub
+        self.si = vim.ServiceInstance('ServiceInstance', stub)
+        self.logins = 0
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    @property
+    def content(self) -> vim.ServiceInstanceContent:
+        """
+        ServiceContent of the session, retrieved once
+        """
+        return get_content(self.si)
+
+    def logged_in(self):
+        # Called by the stub under its login lock: no calls to the server here.
+        # The server-side objects of the previous session, like views and collectors, are gone.
+        self.logins += 1
+        if self.logins > 1:
+            connection_state(self.stub).reset_session()
+
+    def keepalive(self):
+        """
+        Touch the session on the server, logging in again if it expired
+        """
+        if self.content.sessionManager.currentSession is None:
+            # The stub reads and changes its state under its lock
+            with self.stub.lock:
+                self.stub.state = self.stub.STATE_UNAUTHENTICATED
+            self.content.sessionManager.currentSession
+
+    def logout(self):
+        """
+        Logout the session and close its connections
+        """
+        self.closed = True
+        try:
+            if self.logins and self.stub.state == self.stub.STATE_AUTHENTICATED:
+                self.content.sessionManager.Logout()
+        except Exception:
+            # Already expired
+            pass
+        self.stub.soapStub.DropConnections()
+
+
+class SessionPool:
+    """
+    Thread-safe pool of sessions to a vCenter.
+    Each thread is bound to a session, the threads are spread over at most max_sessions sessions.
+    A background thread keeps the sessions alive and logs out the ones idle for idle_timeout.
+    A pool can be passed to every helper in place of si: it answers RetrieveContent() and
+    the SOAP calls with the session of the calling thread.
+    """
+    def __init__(self, host: str, user: str, pwd: str, port: int = 443,
+                 max_sessions: int = MAX_SESSIONS, keepalive_interval: float = KEEPALIVE_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT, **connect_args):
+        """
+        :param host: vCenter Server
+        :param user: username
+        :param pwd: password
+        :param port: port of the vCenter Server
+        :param max_sessions: max number of sessions
+        :param keepalive_interval: seconds between two keepalive rounds
+        :param idle_timeout: seconds a session can stay unused before it is logged out
+        :param connect_args: other arguments of connect.SmartStubAdapter, like sslContext or
+            disableSslCertValidation
+        """
+        self.host = host
+        self.user = user
+        self.port = port
+        self.max_sessions = max_sessions
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self._pwd = pwd
+        self._connect_args = connect_args
+        self._lock = threading.Lock()
+        self._opened = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._sessions = []
+        self._opening = 0
+        self._next = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def _open(self) -> PooledSession:
+        soap_stub = connect.SmartStubAdapter(host=self.host, port=self.port, **self._connect_args)
+        login = connect.VimSessionOrientedStub.makeUserLoginMethod(self.user, self._pwd)
+
+        def _login(stub):
+            login(stub)
+            session.logged_in()
+
+        session = PooledSession(self, connect.VimSessionOrientedStub(soap_stub, _login))
+        return session
+
+    def _acquire(self) -> PooledSession:
+        session = getattr(self._local, 'session', None)
+        if session is not None and not session.closed:
+            session.last_used = time.monotonic()
+            return session
+
+        session = None
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("SessionPool closed")
+                self._sessions = [s for s in self._sessions if not s.closed]
+                if len(self._sessions) + self._opening < self.max_sessions:
+                    # A free slot: the session is opened outside the lock
+                    self._opening += 1
+                    break
+                if self._sessions:
+                    session = self._sessions[next(self._next) % len(self._sessions)]
+                    session.last_used = time.monotonic()
+                    break
+                # Every slot is being opened by another thread
+                self._opened.wait()
+
+        if session is None:
+            try:
+                session = self._open()
+            except BaseException:
+                with self._lock:
+                    self._opening -= 1
+                    self._opened.notify_all()
+                raise
+            with self._lock:
+                self._opening -= 1
+                self._opened.notify_all()
+                closed = self._closed
+                if not closed:
+                    session.last_used = time.monotonic()
+                    self._sessions.append(session)
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name="vcs-session-pool", daemon=True)
+                        self._thread.start()
+            if closed:
+                session.logout()
+                raise RuntimeError("SessionPool closed")
+
+        self._local.session = session
+        return session
+
+    def service_instance(self) -> vim.ServiceInstance:
+        """
+        Get the ServiceInstance of the session bound to the calling thread
+        :return: the ServiceInstance, logged in at the first call
+        """
+        return self._acquire().si
+
+    @contextmanager
+    def session(self):
+        """
+        Use the session of the calling thread in a with block
+        :return: the ServiceInstance
+        """
+        yield self.service_instance()
+
+    def RetrieveContent(self) -> vim.ServiceInstanceContent:
+        """
+        Get the ServiceContent of the session of the calling thread, retrieved once per session
+        :return: the ServiceContent
+        """
+        return self._acquire().content
+
+    @property
+    def _stub(self):
+        # The helpers reach the SOAP stub of si: hand out the one of the calling thread
+        return self._acquire().stub
+
+    @property
+    def sessions(self) -> int:
+        """
+        Number of open sessions
+        """
+        with self._lock:
+            return len([s for s in self._sessions if not s.closed])
+
+    def _run(self):
+        while not self._stop.wait(self.keepalive_interval):
+            now = time.monotonic()
+            with self._lock:
+                sessions = list(self._sessions)
+            for session in sessions:
+                if session.closed or not session.logins:
+                    continue
+                if now - session.last_used > self.idle_timeout:
+                    with self._lock:
+                        if session in self._sessions:
+                            self._sessions.remove(session)
+                    session.logout()
+                    continue
+                try:
+                    session.keepalive()
+                except Exception:
+                    # Retried at the next round, or by the stub at the next call
+                    pass
+
+    def close(self):
+        """
+        Stop the keepalive thread and logout all the sessions
+        """
+        with self._lock:
+            self._closed = True
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._opened.notify_all()
+        self._stop.set()
+        for session in sessions:
+            state = connection_state(session.stub)
+            if state.tasks is not None:
+                state.tasks.close()
+            if state.views is not None:
+                state.views.close()
+            session.logout()
+        if self._thread is not None:
+            self._thread.join(self.keepalive_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_pool(host: str, user: str, pwd: str, port: int = 443, **pool_args) -> SessionPool:
+    """
+    Get the shared SessionPool of a vCenter, creating it if needed
+    :param host: vCenter Server
+    :param user: username
+    :param pwd: password
+    :param port: port of the vCenter Server
+    :param pool_args: other arguments of SessionPool, used when the pool is created
+    :return: the SessionPool
+    """
+    key = (host, port, user)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = SessionPool(host, user, pwd, port, **pool_args)
+            _pools[key] = pool
+        return pool
+
+
+def close_pools():
+    """
+    Close all the shared SessionPools
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,293 @@
+import abc
+import csv
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from vCenterScripter.common import *
+from vCenterScripter.logger import Logger, plain_value, print_
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Rows buffered by the columnar writers before a batch is written
+EXPORT_BATCH_SIZE = 10000
+
+
+class ExportColumn(NamedTuple):
+    """
+    A column of the export: the value of the property path of each object
+    """
+    name: str
+    path: str
+    kind: str = 'string'
+
+
+# Columns exported for each type: the fields of print_vm_info and print_host_info
+EXPORT_COLUMNS = {
+    vim.VirtualMachine: [
+        ExportColumn('name', 'summary.config.name'),
+        ExportColumn('path', 'summary.config.vmPathName'),
+        ExportColumn('guest', 'summary.config.guestFullName'),
+        ExportColumn('instance_uuid', 'summary.config.instanceUuid'),
+        ExportColumn('bios_uuid', 'summary.config.uuid'),
+        ExportColumn('cpu', 'summary.config.numCpu', 'int'),
+        ExportColumn('ram_mb', 'summary.config.memorySizeMB', 'int'),
+        ExportColumn('vdisks', 'summary.config.numVirtualDisks', 'int'),
+        ExportColumn('eth_cards', 'summary.config.numEthernetCards', 'int'),
+        ExportColumn('annotation', 'summary.config.annotation'),
+        ExportColumn('power_state', 'summary.runtime.powerState'),
+        ExportColumn('host', 'summary.runtime.host'),
+        ExportColumn('tools_status', 'summary.guest.toolsStatus'),
+        ExportColumn('ip', 'summary.guest.ipAddress'),
+    ],
+    vim.HostSystem: [
+        ExportColumn('name', 'summary.config.name'),
+        ExportColumn('boot_time', 'summary.runtime.bootTime', 'timestamp'),
+        ExportColumn('power_state', 'summary.runtime.powerState'),
+        ExportColumn('maintenance', 'summary.runtime.inMaintenanceMode', 'bool'),
+        ExportColumn('status', 'overallStatus'),
+        ExportColumn('parent', 'parent'),
+        ExportColumn('nics', 'summary.hardware.numNics', 'int'),
+        ExportColumn('management_ip', 'summary.managementServerIp'),
+        ExportColumn('fault_tolerance', 'summary.config.faultToleranceEnabled', 'bool'),
+        ExportColumn('vmotion', 'summary.config.vmotionEnabled', 'bool'),
+        ExportColumn('cpu_model', 'summary.hardware.cpuModel'),
+        ExportColumn('cpu_cores', 'summary.hardware.numCpuCores', 'int'),
+        ExportColumn('cpu_threads', 'summary.hardware.numCpuThreads', 'int'),
+        ExportColumn('cpu_mhz', 'summary.hardware.cpuMhz', 'int'),
+        ExportColumn('cpu_used_mhz', 'summary.quickStats.overallCpuUsage', 'int'),
+        ExportColumn('ram_bytes', 'summary.hardware.memorySize', 'int'),
+        ExportColumn('ram_used_mb', 'summary.quickStats.overallMemoryUsage', 'int'),
+    ],
+    vim.Datastore: [
+        ExportColumn('name', 'summary.name'),
+        ExportColumn('type', 'summary.type'),
+        ExportColumn('url', 'summary.url'),
+        ExportColumn('capacity', 'summary.capacity', 'int'),
+        ExportColumn('free_space', 'summary.freeSpace', 'int'),
+        ExportColumn('uncommitted', 'summary.uncommitted', 'int'),
+        ExportColumn('accessible', 'summary.accessible', 'bool'),
+        ExportColumn('maintenance', 'summary.maintenanceMode'),
+    ],
+}
+
+# File name of the export of each type
+EXPORT_NAMES = {
+    vim.VirtualMachine: 'vm',
+    vim.HostSystem: 'host',
+    vim.Datastore: 'datastore',
+}
+
+
+def iter_rows(si: vim.ServiceInstance, columns: Dict[vim.ManagedEntity, List[ExportColumn]] = None,
+              page_size: int = RETRIEVE_PAGE_SIZE) -> Iterator[Tuple[vim.ManagedEntity, dict]]:
+    """
+    Read the columns of every object of the types in a single paged PropertyCollector pass.
+    Only a page of objects is kept in memory at a time.
+    :param si: Connection to vCenter Server
+    :param columns: {type: [ExportColumn]}. Standard EXPORT_COLUMNS
+    :param page_size: max number of objects returned by each page
+    :return: an iterator of (type, row). Each row is a dict {'moid': moId, column: value}.
+    """
+    if columns is None:
+        columns = EXPORT_COLUMNS
+    path_sets = {type_obj: [column.path for column in type_columns] for type_obj, type_columns in columns.items()}
+
+    for obj, props in iter_properties_of_types(si, path_sets, page_size=page_size):
+        type_obj = next(type_obj for type_obj in columns if isinstance(obj, type_obj))
+        row = {'moid': obj._moId}
+        for column in columns[type_obj]:
+            row[column.name] = plain_value(props.get(column.path))
+        yield type_obj, row
+
+
+class CsvWriter:
+    """
+    Write rows to a CSV file
+    """
+    extension = 'csv'
+
+    def __init__(self, path: str, columns: List[ExportColumn]):
+        """
+        :param path: path of the file
+        :param columns: columns of the rows
+        """
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, ['moid'] + [column.name for column in columns])
+        self.writer.writeheader()
+
+    def write(self, row: dict):
+        self.writer.writerow({name: value.isoformat() if isinstance(value, datetime) else value
+                              for name, value in row.items()})
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesWriter:
+    """
+    Write rows to a JSON Lines file, one object per line
+    """
+    extension = 'jsonl'
+
+    def __init__(self, path: str, columns: List[ExportColumn]):
+        """
+        :param path: path of the file
+        :param columns: columns of the rows
+        """
+        self.file = open(path, 'w')
+
+    def write(self, row: dict):
+        self.file.write(json.dumps(row, default=lambda value: value.isoformat()))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarWriter(abc.ABC):
+    """
+    Write rows to an Arrow IPC or Parquet file, a batch of batch_size rows at a time.
+    Requires pyarrow. The subclasses open the file in _open.
+    """
+    def __init__(self, path: str, columns: List[ExportColumn], batch_size: int = EXPORT_BATCH_SIZE):
+        """
+        :param path: path of the file
+        :param columns: columns of the rows
+        :param batch_size: rows kept in memory before a batch is written
+        """
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to export to %s" % self.extension)
+        kinds = {
+            'string': pyarrow.string(),
+            'int': pyarrow.int64(),
+            'float': pyarrow.float64(),
+            'bool': pyarrow.bool_(),
+            'timestamp': pyarrow.timestamp('us', tz='UTC'),
+        }
+        self.schema = pyarrow.schema([pyarrow.field('moid', pyarrow.string())] +
+                                     [pyarrow.field(column.name, kinds[column.kind]) for column in columns])
+        self.batch_size = batch_size
+        self._batch = {name: [] for name in self.schema.names}
+        self._rows = 0
+        self._writer = self._open(path)
+
+    @abc.abstractmethod
+    def _open(self, path: str):
+        """
+        Open the file
+        :param path: path of the file
+        :return: the pyarrow writer, with write_table() and close()
+        """
+
+    def write(self, row: dict):
+        for name, values in self._batch.items():
+            values.append(row.get(name))
+        self._rows += 1
+        if self._rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows kept in memory
+        """
+        if not self._rows:
+            return
+        self._writer.write_table(pyarrow.Table.from_pydict(self._batch, schema=self.schema))
+        self._batch = {name: [] for name in self.schema.names}
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+class ArrowWriter(ColumnarWriter):
+    """
+    Write rows to an Arrow IPC file
+    """
+    extension = 'arrow'
+
+    def _open(self, path: str):
+        return pyarrow.ipc.new_file(path, self.schema)
+
+
+class ParquetWriter(ColumnarWriter):
+    """
+    Write rows to a Parquet file
+    """
+    extension = 'parquet'
+
+    def _open(self, path: str):
+        return pyarrow.parquet.ParquetWriter(path, self.schema)
+
+
+# Writer of each export format
+EXPORT_FORMATS = {
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter,
+    'arrow': ArrowWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def available_formats() -> List[str]:
+    """
+    Get the export formats usable in this environment
+    :return: a list of formats, 'arrow' and 'parquet' only if pyarrow is installed
+    """
+    return [name for name, writer in EXPORT_FORMATS.items()
+            if pyarrow is not None or not issubclass(writer, ColumnarWriter)]
+
+
+def export_inventory(si: vim.ServiceInstance, directory: str, formats: tuple = ('csv', 'jsonl'),
+                     columns: Dict[vim.ManagedEntity, List[ExportColumn]] = None,
+                     page_size: int = RETRIEVE_PAGE_SIZE, logger: Logger = None) -> Dict[vim.ManagedEntity, int]:
+    """
+    Export a snapshot of the inventory: a file for each type and format, like vm.csv or host.parquet.
+    The rows are streamed to the files while the pages are read, the memory used doesn't
+    grow with the size of the inventory.
+    :param si: Connection to vCenter Server
+    :param directory: directory of the files
+    :param formats: formats to write, among 'csv', 'jsonl', 'arrow' and 'parquet'
+    :param columns: {type: [ExportColumn]}. Standard EXPORT_COLUMNS
+    :param page_size: max number of objects returned by each page
+    :param logger: Logger
+    :return: a dict {type: number of rows}
+    """
+    if columns is None:
+        columns = EXPORT_COLUMNS
+    for export_format in formats:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError("Unknown export format %r" % export_format)
+    os.makedirs(directory, exist_ok=True)
+
+    writers = {}
+    counts = {type_obj: 0 for type_obj in columns}
+    try:
+        for type_obj, type_columns in columns.items():
+            name = EXPORT_NAMES.get(type_obj, type_obj.__name__.split('.')[-1].lower())
+            writers[type_obj] = []
+            for export_format in formats:
+                writer = EXPORT_FORMATS[export_format]
+                path = os.path.join(directory, "%s.%s" % (name, writer.extension))
+                writers[type_obj].append(writer(path, type_columns))
+
+        for type_obj, row in iter_rows(si, columns, page_size):
+            for writer in writers[type_obj]:
+                writer.write(row)
+            counts[type_obj] += 1
+    finally:
+        for type_writers in writers.values():
+            for writer in type_writers:
+                writer.close()
+
+    print_("Export: %s." % ", ".join("%d %s" % (count, EXPORT_NAMES.get(type_obj, type_obj.__name__))
+                                     for type_obj, count in counts.items()), logger)
+    return counts
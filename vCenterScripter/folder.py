@@ -1,6 +1,6 @@
-from pyvim.task import WaitForTask
-
 from vCenterScripter.common import *
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.tasks import wait_task
 
 
 def list_folder_names(si: vim.ServiceInstance) -> set:
@@ -30,6 +30,8 @@ def create_folder(parent_folder: vim.Folder, folder_name: str):
     :return the newly created folder
     """
     folder = parent_folder.CreateFolder(folder_name)
+    # The name may have been remembered as missing
+    invalidate_inventory(parent_folder, vim.Folder)
     return folder
 
 
@@ -40,4 +42,7 @@ def move_to_folder_vm(virtual_machine: vim.VirtualMachine, dest_folder: vim.Fold
     :param dest_folder: Destination folder
     """
     task = dest_folder.MoveIntoFolder_Task([virtual_machine])
-    WaitForTask(task)
+    wait_task(task)
+
+
+instrument_module(__name__)
@@ -0,0 +1,524 @@
+import http.client
+import os
+import ssl
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from vCenterScripter.common import *
+
+# Polling intervals of the guest processes: fast at first, then slower
+INITIAL_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 5.0
+POLL_BACKOFF_FACTOR = 2.0
+# Seconds a PID can be missing from ListProcessesInGuest before it is reported completed
+MISSING_PROCESS_SECONDS = 10.0
+
+
+class ProcessResult(NamedTuple):
+    """
+    A process completed inside a guest.
+    Only pid is set for a process that the guest no longer lists: its exit code is unknown.
+    """
+    pid: int
+    name: str
+    cmd_line: str
+    exit_code: int
+    start_time: datetime
+    end_time: datetime
+    duration: float
+
+
+def process_result(proc: vim.vm.guest.ProcessManager.ProcessInfo) -> ProcessResult:
+    """
+    Build the ProcessResult of a completed process
+    :param proc: the ProcessInfo returned by ListProcessesInGuest
+    :return: the ProcessResult. duration is in seconds
+    """
+    duration = None
+    if proc.startTime is not None and proc.endTime is not None:
+        duration = (proc.endTime - proc.startTime).total_seconds()
+    return ProcessResult(proc.pid, proc.name, proc.cmdLine, proc.exitCode, proc.startTime, proc.endTime, duration)
+
+
+def unknown_process_result(pid: int) -> ProcessResult:
+    """
+    Build the ProcessResult of a process known only by its PID, like one that the guest no longer lists
+    :param pid: the PID
+    :return: the ProcessResult, with an unknown exit code
+    """
+    return ProcessResult(pid, None, None, None, None, None, None)
+
+
+def backoff_intervals(initial: float = INITIAL_POLL_INTERVAL,
+                      maximum: float = MAX_POLL_INTERVAL,
+                      factor: float = POLL_BACKOFF_FACTOR) -> Iterator[float]:
+    """
+    Polling intervals growing from initial to maximum
+    :param initial: first interval in seconds
+    :param maximum: max interval in seconds
+    :param factor: growth factor of each interval
+    :return: an endless iterator of intervals
+    """
+    interval = initial
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+
+class GuestProcessWaiter:
+    """
+    Wait for the processes of a VM.
+    All the PIDs still running are checked with a single ListProcessesInGuest call per poll,
+    polling fast at first and slower over time. A PID missing from the polls for missing_seconds,
+    for example after a reboot of the guest, is reported completed with an unknown exit code.
+    """
+    def __init__(self, process_manager: vim.vm.guest.ProcessManager,
+                 virtual_machine: vim.VirtualMachine,
+                 credentials: vim.vm.guest.NamePasswordAuthentication,
+                 initial_interval: float = INITIAL_POLL_INTERVAL,
+                 max_interval: float = MAX_POLL_INTERVAL,
+                 missing_seconds: float = MISSING_PROCESS_SECONDS):
+        """
+        :param process_manager: guestOperationsManager.processManager of the vCenter
+        :param virtual_machine: The virtual Machine
+        :param credentials: The credentials of the VM
+        :param initial_interval: first polling interval in seconds
+        :param max_interval: max polling interval in seconds
+        :param missing_seconds: seconds a PID can be missing from the polls before it is reported completed
+        """
+        self.process_manager = process_manager
+        self.virtual_machine = virtual_machine
+        self.credentials = credentials
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.missing_seconds = missing_seconds
+        self._missing = {}
+
+    def poll(self, pids: List[int]) -> Dict[int, vim.vm.guest.ProcessManager.ProcessInfo]:
+        """
+        Get the state of many processes with a single ListProcessesInGuest call
+        :param pids: the PIDs
+        :return: a dict {pid: ProcessInfo}
+        """
+        processes = self.process_manager.ListProcessesInGuest(self.virtual_machine, self.credentials, list(pids))
+        return {proc.pid: proc for proc in processes or []}
+
+    def completed(self, pids: List[int],
+                  processes: Dict[int, vim.vm.guest.ProcessManager.ProcessInfo]) -> List[ProcessResult]:
+        """
+        Get the processes completed among the PIDs of a poll
+        :param pids: the PIDs polled
+        :param processes: the result of poll(pids)
+        :return: list of ProcessResult, also the ones of the PIDs missing for too long
+        """
+        results = []
+        for pid in pids:
+            proc = processes.get(pid)
+            if proc is not None:
+                self._missing.pop(pid, None)
+                if proc.endTime is not None:
+                    results.append(process_result(proc))
+                continue
+            missing_since = self._missing.setdefault(pid, time.monotonic())
+            if time.monotonic() - missing_since >= self.missing_seconds:
+                del self._missing[pid]
+                results.append(unknown_process_result(pid))
+        return results
+
+    def iter_completed(self, pids: List[int], timeout: float = None) -> Iterator[ProcessResult]:
+        """
+        Yield each process as soon as it completes
+        :param pids: the PIDs
+        :param timeout: max seconds to wait. None to wait forever
+        :return: an iterator of ProcessResult. It stops at timeout, even if some processes are still running
+        """
+        running = set(pids)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        intervals = backoff_intervals(self.initial_interval, self.max_interval)
+
+        while running:
+            pids = list(running)
+            for result in self.completed(pids, self.poll(pids)):
+                running.discard(result.pid)
+                yield result
+            if not running:
+                break
+
+            interval = next(intervals)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                interval = min(interval, remaining)
+            time.sleep(interval)
+
+    def wait(self, pids: List[int], timeout: float = None) -> Dict[int, ProcessResult]:
+        """
+        Wait for all the processes to complete
+        :param pids: the PIDs
+        :param timeout: max seconds to wait. None to wait forever
+        :return: a dict {pid: ProcessResult}
+        :raise TimeoutError: if some processes are still running at timeout
+        """
+        results = {result.pid: result for result in self.iter_completed(pids, timeout)}
+        running = set(pids) - set(results)
+        if running:
+            raise TimeoutError("Guest processes %s still running after %s seconds" % (sorted(running), timeout))
+        return results
+
+
+def wait_for_processes(si: vim.ServiceInstance,
+                       virtual_machine: vim.VirtualMachine,
+                       credentials: vim.vm.guest.NamePasswordAuthentication,
+                       pids: List[int],
+                       timeout: float = None) -> Dict[int, ProcessResult]:
+    """
+    Wait for processes running inside the VM, using VMware Tools
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param pids: the PIDs
+    :param timeout: max seconds to wait. None to wait forever
+    :return: a dict {pid: ProcessResult}
+    :raise TimeoutError: if some processes are still running at timeout
+    """
+    process_manager = get_process_manager(si)
+    return GuestProcessWaiter(process_manager, virtual_machine, credentials).wait(pids, timeout)
+
+
+# Size of the chunks streamed by the guest file transfers
+TRANSFER_CHUNK_SIZE = 1 << 20
+
+
+class TransferStats(NamedTuple):
+    """
+    Statistics of a guest file transfer
+    """
+    guest_path: str
+    bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second
+        """
+        return self.bytes / self.seconds if self.seconds else float(self.bytes)
+
+
+class HttpConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections, reused by the guest file transfers
+    """
+    def __init__(self, ssl_context: ssl.SSLContext = None, timeout: float = 60, max_idle: int = 16):
+        """
+        :param ssl_context: SSLContext of the HTTPS connections. Standard the verifying default context:
+            pass ssl._create_unverified_context() for ESXi hosts with self-signed certificates
+        :param timeout: socket timeout in seconds
+        :param max_idle: max number of idle connections kept for each host
+        """
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def acquire(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """
+        Get an idle connection to netloc, or a new one
+        :param scheme: 'http' or 'https'
+        :param netloc: host:port
+        :return: the connection
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection):
+        """
+        Give back a connection whose response was fully read
+        :param scheme: 'http' or 'https'
+        :param netloc: host:port
+        :param connection: the connection
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close all the idle connections
+        """
+        with self._lock:
+            idle = [connection for connections in self._idle.values() for connection in connections]
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HttpConnectionPool:
+    """
+    Get the HttpConnectionPool shared by the guest file transfers, creating it if needed
+    :return: the HttpConnectionPool
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = HttpConnectionPool()
+        return _default_pool
+
+
+def _transfer_url(si: vim.ServiceInstance, url: str, host: str = None):
+    # The ESXi may answer with '*' as host: it stands for the host the client connected to
+    parsed = urllib.parse.urlsplit(url)
+    netloc = parsed.netloc
+    if host is None:
+        # A session stub, like the ones of a SessionPool, wraps the SOAP stub. Its host is host:port,
+        # or [address]:port for IPv6
+        stub = getattr(si._stub, 'soapStub', si._stub)
+        host = urllib.parse.urlsplit('//' + getattr(stub, 'host', '')).hostname
+    if parsed.hostname == '*' and host:
+        if ':' in host and not host.startswith('['):
+            host = '[%s]' % host
+        netloc = netloc.replace('*', host, 1)
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    return parsed.scheme, netloc, path
+
+
+def _iter_chunks(source, chunk_size: int) -> Iterator[bytes]:
+    if isinstance(source, (bytes, bytearray)):
+        for i in range(0, len(source), chunk_size):
+            yield bytes(source[i:i + chunk_size])
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def _request(pool: HttpConnectionPool, scheme: str, netloc: str, method: str, path: str,
+             body: Iterator[bytes] = None, size: int = None) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    connection = pool.acquire(scheme, netloc)
+    try:
+        connection.putrequest(method, path, skip_accept_encoding=True)
+        if body is not None:
+            connection.putheader('Content-Length', str(size))
+            connection.putheader('Content-Type', 'application/octet-stream')
+        connection.endheaders()
+        if body is not None:
+            for chunk in body:
+                connection.send(chunk)
+        response = connection.getresponse()
+    except Exception:
+        connection.close()
+        raise
+    if response.status >= 300:
+        response.read()
+        connection.close()
+        raise http.client.HTTPException("%s %s: %d %s" % (method, path, response.status, response.reason))
+    return connection, response
+
+
+def upload_file_to_guest(si: vim.ServiceInstance,
+                         virtual_machine: vim.VirtualMachine,
+                         credentials: vim.vm.guest.NamePasswordAuthentication,
+                         source,
+                         guest_path: str,
+                         size: int = None,
+                         overwrite: bool = True,
+                         file_attributes: vim.vm.guest.FileManager.FileAttributes = None,
+                         host: str = None,
+                         pool: HttpConnectionPool = None,
+                         chunk_size: int = TRANSFER_CHUNK_SIZE) -> TransferStats:
+    """
+    Upload a file inside the VM using VMware Tools, streaming it without loading it in memory
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param source: local path, file-like object, bytes or iterator of bytes chunks
+    :param guest_path: Destination path inside the guest
+    :param size: size in bytes. Needed only for iterators of chunks and not seekable files
+    :param overwrite: True to overwrite an existing file
+    :param file_attributes: attributes of the new file. Standard none
+    :param host: host name replacing '*' in the transfer URL. Standard the vCenter host
+    :param pool: HttpConnectionPool. Standard the shared one
+    :param chunk_size: size of the streamed chunks
+    :return: the TransferStats
+    """
+    opened = None
+    if isinstance(source, str):
+        opened = source = open(source, 'rb')
+    try:
+        if size is None:
+            if isinstance(source, (bytes, bytearray)):
+                size = len(source)
+            elif hasattr(source, 'seekable') and source.seekable():
+                position = source.tell()
+                size = source.seek(0, os.SEEK_END) - position
+                source.seek(position)
+            else:
+                raise ValueError("size is needed to upload an iterator of chunks or a not seekable file")
+
+        file_manager = get_file_manager(si)
+        if file_attributes is None:
+            file_attributes = vim.vm.guest.FileManager.FileAttributes()
+        url = file_manager.InitiateFileTransferToGuest(virtual_machine, credentials, guest_path,
+                                                       file_attributes, size, overwrite)
+
+        pool = pool or get_http_pool()
+        scheme, netloc, path = _transfer_url(si, url, host)
+        start = time.monotonic()
+        connection, response = _request(pool, scheme, netloc, 'PUT', path, _iter_chunks(source, chunk_size), size)
+        response.read()
+        pool.release(scheme, netloc, connection)
+        return TransferStats(guest_path, size, time.monotonic() - start)
+    finally:
+        if opened is not None:
+            opened.close()
+
+
+def iter_download_from_guest(si: vim.ServiceInstance,
+                             virtual_machine: vim.VirtualMachine,
+                             credentials: vim.vm.guest.NamePasswordAuthentication,
+                             guest_path: str,
+                             host: str = None,
+                             pool: HttpConnectionPool = None,
+                             chunk_size: int = TRANSFER_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Stream a file out of the VM using VMware Tools
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param guest_path: Path of the file inside the guest
+    :param host: host name replacing '*' in the transfer URL. Standard the vCenter host
+    :param pool: HttpConnectionPool. Standard the shared one
+    :param chunk_size: size of the streamed chunks
+    :return: an iterator of bytes chunks
+    """
+    file_manager = get_file_manager(si)
+    info = file_manager.InitiateFileTransferFromGuest(virtual_machine, credentials, guest_path)
+
+    pool = pool or get_http_pool()
+    scheme, netloc, path = _transfer_url(si, info.url, host)
+    connection, response = _request(pool, scheme, netloc, 'GET', path)
+    try:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    except BaseException:
+        connection.close()
+        raise
+    pool.release(scheme, netloc, connection)
+
+
+def download_file_from_guest(si: vim.ServiceInstance,
+                             virtual_machine: vim.VirtualMachine,
+                             credentials: vim.vm.guest.NamePasswordAuthentication,
+                             guest_path: str,
+                             destination,
+                             host: str = None,
+                             pool: HttpConnectionPool = None,
+                             chunk_size: int = TRANSFER_CHUNK_SIZE) -> TransferStats:
+    """
+    Download a file from the VM using VMware Tools, streaming it without loading it in memory
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param guest_path: Path of the file inside the guest
+    :param destination: local path or writable file-like object
+    :param host: host name replacing '*' in the transfer URL. Standard the vCenter host
+    :param pool: HttpConnectionPool. Standard the shared one
+    :param chunk_size: size of the streamed chunks
+    :return: the TransferStats
+    """
+    opened = None
+    if isinstance(destination, str):
+        opened = destination = open(destination, 'wb')
+    try:
+        start = time.monotonic()
+        size = 0
+        for chunk in iter_download_from_guest(si, virtual_machine, credentials, guest_path, host, pool, chunk_size):
+            destination.write(chunk)
+            size += len(chunk)
+        return TransferStats(guest_path, size, time.monotonic() - start)
+    finally:
+        if opened is not None:
+            opened.close()
+
+
+class GuestTransfer(NamedTuple):
+    """
+    A file transfer of transfer_many.
+    direction is 'upload' (local -> guest_path) or 'download' (guest_path -> local).
+    size is needed only to upload iterators of chunks
+    """
+    direction: str
+    vm: vim.VirtualMachine
+    credentials: vim.vm.guest.NamePasswordAuthentication
+    guest_path: str
+    local: object
+    size: int = None
+
+
+class TransferResult(NamedTuple):
+    """
+    Outcome of a GuestTransfer
+    """
+    transfer: GuestTransfer
+    stats: TransferStats
+    error: Exception
+
+
+def transfer_many(si: vim.ServiceInstance,
+                  transfers: List[GuestTransfer],
+                  max_concurrency: int = 8,
+                  host: str = None,
+                  pool: HttpConnectionPool = None) -> List[TransferResult]:
+    """
+    Run many guest file transfers in parallel, over the pooled HTTP connections
+    :param si: Connection to Vcenter
+    :param transfers: list of GuestTransfer
+    :param max_concurrency: max number of transfers running at the same time
+    :param host: host name replacing '*' in the transfer URLs. Standard the vCenter host
+    :param pool: HttpConnectionPool. Standard the shared one
+    :return: a TransferResult for each transfer, in the same order of transfers
+    """
+    def run(transfer: GuestTransfer) -> TransferResult:
+        try:
+            if transfer.direction == 'upload':
+                stats = upload_file_to_guest(si, transfer.vm, transfer.credentials, transfer.local,
+                                             transfer.guest_path, size=transfer.size, host=host, pool=pool)
+            elif transfer.direction == 'download':
+                stats = download_file_from_guest(si, transfer.vm, transfer.credentials, transfer.guest_path,
+                                                 transfer.local, host=host, pool=pool)
+            else:
+                raise ValueError("Unknown direction %r" % transfer.direction)
+        except Exception as e:
+            return TransferResult(transfer, None, e)
+        return TransferResult(transfer, stats, None)
+
+    with ThreadPoolExecutor(max_concurrency, thread_name_prefix="vcs-transfer") as executor:
+        return list(executor.map(run, transfers))
@@ -1,6 +1,10 @@
 
+import threading
+import time
+
 from vCenterScripter.common import *
 from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
 
 
 def list_host(si: vim.ServiceInstance) -> set:
@@ -30,6 +34,7 @@ def refresh_host(si: vim.ServiceInstance, host: vim.HostSystem) -> vim.HostSyste
     :return: The new Host
     """
     name = host.config.name
+    forget_object(host)
     del host
     return get_host(si, name)
 
@@ -56,28 +61,139 @@ def exit_maintenance(host: vim.HostSystem,  logger: Logger = None):
     print_("Host: exiting maintenance mode.", logger)
 
 
-def list_resource_pool_host(si: vim.ServiceInstance, host: vim.HostSystem) -> set:
+class ResourcePoolIndex:
+    """
+    Snapshot of the Resource Pools of a connection, indexed by owner ComputeResource or cluster
+    and by HostSystem. It is built with a single property retrieval, the lookups don't hit the network.
+    """
+    def __init__(self, si: vim.ServiceInstance, miss_ttl: float = MISS_TTL):
+        """
+        :param si: Connection to vCenter Server
+        :param miss_ttl: min seconds between two loads caused by missing hosts or pools
+        """
+        self.si = si
+        self.miss_ttl = miss_ttl
+        self.loaded = None
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._owners = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Load again the Resource Pools and the hosts of each ComputeResource
+        """
+        with self._lock:
+            self._load()
+
+    def refresh_on_miss(self) -> bool:
+        """
+        Load again the Resource Pools after a lookup missed, unless they were loaded in the last
+        miss_ttl seconds: the threads missing at the same time share a single load
+        :return: True if loaded again
+        """
+        with self._lock:
+            if time.monotonic() - self.loaded < self.miss_ttl:
+                return False
+            self._load()
+            return True
+
+    def _load(self):
+        pools = {}
+        owners = {}
+        path_sets = {vim.ResourcePool: ['name', 'owner'], vim.ComputeResource: ['host']}
+        for obj, props in iter_properties_of_types(self.si, path_sets):
+            if isinstance(obj, vim.ResourcePool):
+                pools.setdefault(props.get('owner'), {}).setdefault(props.get('name'), []).append(obj)
+            else:
+                for host in props.get('host', []):
+                    owners[host] = obj
+        self._pools = pools
+        self._owners = owners
+        self.loaded = time.monotonic()
+
+    def owner(self, host: vim.HostSystem) -> vim.ComputeResource:
+        """
+        Get the ComputeResource or the cluster of a host
+        :param host: Host
+        :return: the ComputeResource, None if the host is unknown
+        """
+        return self._owners.get(host)
+
+    def pools(self, owner) -> dict:
+        """
+        Get the Resource Pools of a host or a ComputeResource
+        :param owner: Host, ComputeResource or cluster
+        :return: a dict {name: [Resource Pools]}
+        """
+        if isinstance(owner, vim.HostSystem):
+            owner = self._owners.get(owner)
+        return self._pools.get(owner, {})
+
+    def get(self, owner, name: str) -> vim.ResourcePool:
+        """
+        Get the "name" Resource Pool of a host or a ComputeResource
+        :param owner: Host, ComputeResource or cluster
+        :param name: Name of the Resource Pool
+        :return: the Resource Pool, None if not found
+        """
+        pools = self.pools(owner).get(name)
+        return pools[0] if pools else None
+
+
+def get_resource_pool_index(si: vim.ServiceInstance, refresh: bool = False) -> ResourcePoolIndex:
+    """
+    Get the ResourcePoolIndex of the connection, building it if needed
+    :param si: Connection to vCenter Server
+    :param refresh: True to load again the Resource Pools
+    :return: the ResourcePoolIndex
+    """
+    state = connection_state(si)
+    with state.lock:
+        index = state.indexes.get('resource_pools')
+    if index is None:
+        # Loaded outside the lock of the connection: the other caches stay available meanwhile
+        index = ResourcePoolIndex(si)
+        with state.lock:
+            index = state.indexes.setdefault('resource_pools', index)
+    elif refresh:
+        index.refresh()
+    return index
+
+
+def list_resource_pool_host(si: vim.ServiceInstance, host: vim.HostSystem,
+                            index: ResourcePoolIndex = None) -> set:
     """
     Get names of the Resource Pools of a specific HostSystem.
     :param host: Host
     :param si: Connection to the vCenter.
+    :param index: ResourcePoolIndex to look into. Standard the one of the connection, loaded again if the host is unknown
     :return: a set of names of Resource pools where the host is present
     """
-    resources = list_obj(si, vim.ResourcePool)
-    set_names = set([pool.name for pool in resources if pool.owner.name == host.summary.config.name])
-    return set_names
+    if index is None:
+        index = get_resource_pool_index(si)
+        if index.owner(host) is None:
+            index.refresh_on_miss()
+    return set(index.pools(host))
 
 
-def get_resource_pool_host(si: vim.ServiceInstance, host: vim.HostSystem, name: str ="") -> vim.ResourcePool:
+def get_resource_pool_host(si: vim.ServiceInstance, host: vim.HostSystem, name: str ="",
+                           index: ResourcePoolIndex = None) -> vim.ResourcePool:
     """
     Get the "Name" resource pool of a specific HostSystem.
     :param si: Connection to the vCenter
     :param host: Host
     :param name: Name of the Resource Pool. Standard "Resources"
+    :param index: ResourcePoolIndex to look into. Standard the one of the connection, loaded again if the pool is not found
     :return: a resource pool
     """
-    resources = list_obj(si, vim.ResourcePool)
-    resource_pool = next((pool for pool in resources if pool.owner.name == host.summary.config.name and pool.name == name), None)
+    if index is not None:
+        return index.get(host, name)
+    index = get_resource_pool_index(si)
+    resource_pool = index.get(host, name)
+    if resource_pool is None and index.refresh_on_miss():
+        resource_pool = index.get(host, name)
     return resource_pool
 
 
+instrument_module(__name__)
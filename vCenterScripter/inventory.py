@@ -0,0 +1,239 @@
+import threading
+
+from vCenterScripter.common import *
+
+# Types kept by the cache when none are specified
+CACHED_TYPES = (vim.VirtualMachine, vim.HostSystem, vim.Datastore, vim.Folder)
+
+
+class InventoryCache(InventoryIndex):
+    """
+    Name index of a connection kept current by a background WaitForUpdatesEx loop.
+    The inventory is loaded once, then the enter/leave/modify updates of a filter over a
+    ContainerView are applied: lookups of the cached types never hit the network.
+    """
+    def __init__(self, si: vim.ServiceInstance, types: tuple = CACHED_TYPES,
+                 property_collector: vmodl.query.PropertyCollector = None,
+                 max_wait_seconds: int = 30):
+        """
+        :param si: Connection to vCenter Server
+        :param types: types to be cached
+        :param property_collector: PropertyCollector to wait on. Standard a new one of the session
+        :param max_wait_seconds: max duration of a single WaitForUpdatesEx call
+        """
+        super().__init__(si)
+        self.cached_types = tuple(types)
+        self.max_wait_seconds = max_wait_seconds
+        self.version = None
+        self.error = None
+        self.ready = threading.Event()
+
+        self._property_collector = property_collector
+        self._own_collector = property_collector is None
+        self._container_view = None
+        self._filter = None
+        self._names_of = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def start(self):
+        """
+        Load the inventory and start the background update loop
+        """
+        content = get_content(self.si)
+        if self._property_collector is None:
+            self._property_collector = content.propertyCollector.CreatePropertyCollector()
+        self._container_view = content.viewManager.CreateContainerView(
+            content.rootFolder, list(self.cached_types), True)
+        self._create_filter()
+
+        # A large inventory comes in more update sets: ready only once all of them are applied
+        while True:
+            update_set = self._wait_and_apply()
+            if update_set is None or not update_set.truncated:
+                break
+        self.ready.set()
+
+        self._thread = threading.Thread(target=self._run, name="vcs-inventory-cache", daemon=True)
+        self._thread.start()
+
+    def restarted(self) -> 'InventoryCache':
+        """
+        Build a cache of the same types for a new session of the connection, not started yet.
+        A PropertyCollector given by the caller is not reused: it belongs to the previous session.
+        :return: the new InventoryCache
+        """
+        return InventoryCache(self.si, self.cached_types, max_wait_seconds=self.max_wait_seconds)
+
+    def stop(self):
+        """
+        Stop the background update loop and destroy the server-side filter and view
+        """
+        self._stop.set()
+        if self._own_collector and self._property_collector is not None:
+            # A collector given by the caller may have other waiters: only the loop's own is cancelled
+            try:
+                self._property_collector.CancelWaitForUpdates()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(self.max_wait_seconds)
+
+        if self._filter is not None:
+            self._filter.DestroyPropertyFilter()
+            self._filter = None
+        if self._container_view is not None:
+            self._container_view.DestroyView()
+            self._container_view = None
+        if self._own_collector and self._property_collector is not None:
+            self._property_collector.DestroyPropertyCollector()
+            self._property_collector = None
+
+    def _create_filter(self):
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(
+            obj=self._container_view, skip=True, selectSet=[traversal_spec])
+        property_specs = [vmodl.query.PropertyCollector.PropertySpec(
+            type=type_obj, pathSet=[name_property(type_obj)], all=False) for type_obj in self.cached_types]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=property_specs)
+        self._filter = self._property_collector.CreateFilter(filter_spec, True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._wait_and_apply()
+            except vmodl.query.InvalidCollectorVersion:
+                # The session was re-established: start again from a full load
+                with self._lock:
+                    self.version = None
+                    self._reset()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self.error = e
+                self._stop.wait(self.max_wait_seconds)
+
+    def _wait_and_apply(self) -> vmodl.query.PropertyCollector.UpdateSet:
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait_seconds)
+        update_set = self._property_collector.WaitForUpdatesEx(self.version, options)
+        if update_set is not None:
+            self.apply_update_set(update_set)
+        return update_set
+
+    def _reset(self):
+        self._names_of.clear()
+        for type_obj in self.cached_types:
+            self._types[type_obj] = {}
+
+    def _type_of(self, obj):
+        return next((type_obj for type_obj in self.cached_types if isinstance(obj, type_obj)), None)
+
+    def apply_update_set(self, update_set: vmodl.query.PropertyCollector.UpdateSet):
+        """
+        Apply an UpdateSet returned by WaitForUpdatesEx
+        :param update_set: the UpdateSet
+        """
+        with self._lock:
+            if self.version is None:
+                self._reset()
+            for filter_update in update_set.filterSet or []:
+                for object_update in filter_update.objectSet or []:
+                    self._apply_object_update(object_update)
+            self.version = update_set.version
+
+    def _apply_object_update(self, object_update: vmodl.query.PropertyCollector.ObjectUpdate):
+        obj = object_update.obj
+        type_obj = self._type_of(obj)
+        if type_obj is None:
+            return
+
+        if object_update.kind == 'leave':
+            self._unlink(type_obj, obj)
+            return
+
+        path = name_property(type_obj)
+        for change in object_update.changeSet or []:
+            if change.name != path:
+                continue
+            self._unlink(type_obj, obj)
+            if change.op != 'remove':
+                self._names_of[obj] = change.val
+                self._types[type_obj].setdefault(change.val, []).append(obj)
+
+    def _unlink(self, type_obj: vim, obj):
+        name = self._names_of.pop(obj, None)
+        if name is None:
+            return
+        objects = self._types[type_obj].get(name, [])
+        if obj in objects:
+            objects.remove(obj)
+        if not objects:
+            self._types[type_obj].pop(name, None)
+
+    def refresh(self, type_obj: vim) -> dict:
+        """
+        Get the names of type_obj. Only the types not cached are reloaded from the vCenter.
+        :param type_obj: type, for example vim.VirtualMachine
+        :return: the {name: [objects]} of type_obj
+        """
+        if type_obj not in self.cached_types:
+            return super().refresh(type_obj)
+        with self._lock:
+            return {name: list(objects) for name, objects in self._types[type_obj].items()}
+
+    def _verified(self, type_obj: vim, name: str, obj) -> bool:
+        # The updates keep the names of the cached types current: no round trip to check a hit
+        return type_obj in self.cached_types or super()._verified(type_obj, name, obj)
+
+    def invalidate(self, type_obj: vim = None):
+        # The updates keep the cached types current
+        with self._lock:
+            for cached in list(self._types):
+                if cached not in self.cached_types and type_obj in (None, cached):
+                    del self._types[cached]
+            for key in [key for key in self._misses if type_obj in (None, key[0])]:
+                del self._misses[key]
+
+    def discard(self, obj):
+        # The leave update of the filter removes the cached objects
+        if self._type_of(obj) is None:
+            super().discard(obj)
+
+
+def enable_inventory_cache(si: vim.ServiceInstance, types: tuple = CACHED_TYPES,
+                           property_collector: vmodl.query.PropertyCollector = None,
+                           max_wait_seconds: int = 30) -> InventoryCache:
+    """
+    Keep the inventory of the connection cached: list_obj_names and get_object of the
+    cached types are answered from memory.
+    :param si: Connection to vCenter Server
+    :param types: types to be cached
+    :param property_collector: PropertyCollector to wait on. Standard a new one of the session
+    :param max_wait_seconds: max duration of a single WaitForUpdatesEx call
+    :return: the running InventoryCache
+    """
+    disable_inventory_cache(si)
+    cache = InventoryCache(si, types, property_collector, max_wait_seconds)
+    cache.start()
+    state = connection_state(si)
+    with state.lock:
+        state.index = cache
+    return cache
+
+
+def disable_inventory_cache(si: vim.ServiceInstance):
+    """
+    Stop the inventory cache of the connection, going back to the on-demand index
+    :param si: Connection to vCenter Server
+    """
+    state = connection_state(si)
+    with state.lock:
+        # Not restarted after a new login either
+        state.restarting = None
+        cache = state.index
+        if not isinstance(cache, InventoryCache):
+            return
+        state.index = None
+    cache.stop()
@@ -1,27 +1,263 @@
-from typing import List
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, List, Tuple
 
 from prettytable import PrettyTable
 from pyVmomi import vim
 
 MBFACTOR = float(1 << 20)
 
+# Rotated log files kept
+LOG_BACKUP_COUNT = 3
+# Max number of messages written by the Logger at once
+LOG_MAX_BATCH = 1000
+
+# Open Loggers, closed at exit so that no message is lost
+_loggers = weakref.WeakSet()
+
+# Rows used by the plain reports to size the columns
+REPORT_SAMPLE_ROWS = 100
+
+# Columns of the fleet reports: (header, property path)
+VM_REPORT_COLUMNS = [
+    ("Name", 'summary.config.name'),
+    ("Path", 'summary.config.vmPathName'),
+    ("Guest", 'summary.config.guestFullName'),
+    ("CPU", 'summary.config.numCpu'),
+    ("RAM (MB)", 'summary.config.memorySizeMB'),
+    ("VDisk", 'summary.config.numVirtualDisks'),
+    ("ETH Cards", 'summary.config.numEthernetCards'),
+    ("State", 'summary.runtime.powerState'),
+    ("VMware-tools", 'summary.guest.toolsStatus'),
+    ("IP", 'summary.guest.ipAddress'),
+]
+HOST_REPORT_COLUMNS = [
+    ("Name", 'summary.config.name'),
+    ("Boot Time", 'summary.runtime.bootTime'),
+    ("PowerState", 'summary.runtime.powerState'),
+    ("Maintenance", 'summary.runtime.inMaintenanceMode'),
+    ("Status", 'overallStatus'),
+    ("NICS", 'summary.hardware.numNics'),
+    ("Management IP", 'summary.managementServerIp'),
+    ("CPU Model", 'summary.hardware.cpuModel'),
+    ("CPU Cores", 'summary.hardware.numCpuCores'),
+    ("CPU Threads", 'summary.hardware.numCpuThreads'),
+    ("CPU Used (MHz)", 'summary.quickStats.overallCpuUsage'),
+    ("RAM Used (MB)", 'summary.quickStats.overallMemoryUsage'),
+]
+PROCESS_REPORT_COLUMNS = [
+    ("Name", 'name'),
+    ("PID", 'pid'),
+    ("Owner", 'owner'),
+    ("cmdLine", 'cmdLine'),
+    ("StartTime", 'startTime'),
+    ("EndTime", 'endTime'),
+    ("ExitCode", 'exitCode'),
+]
+
 
 class Logger:
-    def __init__(self, file: str= None):
-        if file is not None:
-            self.file = open(file, "w")
-        else:
-            self.file = None
+    """
+    Thread-safe Logger: the messages are queued and written by a background thread,
+    a batch at a time, to the file and to stdout.
+    The file is rotated beyond max_bytes. With structured=True every message is a JSON record.
+    A Logger with no file and echo=False is disabled: print_ returns at once.
+    """
+    def __init__(self, file: str = None, echo: bool = True, structured: bool = False,
+                 max_bytes: int = 0, backup_count: int = LOG_BACKUP_COUNT, max_batch: int = LOG_MAX_BATCH):
+        """
+        :param file: path of the log file. None to log only to stdout
+        :param echo: True to write the messages also to stdout
+        :param structured: True to write JSON records, one per line
+        :param max_bytes: size of the file beyond which it is rotated. 0 to never rotate
+        :param backup_count: number of rotated files kept, like file.1, file.2
+        :param max_batch: max number of messages written at once
+        """
+        self.path = file
+        self.echo = echo
+        self.structured = structured
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_batch = max_batch
+        self.enabled = file is not None or echo
+        self.file = open(file, "w") if file is not None else None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        _loggers.add(self)
 
     def print(self, string: str):
-        string = string.replace("\n", "\n<D>")
+        """
+        Log a message
+        :param string: the message, or any object printable with str()
+        """
+        if self.enabled:
+            self._put({'time': time.time(), 'message': str(string)})
+
+    def record(self, operation: str, obj=None, duration: float = None, outcome: str = "ok", **fields):
+        """
+        Log a structured record of an operation
+        :param operation: the operation, for example 'power_on_vm'
+        :param obj: the object of the operation: its name or a managed object
+        :param duration: seconds taken by the operation
+        :param outcome: 'ok' or the error
+        :param fields: other fields of the record
+        """
+        if not self.enabled:
+            return
+        if isinstance(obj, vim.ManagedObject):
+            obj = obj._moId
+        entry = {'time': time.time(), 'operation': operation, 'object': obj,
+                 'duration': duration, 'outcome': outcome}
+        entry.update(fields)
+        self._put(entry)
+
+    @contextmanager
+    def timed(self, operation: str, obj=None, **fields):
+        """
+        Log a record of the operation run in the with block, with its duration and outcome
+        :param operation: the operation, for example 'power_on_vm'
+        :param obj: the object of the operation: its name or a managed object
+        :param fields: other fields of the record
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(operation, obj, time.perf_counter() - start, "%s: %s" % (type(e).__name__, e), **fields)
+            raise
+        self.record(operation, obj, time.perf_counter() - start, **fields)
+
+    def _put(self, entry: dict):
+        with self._lock:
+            if self._closed:
+                # No background thread any more: the late messages are written at once
+                self._write_late(entry)
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vcs-logger", daemon=True)
+                self._thread.start()
+            self._queue.put(entry)
+
+    def _write_late(self, entry: dict):
+        line, echo_line = self._format(entry)
+        if self.path is not None:
+            with open(self.path, "a") as file:
+                file.write(line + "\n")
+        if self.echo:
+            sys.stdout.write(echo_line + "\n")
+
+    def _format(self, entry: dict) -> Tuple[str, str]:
+        # (line of the file, line of stdout)
+        if self.structured:
+            line = json.dumps(entry, default=str)
+            return line, line
+        if 'message' in entry:
+            message = entry['message']
+        else:
+            message = "%s %s: %s" % (entry['operation'], entry['object'] or "", entry['outcome'])
+            if entry['duration'] is not None:
+                message += " (%.3fs)" % entry['duration']
+        message = message.replace("\n", "\n<D>")
+        return message, "\t<D>:" + message
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            try:
+                self._write_batch([entry for entry in batch if entry is not None])
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, entries: list):
+        try:
+            self._write([self._format(entry) for entry in entries])
+        except Exception:
+            # Written again one at a time: a record that can't be written doesn't stop the others
+            for entry in entries:
+                try:
+                    self._write([self._format(entry)])
+                except Exception as e:
+                    sys.stderr.write("Logger: record not written, %s: %s: %r\n" % (type(e).__name__, e, entry))
+
+    def _write(self, lines: list):
+        if not lines:
+            return
         if self.file is not None:
-            self.file.write(string)
-        print("\t<D>:"+string)
+            self.file.write("".join(line + "\n" for line, _ in lines))
+            self.file.flush()
+            if self.max_bytes and self.file.tell() >= self.max_bytes:
+                self._rotate()
+        if self.echo:
+            sys.stdout.write("".join(line + "\n" for _, line in lines))
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.path, i)):
+                os.replace("%s.%d" % (self.path, i), "%s.%d" % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, "%s.1" % self.path)
+        self.file = open(self.path, "w")
+
+    def flush(self):
+        """
+        Wait until all the messages logged so far are written
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """
+        Write the messages still queued and close the file.
+        The messages logged afterwards are written at once, appended to the file.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+        if self.file is not None:
+            self.file.close()
+        _loggers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@atexit.register
+def _close_loggers():
+    for logger in list(_loggers):
+        logger.close()
 
 
 def print_(string:str, logger:Logger):
-    if logger is not None:
+    if logger is not None and getattr(logger, 'enabled', True):
         logger.print(string)
 
 
@@ -79,18 +315,16 @@ def print_pid_info(proc: vim.vm.guest.ProcessManager.ProcessInfo, logger: Logger
     print_processes_list(temp, logger)
 
 
-def print_processes_list(processes: List[vim.vm.guest.ProcessManager.ProcessInfo], logger: Logger):
+def print_processes_list(processes: List[vim.vm.guest.ProcessManager.ProcessInfo], logger: Logger,
+                         report_format: str = 'plain'):
     """
     Print the data taken from function get_processes
     :param processes:  List of processes taken using function get_processes
     :param logger: Logger
+    :param report_format: 'plain', 'tsv' or 'json'
     """
-    t = PrettyTable(['Name', 'PID', 'Owner', 'cmdLine', 'StartTime', 'EndTime', 'ExitCode'])
-
-    for proc in processes:
-        t.add_row([proc.name, proc.pid, proc.owner, proc.cmdLine, proc.startTime, proc.endTime, proc.exitCode])
-
-    logger.print(t)
+    rows = ({path: getattr(proc, path) for _, path in PROCESS_REPORT_COLUMNS} for proc in processes)
+    print_report(rows, PROCESS_REPORT_COLUMNS, logger, report_format)
 
 
 def print_host_info(host: vim.HostSystem, logger: Logger):
@@ -129,4 +363,139 @@ def print_host_info(host: vim.HostSystem, logger: Logger):
     t.add_row(["RAM (MB)", host_total_memory])
     t.add_row(["RAM usage (%)", memory_usage])
 
-    logger.print(t)
\ No newline at end of file
+    logger.print(t)
+
+
+def report_paths(columns: List[Tuple[str, str]]) -> List[str]:
+    """
+    Get the property paths to fetch for a report
+    :param columns: columns of the report, (header, property path)
+    :return: the list of property paths
+    """
+    return [path for _, path in columns]
+
+
+def plain_value(value):
+    """
+    Convert a property value to a plain value, for the reports and the exports
+    :param value: the value of a property
+    :return: the moId of managed objects, the same value for numbers, booleans, strings,
+        datetimes and None, the string form of anything else
+    """
+    if value is None or isinstance(value, (bool, int, float, str, datetime)):
+        return value
+    if isinstance(value, vim.ManagedObject):
+        return value._moId
+    return str(value)
+
+
+class FleetReport:
+    """
+    Report with one row per object, written while the rows arrive.
+    The rows are dicts {property path: value} already fetched, for example by iter_properties:
+    nothing is read from the vCenter while rendering.
+    Formats: 'plain' (aligned columns sized on the first rows), 'tsv' and 'json' (one object per line).
+    """
+    def __init__(self, columns: List[Tuple[str, str]], output=None, report_format: str = 'plain',
+                 sample_rows: int = REPORT_SAMPLE_ROWS):
+        """
+        :param columns: columns of the report, (header, property path)
+        :param output: Logger or file-like object to write to. Standard stdout
+        :param report_format: 'plain', 'tsv' or 'json'
+        :param sample_rows: rows buffered by the plain format to size the columns
+        """
+        if report_format not in ('plain', 'tsv', 'json'):
+            raise ValueError("Unknown report format %r" % report_format)
+        self.columns = columns
+        self.output = output
+        self.report_format = report_format
+        self.sample_rows = sample_rows
+        self.rows = 0
+        self._sample = []
+        self._widths = None
+        if report_format == 'tsv':
+            self._write_line("\t".join(self._tsv(header) for header, _ in columns))
+
+    def _write_line(self, line: str):
+        if isinstance(self.output, Logger):
+            self.output.print(line)
+        elif self.output is not None:
+            self.output.write(line + "\n")
+        else:
+            print(line)
+
+    @staticmethod
+    def _value(value):
+        value = plain_value(value)
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    @staticmethod
+    def _tsv(value) -> str:
+        return "" if value is None else str(value).replace("\t", " ").replace("\n", " ")
+
+    def add(self, row):
+        """
+        Write a row
+        :param row: dict {property path: value}, or (object, dict) as yielded by iter_properties
+        """
+        if isinstance(row, tuple):
+            row = row[1]
+        values = [self._value(row.get(path)) for _, path in self.columns]
+        self.rows += 1
+
+        if self.report_format == 'json':
+            self._write_line(json.dumps({header: value for (header, _), value in zip(self.columns, values)},
+                                        default=str))
+        elif self.report_format == 'tsv':
+            self._write_line("\t".join(self._tsv(value) for value in values))
+        elif self._widths is None:
+            self._sample.append(values)
+            if len(self._sample) >= self.sample_rows:
+                self._flush_sample()
+        else:
+            self._write_plain(values)
+
+    def _flush_sample(self):
+        cells = [[header for header, _ in self.columns]]
+        cells += [[self._tsv(value) for value in values] for values in self._sample]
+        self._widths = [max(len(row[i]) for row in cells) for i in range(len(self.columns))]
+        self._write_plain(cells[0])
+        self._write_line("  ".join("-" * width for width in self._widths))
+        for values in self._sample:
+            self._write_plain(values)
+        self._sample = []
+
+    def _write_plain(self, values: list):
+        self._write_line("  ".join(self._tsv(value).ljust(width)
+                                   for value, width in zip(values, self._widths)).rstrip())
+
+    def close(self):
+        """
+        Write the rows still buffered
+        """
+        if self.report_format == 'plain' and self._widths is None:
+            self._flush_sample()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def print_report(rows: Iterable, columns: List[Tuple[str, str]], output=None,
+                 report_format: str = 'plain') -> int:
+    """
+    Write a report with one row per object.
+    For example: print_report(iter_properties(si, vim.VirtualMachine, report_paths(VM_REPORT_COLUMNS)),
+    VM_REPORT_COLUMNS, logger, 'tsv')
+    :param rows: dicts {property path: value}, or (object, dict) as yielded by iter_properties
+    :param columns: columns of the report, (header, property path)
+    :param output: Logger or file-like object to write to. Standard stdout
+    :param report_format: 'plain', 'tsv' or 'json'
+    :return: the number of rows written
+    """
+    with FleetReport(columns, output, report_format) as report:
+        for row in rows:
+            report.add(row)
+    return report.rows
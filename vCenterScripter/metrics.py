@@ -0,0 +1,426 @@
+import functools
+import inspect
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List
+
+from pyVmomi import SoapAdapter
+
+# Upper bounds, in seconds, of the buckets of the histograms
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Helper label of the SOAP calls made outside any instrumented helper
+NO_HELPER = "(none)"
+
+_enabled = False
+_registry = None
+_lock = threading.Lock()
+_local = threading.local()
+_patched = {}
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets
+    """
+    def __init__(self, buckets: tuple = HISTOGRAM_BUCKETS):
+        """
+        :param buckets: upper bounds of the buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Add a value
+        :param value: the value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        """
+        Get the number of values less than or equal to each bucket, the last one is +Inf
+        :return: list of counts
+        """
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class HelperStats:
+    """
+    Metrics of the invocations of a single helper.
+    The SOAP calls, the bytes and the task waits include the ones of the nested helpers.
+    """
+    def __init__(self, buckets: tuple = HISTOGRAM_BUCKETS):
+        self.calls = 0
+        self.errors = 0
+        self.soap_calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wall_time = Histogram(buckets)
+        self.task_wait = Histogram(buckets)
+
+
+class Metrics:
+    """
+    Registry of the metrics of the helpers, with counters and histograms by helper name
+    """
+    def __init__(self, buckets: tuple = HISTOGRAM_BUCKETS):
+        """
+        :param buckets: upper bounds of the buckets of the histograms
+        """
+        self.buckets = buckets
+        self.helpers = {}
+        self._lock = threading.RLock()
+
+    def stats(self, helper: str) -> HelperStats:
+        """
+        Get the metrics of a helper
+        :param helper: name of the helper, like 'vm.get_vm'
+        :return: the HelperStats
+        """
+        stats = self.helpers.get(helper)
+        if stats is None:
+            with self._lock:
+                stats = self.helpers.setdefault(helper, HelperStats(self.buckets))
+        return stats
+
+    def _update(self, helpers: list, field: str, value):
+        with self._lock:
+            for helper in helpers:
+                stats = self.stats(helper)
+                setattr(stats, field, getattr(stats, field) + value)
+
+    def _observe_task_wait(self, helpers: list, seconds: float):
+        with self._lock:
+            for helper in helpers:
+                self.stats(helper).task_wait.observe(seconds)
+
+    def _invocation(self, helper: str, seconds: float, failed: bool):
+        with self._lock:
+            stats = self.stats(helper)
+            stats.calls += 1
+            stats.errors += failed
+            stats.wall_time.observe(seconds)
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Get the totals of each helper
+        :return: a dict {helper: {'calls', 'errors', 'seconds', 'soap_calls', 'bytes_sent',
+            'bytes_received', 'task_wait_seconds'}}
+        """
+        with self._lock:
+            return {helper: {
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'seconds': stats.wall_time.sum,
+                'soap_calls': stats.soap_calls,
+                'bytes_sent': stats.bytes_sent,
+                'bytes_received': stats.bytes_received,
+                'task_wait_seconds': stats.task_wait.sum,
+            } for helper, stats in sorted(self.helpers.items())}
+
+    def prometheus(self, prefix: str = "vcs") -> str:
+        """
+        Export the metrics in the Prometheus text format
+        :param prefix: prefix of the metric names
+        :return: the text
+        """
+        lines = []
+        with self._lock:
+            helpers = sorted(self.helpers.items())
+            for name, field, help_text in (
+                    ('helper_calls_total', 'calls', "Invocations of the helper"),
+                    ('helper_errors_total', 'errors', "Invocations of the helper raising an error"),
+                    ('soap_calls_total', 'soap_calls', "SOAP calls made by the helper"),
+                    ('soap_sent_bytes_total', 'bytes_sent', "Bytes of the SOAP requests of the helper"),
+                    ('soap_received_bytes_total', 'bytes_received', "Bytes of the SOAP responses of the helper")):
+                lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+                lines.append("# TYPE %s_%s counter" % (prefix, name))
+                for helper, stats in helpers:
+                    lines.append('%s_%s{helper="%s"} %d' % (prefix, name, helper, getattr(stats, field)))
+
+            for name, field, help_text in (
+                    ('helper_seconds', 'wall_time', "Wall time of the invocations of the helper"),
+                    ('task_wait_seconds', 'task_wait', "Time the helper waited for vCenter tasks")):
+                lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+                lines.append("# TYPE %s_%s histogram" % (prefix, name))
+                for helper, stats in helpers:
+                    histogram = getattr(stats, field)
+                    bounds = ["%g" % bound for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.cumulative()):
+                        lines.append('%s_%s_bucket{helper="%s",le="%s"} %d' % (prefix, name, helper, bound, count))
+                    lines.append('%s_%s_sum{helper="%s"} %g' % (prefix, name, helper, histogram.sum))
+                    lines.append('%s_%s_count{helper="%s"} %d' % (prefix, name, helper, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Forget all the metrics
+        """
+        with self._lock:
+            self.helpers = {}
+
+
+def _active_helpers() -> list:
+    # A helper running nested in itself is counted once
+    stack = getattr(_local, 'stack', None)
+    return list(dict.fromkeys(stack)) if stack else [NO_HELPER]
+
+
+def record_soap_call(bytes_sent: int = 0, bytes_received: int = 0):
+    """
+    Count a SOAP call of the running helpers. Called by the instrumented pyVmomi stub,
+    it can be called by other stubs too.
+    :param bytes_sent: bytes of the request
+    :param bytes_received: bytes of the response
+    """
+    registry = _registry
+    if not _enabled or registry is None:
+        return
+    helpers = _active_helpers()
+    registry._update(helpers, 'soap_calls', 1)
+    if bytes_sent:
+        registry._update(helpers, 'bytes_sent', bytes_sent)
+    if bytes_received:
+        registry._update(helpers, 'bytes_received', bytes_received)
+
+
+def record_task_wait(seconds: float):
+    """
+    Count the time the running helpers waited for vCenter tasks
+    :param seconds: seconds waited
+    """
+    registry = _registry
+    if not _enabled or registry is None:
+        return
+    registry._observe_task_wait(_active_helpers(), seconds)
+
+
+@contextmanager
+def task_wait():
+    """
+    Count the time spent in the with block as waiting for vCenter tasks
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_task_wait(time.perf_counter() - start)
+
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _instrumented(helper: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        registry = _registry
+        if not _enabled or registry is None:
+            return func(*args, **kwargs)
+
+        stack = _stack()
+        stack.append(helper)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stack.pop()
+            registry._invocation(helper, time.perf_counter() - start, failed)
+
+    wrapper.__wrapped_helper__ = helper
+    return wrapper
+
+
+def _instrumented_generator(helper: str, func):
+    # Only the time spent producing the items is counted, not the one of the consumer between them
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        registry = _registry
+        if not _enabled or registry is None:
+            return (yield from func(*args, **kwargs))
+
+        generator = func(*args, **kwargs)
+        seconds = 0.0
+        failed = True
+        try:
+            while True:
+                # The items may be consumed by another thread than the first one
+                stack = _stack()
+                stack.append(helper)
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration as stop:
+                    failed = False
+                    return stop.value
+                finally:
+                    stack.pop()
+                    seconds += time.perf_counter() - start
+                yield item
+        except GeneratorExit:
+            # The consumer stopped early
+            failed = False
+            raise
+        finally:
+            generator.close()
+            registry._invocation(helper, seconds, failed)
+
+    wrapper.__wrapped_helper__ = helper
+    return wrapper
+
+
+def instrument_module(module_name: str):
+    """
+    Wrap the public functions defined in a module, so that their invocations are measured
+    while the instrumentation is enabled. The invocation of a generator function lasts
+    the time spent iterating it.
+    :param module_name: name of the module, usually __name__
+    """
+    module = sys.modules[module_name]
+    short_name = module_name.split('vCenterScripter.', 1)[-1]
+    for name, func in list(vars(module).items()):
+        if name.startswith('_') or not inspect.isfunction(func) or func.__module__ != module_name:
+            continue
+        if hasattr(func, '__wrapped_helper__'):
+            continue
+        instrumented = _instrumented_generator if inspect.isgeneratorfunction(func) else _instrumented
+        setattr(module, name, instrumented("%s.%s" % (short_name, name), func))
+
+
+class _CountingReader:
+    # Count the bytes of a SOAP response while the parser reads it
+    def __init__(self, response):
+        self.response = response
+        self.bytes = 0
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        self.bytes += len(data)
+        return data
+
+
+def _patch_stub():
+    # Count the SOAP calls of every pyVmomi stub: requests in SerializeRequest, responses in Deserialize
+    if _patched:
+        return
+    serialize = SoapAdapter.SoapStubAdapter.SerializeRequest
+    deserialize = SoapAdapter.SoapResponseDeserializer.Deserialize
+
+    def serialize_request(self, mo, info, args):
+        request = serialize(self, mo, info, args)
+        record_soap_call(bytes_sent=len(request))
+        return request
+
+    def deserialize_response(self, response, resultType, nsMap=None):
+        if isinstance(response, (bytes, str)):
+            _record_received(len(response))
+            return deserialize(self, response, resultType, nsMap)
+        reader = _CountingReader(response)
+        try:
+            return deserialize(self, reader, resultType, nsMap)
+        finally:
+            _record_received(reader.bytes)
+
+    # The originals may be inherited: None means delete the override
+    _patched['serialize'] = vars(SoapAdapter.SoapStubAdapter).get('SerializeRequest')
+    _patched['deserialize'] = vars(SoapAdapter.SoapResponseDeserializer).get('Deserialize')
+    SoapAdapter.SoapStubAdapter.SerializeRequest = serialize_request
+    SoapAdapter.SoapResponseDeserializer.Deserialize = deserialize_response
+
+
+def _record_received(size: int):
+    registry = _registry
+    if _enabled and registry is not None and size:
+        registry._update(_active_helpers(), 'bytes_received', size)
+
+
+def _unpatch_stub():
+    if not _patched:
+        return
+    for cls, name, key in ((SoapAdapter.SoapStubAdapter, 'SerializeRequest', 'serialize'),
+                           (SoapAdapter.SoapResponseDeserializer, 'Deserialize', 'deserialize')):
+        original = _patched.pop(key)
+        if original is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, original)
+
+
+def enable(registry: Metrics = None) -> Metrics:
+    """
+    Turn on the instrumentation of the helpers
+    :param registry: Metrics to record to. Standard the current one, or a new one
+    :return: the Metrics recording
+    """
+    global _enabled, _registry
+    with _lock:
+        if registry is not None:
+            _registry = registry
+        elif _registry is None:
+            _registry = Metrics()
+        _patch_stub()
+        _enabled = True
+        return _registry
+
+
+def disable():
+    """
+    Turn off the instrumentation of the helpers. The recorded metrics are kept.
+    """
+    global _enabled
+    with _lock:
+        _enabled = False
+        _unpatch_stub()
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the Metrics recording, if any
+    :return: the Metrics, or None
+    """
+    return _registry
+
+
+@contextmanager
+def profile(registry: Metrics = None):
+    """
+    Record the metrics of the helpers called in the with block, for example of one script run:
+        with profile() as metrics:
+            ...
+        print(metrics.prometheus())
+    :param registry: Metrics to record to. Standard a new one
+    :return: the Metrics
+    """
+    global _enabled, _registry
+    with _lock:
+        previous = (_enabled, _registry)
+    registry = enable(registry or Metrics())
+    try:
+        yield registry
+    finally:
+        with _lock:
+            _enabled, _registry = previous
+            if not _enabled:
+                _unpatch_stub()
@@ -0,0 +1,136 @@
+import functools
+from typing import Dict, List, Tuple
+
+from vCenterScripter.common import *
+from vCenterScripter.common import ConnectionState
+from vCenterScripter.metrics import instrument_module
+
+# Properties read for the HostNetwork of a host
+HOST_NETWORK_PROPERTIES = ['config.network', 'configManager.networkSystem']
+
+
+class HostNetwork:
+    """
+    Indexed view of the standard networking of a host, host.config.network
+    """
+    def __init__(self, host: vim.HostSystem, network: vim.host.NetworkInfo,
+                 network_system: vim.host.NetworkSystem = None):
+        """
+        :param host: Host
+        :param network: host.config.network
+        :param network_system: host.configManager.networkSystem
+        """
+        self.host = host
+        self.network = network
+        self.network_system = network_system
+        self.switches = {switch.name: switch for switch in network.vswitch or []}
+        self.portgroups = {portgroup.spec.name: portgroup for portgroup in network.portgroup or []}
+        self.pnics = {pnic.device: pnic for pnic in network.pnic or []}
+        self.vnics = {vnic.device: vnic for vnic in network.vnic or []}
+        self.by_key = {}
+        for objs in (network.vswitch, network.portgroup, network.pnic, network.vnic):
+            for obj in objs or []:
+                self.by_key[obj.key] = obj
+
+    def portgroup(self, name: str) -> vim.host.PortGroup:
+        """
+        Get a portgroup by name or by key
+        :param name: name or key of the portgroup
+        :return: the PortGroup, None if not found
+        """
+        portgroup = self.portgroups.get(name)
+        if portgroup is None:
+            portgroup = self.by_key.get(name)
+        return portgroup if isinstance(portgroup, vim.host.PortGroup) else None
+
+    def vnics_of_portgroup(self, name: str) -> List[vim.host.VirtualNic]:
+        """
+        Get the VMkernel NICs of a portgroup
+        :param name: name of the portgroup
+        :return: list of VirtualNic
+        """
+        return [vnic for vnic in self.vnics.values() if vnic.portgroup == name]
+
+
+def _cache(host: vim.HostSystem) -> Tuple[ConnectionState, dict]:
+    state = connection_state(host)
+    with state.lock:
+        return state, state.indexes.setdefault('host_networks', {})
+
+
+def host_network_missing(host: vim.HostSystem) -> str:
+    """
+    Get the error message of a host with no network configuration
+    :param host: Host
+    :return: the message
+    """
+    return "Network configuration of host %s not available, is it disconnected?" % host._moId
+
+
+def get_host_networks(si: vim.ServiceInstance, hosts: list, refresh: bool = False) -> Dict[vim.HostSystem, HostNetwork]:
+    """
+    Get the network views of many hosts, the ones not cached are read with a single property retrieval
+    :param si: Connection to vCenter Server
+    :param hosts: the Hosts
+    :param refresh: True to read all of them again
+    :return: a dict {host: HostNetwork}. The hosts with no network configuration, like the
+        disconnected ones, are missing from it.
+    """
+    hosts = list(hosts)
+    if not hosts:
+        return {}
+    state, cache = _cache(hosts[0])
+    with state.lock:
+        views = {} if refresh else {host: cache[host._moId] for host in hosts if host._moId in cache}
+    missing = [host for host in hosts if host not in views]
+
+    properties = get_properties(si, missing, HOST_NETWORK_PROPERTIES)
+    with state.lock:
+        for host in missing:
+            props = properties.get(host, {})
+            if props.get('config.network') is None:
+                continue
+            views[host] = cache[host._moId] = HostNetwork(host, props['config.network'],
+                                                          props.get('configManager.networkSystem'))
+    return views
+
+
+def get_host_network(host: vim.HostSystem, refresh: bool = False) -> HostNetwork:
+    """
+    Get the network view of a host, read once and cached until a helper changes the host network
+    :param host: Host
+    :param refresh: True to read it again
+    :return: the HostNetwork
+    :raise LookupError: if the host has no network configuration, like a disconnected host
+    """
+    network = get_host_networks(service_instance(host), [host], refresh).get(host)
+    if network is None:
+        raise LookupError(host_network_missing(host))
+    return network
+
+
+def invalidate_host_network(host: vim.HostSystem):
+    """
+    Forget the cached network view of a host
+    :param host: Host
+    """
+    state, cache = _cache(host)
+    with state.lock:
+        cache.pop(host._moId, None)
+
+
+def invalidates_host_network(func):
+    """
+    Decorator of the helpers changing the network of their first argument, the host:
+    its cached view is forgotten when they return or fail
+    """
+    @functools.wraps(func)
+    def wrapper(host, *args, **kwargs):
+        try:
+            return func(host, *args, **kwargs)
+        finally:
+            invalidate_host_network(host)
+    return wrapper
+
+
+instrument_module(__name__)
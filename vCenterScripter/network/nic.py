@@ -1,4 +1,6 @@
 from vCenterScripter.common import *
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.network.netconfig import get_host_network
 
 
 def list_host_nics(host: vim.HostSystem) -> set:
@@ -7,7 +9,7 @@ def list_host_nics(host: vim.HostSystem) -> set:
     :param host: Host
     :return a set of names of the host Phisical NICs.
     """
-    return list_host_objects(host.config.network.pnic)
+    return set(get_host_network(host).pnics)
 
 
 def get_host_nic(host: vim.HostSystem, name: str) -> vim.host.PhysicalNic:
@@ -16,6 +18,7 @@ def get_host_nic(host: vim.HostSystem, name: str) -> vim.host.PhysicalNic:
     :param name: of the vSwitch
     :param host: Host
     """
-    return get_host_object(host.config.network.pnic, name)
+    return get_host_network(host).pnics.get(name)
 
 
+instrument_module(__name__)
@@ -1,5 +1,7 @@
 from vCenterScripter.common import *
 from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.network.netconfig import get_host_network, invalidates_host_network
 
 
 def list_host_portgroups(host: vim.HostSystem) -> set:
@@ -8,18 +10,19 @@ def list_host_portgroups(host: vim.HostSystem) -> set:
     :param host: Host
     :return a set of names of the host portgroups.
     """
-    return list_host_objects(host.config.network.portgroup)
+    return set(get_host_network(host).portgroups)
 
 
 def get_host_portgroup(host: vim.HostSystem, name: str) -> vim.host.PortGroup:
     """
     Get the Portgroup of a host
-    :param name: of the Portgroup
+    :param name: name or key of the Portgroup
     :param host: Host
     """
-    return get_host_object(host.config.network.portgroup, name)
+    return get_host_network(host).portgroup(name)
 
 
+@invalidates_host_network
 def delete_host_portgroup(host: vim.HostSystem, name: str, logger: Logger = None):
     """
     Delete a PortGroup from a host
@@ -32,6 +35,7 @@ def delete_host_portgroup(host: vim.HostSystem, name: str, logger: Logger = None
     print_("Host: Deleted " + name + " pg", logger)
 
 
+@invalidates_host_network
 def add_host_portgroup(host: vim.HostSystem,
                        switch:vim.host.VirtualSwitch,
                        portgroup_name:str,
@@ -65,6 +69,7 @@ def add_host_portgroup(host: vim.HostSystem,
     print_("Added portgroup" + portgroup_name, logger)
 
 
+@invalidates_host_network
 def update_host_portgroup_vlan(host: vim.HostSystem,
                        portgroup: vim.host.PortGroup,
                        vlan_id: int,
@@ -82,6 +87,7 @@ def update_host_portgroup_vlan(host: vim.HostSystem,
     print_("Modified portgroup " + portgroup.key, logger)
 
 
+@invalidates_host_network
 def update_host_portgroup_flags(host: vim.HostSystem,
                        portgroup: vim.host.PortGroup,
                        logger: Logger = None,
@@ -101,3 +107,6 @@ def update_host_portgroup_flags(host: vim.HostSystem,
     spec.policy.security.forgedTransmits = forgedTransmits
     host.configManager.networkSystem.UpdatePortGroup(pgName=portgroup.spec.name, portgrp=spec)
     print_("Modified portgroup " + portgroup.key, logger)
+
+
+instrument_module(__name__)
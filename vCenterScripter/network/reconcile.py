@@ -0,0 +1,249 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple
+
+from vCenterScripter.common import *
+from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.network.netconfig import get_host_networks, host_network_missing, invalidate_host_network
+from vCenterScripter.network.vswitch import Nic_Teaming
+
+# Ports of the vSwitches created without num_ports
+DEFAULT_SWITCH_PORTS = 128
+
+
+class SwitchState(NamedTuple):
+    """
+    Desired state of a standard vSwitch. The fields left None are not changed.
+    """
+    name: str
+    num_ports: int = None
+    mtu: int = None
+    nics: List[str] = None
+    active_nics: List[str] = None
+    standby_nics: List[str] = None
+    teaming: Nic_Teaming = None
+
+
+class PortgroupState(NamedTuple):
+    """
+    Desired state of a portgroup. The security flags left None are not changed.
+    """
+    name: str
+    switch: str
+    vlan_id: int = 0
+    allow_promiscuous: bool = None
+    mac_changes: bool = None
+    forged_transmits: bool = None
+
+
+class VnicState(NamedTuple):
+    """
+    Desired state of a VMkernel NIC, matched by device or else by portgroup.
+    The fields left None are not changed.
+    """
+    portgroup: str
+    ip: vim.host.IpConfig = None
+    mtu: int = None
+    device: str = None
+
+
+class HostNetworkState(NamedTuple):
+    """
+    Desired network of a host. The objects not listed are left as they are,
+    except the ones in remove_portgroups and remove_switches.
+    """
+    switches: List[SwitchState] = ()
+    portgroups: List[PortgroupState] = ()
+    vnics: List[VnicState] = ()
+    remove_portgroups: List[str] = ()
+    remove_switches: List[str] = ()
+
+
+class NetworkResult(NamedTuple):
+    """
+    Result of reconcile_host_networks on a single host.
+    config is the delta sent to the host, None if the host was already in the desired state.
+    """
+    host: vim.HostSystem
+    config: vim.host.NetworkConfig
+    error: Exception
+
+
+def _switch_spec(spec: vim.host.VirtualSwitch.Specification, desired: SwitchState) -> vim.host.VirtualSwitch.Specification:
+    spec = copy.deepcopy(spec) if spec is not None else vim.host.VirtualSwitch.Specification(
+        numPorts=desired.num_ports or DEFAULT_SWITCH_PORTS)
+    if desired.num_ports is not None:
+        spec.numPorts = desired.num_ports
+    if desired.mtu is not None:
+        spec.mtu = desired.mtu
+    if desired.nics is not None:
+        if spec.bridge is None:
+            spec.bridge = vim.host.VirtualSwitch.BondBridge()
+        spec.bridge.nicDevice = list(desired.nics)
+
+    if desired.active_nics is None and desired.standby_nics is None and desired.teaming is None:
+        return spec
+    if spec.policy is None:
+        spec.policy = vim.host.NetworkPolicy()
+    if spec.policy.nicTeaming is None:
+        spec.policy.nicTeaming = vim.host.NetworkPolicy.NicTeamingPolicy()
+    teaming = spec.policy.nicTeaming
+    if desired.teaming is not None:
+        teaming.policy = desired.teaming.value
+    if desired.active_nics is not None or desired.standby_nics is not None:
+        if teaming.nicOrder is None:
+            teaming.nicOrder = vim.host.NetworkPolicy.NicOrderPolicy()
+        if desired.active_nics is not None:
+            teaming.nicOrder.activeNic = list(desired.active_nics)
+        if desired.standby_nics is not None:
+            teaming.nicOrder.standbyNic = list(desired.standby_nics)
+    return spec
+
+
+def _switch_key(spec: vim.host.VirtualSwitch.Specification) -> tuple:
+    teaming = spec.policy.nicTeaming if spec.policy is not None else None
+    order = teaming.nicOrder if teaming is not None else None
+    return (spec.numPorts, spec.mtu,
+            list(spec.bridge.nicDevice) if isinstance(spec.bridge, vim.host.VirtualSwitch.BondBridge) else None,
+            teaming.policy if teaming is not None else None,
+            list(order.activeNic) if order is not None else None,
+            list(order.standbyNic) if order is not None else None)
+
+
+def _portgroup_spec(spec: vim.host.PortGroup.Specification, desired: PortgroupState) -> vim.host.PortGroup.Specification:
+    spec = copy.deepcopy(spec) if spec is not None else vim.host.PortGroup.Specification(
+        name=desired.name, policy=vim.host.NetworkPolicy())
+    spec.vswitchName = desired.switch
+    spec.vlanId = int(desired.vlan_id)
+    flags = {'allowPromiscuous': desired.allow_promiscuous,
+             'macChanges': desired.mac_changes,
+             'forgedTransmits': desired.forged_transmits}
+    if any(value is not None for value in flags.values()):
+        if spec.policy is None:
+            spec.policy = vim.host.NetworkPolicy()
+        if spec.policy.security is None:
+            spec.policy.security = vim.host.NetworkPolicy.SecurityPolicy()
+        for flag, value in flags.items():
+            if value is not None:
+                setattr(spec.policy.security, flag, value)
+    return spec
+
+
+def _portgroup_key(spec: vim.host.PortGroup.Specification) -> tuple:
+    security = spec.policy.security if spec.policy is not None else None
+    return (spec.vswitchName, spec.vlanId,
+            security.allowPromiscuous if security is not None else None,
+            security.macChanges if security is not None else None,
+            security.forgedTransmits if security is not None else None)
+
+
+def _ip_key(ip: vim.host.IpConfig) -> tuple:
+    return (ip.dhcp, ip.ipAddress, ip.subnetMask) if ip is not None else None
+
+
+def plan_host_network(network: vim.host.NetworkInfo, desired: HostNetworkState) -> vim.host.NetworkConfig:
+    """
+    Compute the changes bringing the network of a host to the desired state
+    :param network: current network of the host, host.config.network
+    :param desired: HostNetworkState
+    :return: a NetworkConfig with only the changed objects, for UpdateNetworkConfig in 'modify' mode.
+        None if the host is already in the desired state.
+    """
+    switches = {switch.name: switch for switch in network.vswitch or []}
+    portgroups = {portgroup.spec.name: portgroup for portgroup in network.portgroup or []}
+    vnics = list(network.vnic or [])
+    config = vim.host.NetworkConfig(vswitch=[], portgroup=[], vnic=[])
+
+    for state in desired.switches:
+        current = switches.get(state.name)
+        spec = _switch_spec(current.spec if current is not None else None, state)
+        if current is None:
+            config.vswitch.append(vim.host.VirtualSwitch.Config(changeOperation='add', name=state.name, spec=spec))
+        elif _switch_key(spec) != _switch_key(current.spec):
+            config.vswitch.append(vim.host.VirtualSwitch.Config(changeOperation='edit', name=state.name, spec=spec))
+
+    for state in desired.portgroups:
+        current = portgroups.get(state.name)
+        spec = _portgroup_spec(current.spec if current is not None else None, state)
+        if current is None:
+            config.portgroup.append(vim.host.PortGroup.Config(changeOperation='add', spec=spec))
+        elif _portgroup_key(spec) != _portgroup_key(current.spec):
+            config.portgroup.append(vim.host.PortGroup.Config(changeOperation='edit', spec=spec))
+
+    for state in desired.vnics:
+        if state.device is not None:
+            current = next((vnic for vnic in vnics if vnic.device == state.device), None)
+        else:
+            current = next((vnic for vnic in vnics if vnic.portgroup == state.portgroup), None)
+        if current is None:
+            spec = vim.host.VirtualNic.Specification(ip=state.ip, mtu=state.mtu)
+            config.vnic.append(vim.host.VirtualNic.Config(changeOperation='add', portgroup=state.portgroup, spec=spec))
+            continue
+        spec = copy.deepcopy(current.spec)
+        if state.ip is not None:
+            spec.ip = state.ip
+        if state.mtu is not None:
+            spec.mtu = state.mtu
+        if (current.portgroup != state.portgroup or spec.mtu != current.spec.mtu or
+                _ip_key(spec.ip) != _ip_key(current.spec.ip)):
+            spec.portgroup = state.portgroup
+            config.vnic.append(vim.host.VirtualNic.Config(changeOperation='edit', device=current.device,
+                                                          portgroup=state.portgroup, spec=spec))
+
+    for name in desired.remove_portgroups:
+        if name in portgroups:
+            config.portgroup.append(vim.host.PortGroup.Config(changeOperation='remove', spec=portgroups[name].spec))
+    for name in desired.remove_switches:
+        if name in switches:
+            config.vswitch.append(vim.host.VirtualSwitch.Config(changeOperation='remove', name=name))
+
+    if not (config.vswitch or config.portgroup or config.vnic):
+        return None
+    return config
+
+
+def reconcile_host_networks(si: vim.ServiceInstance,
+                            desired: Dict[vim.HostSystem, HostNetworkState],
+                            max_concurrency: int = 20,
+                            dry_run: bool = False,
+                            logger: Logger = None) -> List[NetworkResult]:
+    """
+    Bring the standard networking of many hosts to a desired state.
+    The networks of all the hosts are read with a single property retrieval, then each host
+    gets only its changes in a single UpdateNetworkConfig call, the hosts run concurrently.
+    :param si: Connection to vCenter Server
+    :param desired: {host: HostNetworkState}
+    :param max_concurrency: max number of hosts updated at the same time
+    :param dry_run: True to only compute the changes
+    :param logger: Logger
+    :return: a NetworkResult for each host, in the order of desired
+    """
+    hosts = list(desired)
+    networks = get_host_networks(si, hosts, refresh=True)
+
+    def reconcile(host):
+        try:
+            if host not in networks:
+                raise LookupError(host_network_missing(host))
+            config = plan_host_network(networks[host].network, desired[host])
+            if config is not None and not dry_run:
+                try:
+                    networks[host].network_system.UpdateNetworkConfig(config, 'modify')
+                finally:
+                    invalidate_host_network(host)
+            return NetworkResult(host, config, None)
+        except Exception as e:
+            return NetworkResult(host, None, e)
+
+    with ThreadPoolExecutor(max_concurrency, thread_name_prefix="vcs-network") as pool:
+        results = list(pool.map(reconcile, hosts))
+
+    changed = sum(1 for result in results if result.config is not None)
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Network: %d hosts %s, %d unchanged, %d failed." % (
+        changed, "to change" if dry_run else "changed", len(results) - changed - failed, failed), logger)
+    return results
+
+
+instrument_module(__name__)
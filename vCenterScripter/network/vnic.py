@@ -1,5 +1,7 @@
 from vCenterScripter.common import *
 from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.network.netconfig import get_host_network, invalidates_host_network
 
 
 def list_host_vnics(host: vim.HostSystem) -> set:
@@ -8,7 +10,7 @@ def list_host_vnics(host: vim.HostSystem) -> set:
     :param host: Host
     :return a set of names of the host  VNICs.
     """
-    return list_host_objects(host.config.network.vnic)
+    return set(get_host_network(host).vnics)
 
 
 def get_host_nic(host: vim.HostSystem, name: str) -> vim.host.VirtualNic:
@@ -17,9 +19,10 @@ def get_host_nic(host: vim.HostSystem, name: str) -> vim.host.VirtualNic:
     :param name: of the vSwitch
     :param host: Host
     """
-    return get_host_object(host.config.network.vnic, name)
+    return get_host_network(host).vnics.get(name)
 
 
+@invalidates_host_network
 def add_host_vmnic_ip(host: vim.HostSystem, portgroup: vim.host.PortGroup, mtu: int, ip: vim.host.IpConfig, logger: Logger = None):
     """
     Add a VNic to a portgroup of a Host
@@ -39,6 +42,7 @@ def add_host_vmnic_ip(host: vim.HostSystem, portgroup: vim.host.PortGroup, mtu:
     print_("vmnic added!", logger)
 
 
+@invalidates_host_network
 def delete_host_vmnic(host: vim.HostSystem, vnic: vim.host.VirtualNic, logger: Logger = None):
     host.configManager.networkSystem.RemoveVirtualNic(vnic)
     print_("vminc deleted!", logger)
@@ -65,3 +69,5 @@ class vnic_services:
     def __init__(self, services):
         self.services = services
 
+
+instrument_module(__name__)
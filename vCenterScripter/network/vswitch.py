@@ -1,6 +1,13 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import List, NamedTuple
+
 from vCenterScripter.common import *
 from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.network.netconfig import (get_host_network, get_host_networks, host_network_missing,
+                                               invalidate_host_network, invalidates_host_network)
 
 
 class Nic_Teaming(Enum):
@@ -16,7 +23,7 @@ def list_host_switches(host: vim.HostSystem) -> set:
     :param host: Host
     :return a set of names of the host vswitches.
     """
-    return list_host_objects(host.config.network.vswitch)
+    return set(get_host_network(host).switches)
 
 
 def get_host_switch(host: vim.HostSystem, name: str) -> vim.host.VirtualSwitch:
@@ -25,9 +32,10 @@ def get_host_switch(host: vim.HostSystem, name: str) -> vim.host.VirtualSwitch:
     :param name: of the vSwitch
     :param host: Host
     """
-    return get_host_object(host.config.network.vswitch, name)
+    return get_host_network(host).switches.get(name)
 
 
+@invalidates_host_network
 def add_host_switch(host: vim.HostSystem, name: str, num_ports: int, mtu:int, logger: Logger = None):
     """
     Create a new vSwitch on the host
@@ -44,6 +52,7 @@ def add_host_switch(host: vim.HostSystem, name: str, num_ports: int, mtu:int, lo
     print_("Host: Added " + name + " vSwitch - (" + str(num_ports) + ":"+str(mtu)+")", logger)
 
 
+@invalidates_host_network
 def delete_host_switch(host: vim.HostSystem, name: str, logger: Logger = None):
     """
     Delete a virtual switch from a host
@@ -55,6 +64,150 @@ def delete_host_switch(host: vim.HostSystem, name: str, logger: Logger = None):
     print_("Host: Deleted " + name + " vSwitch", logger)
 
 
+class UplinkChange(NamedTuple):
+    """
+    A change of the uplinks or of the teaming policy of a vSwitch, for change_uplinks.
+    role is 'active', 'standby' or 'remove'. nic None changes only the teaming policy.
+    """
+    host: vim.HostSystem
+    switch: str
+    nic: str = None
+    role: str = 'active'
+    teaming: Nic_Teaming = None
+
+
+class UplinkResult(NamedTuple):
+    """
+    Result of change_uplinks on a single vSwitch.
+    spec is the Specification sent to the host, None if the vSwitch was already as requested.
+    """
+    host: vim.HostSystem
+    switch: str
+    spec: vim.host.VirtualSwitch.Specification
+    error: Exception
+
+
+def merge_uplink_changes(spec: vim.host.VirtualSwitch.Specification,
+                         changes: List[UplinkChange]) -> vim.host.VirtualSwitch.Specification:
+    """
+    Apply many uplink changes to a copy of the specification of a vSwitch, in order
+    :param spec: current Specification of the vSwitch
+    :param changes: UplinkChange of the vSwitch
+    :return: the new Specification
+    :raise ValueError: if the uplinks of a vSwitch not bridged by a BondBridge are changed, or a role is unknown
+    """
+    if (spec.bridge is not None and not isinstance(spec.bridge, vim.host.VirtualSwitch.BondBridge) and
+            any(change.nic is not None for change in changes)):
+        raise ValueError("Uplinks of a vSwitch with a %s cannot be changed, only a BondBridge"
+                         % type(spec.bridge).__name__)
+    spec = copy.deepcopy(spec)
+    if spec.bridge is None:
+        spec.bridge = vim.host.VirtualSwitch.BondBridge()
+    if spec.policy is None:
+        spec.policy = vim.host.NetworkPolicy()
+    if spec.policy.nicTeaming is None:
+        spec.policy.nicTeaming = vim.host.NetworkPolicy.NicTeamingPolicy()
+    nic_config = spec.policy.nicTeaming
+    if nic_config.nicOrder is None:
+        nic_config.nicOrder = vim.host.NetworkPolicy.NicOrderPolicy()
+    order = nic_config.nicOrder
+
+    for change in changes:
+        if change.teaming is not None:
+            nic_config.policy = change.teaming.value
+        if change.nic is None:
+            continue
+        device = getattr(change.nic, 'device', change.nic)
+        for devices in (order.activeNic, order.standbyNic):
+            if device in devices:
+                devices.remove(device)
+        if change.role == 'remove':
+            if device in spec.bridge.nicDevice:
+                spec.bridge.nicDevice.remove(device)
+            continue
+        if change.role == 'active':
+            order.activeNic.append(device)
+        elif change.role == 'standby':
+            order.standbyNic.append(device)
+        else:
+            raise ValueError("Unknown uplink role %r" % change.role)
+        if device not in spec.bridge.nicDevice:
+            spec.bridge.nicDevice.append(device)
+    return spec
+
+
+def _switch_state(spec: vim.host.VirtualSwitch.Specification) -> tuple:
+    nic_config = spec.policy.nicTeaming if spec.policy is not None else None
+    order = nic_config.nicOrder if nic_config is not None else None
+    return (list(spec.bridge.nicDevice) if spec.bridge is not None else [],
+            nic_config.policy if nic_config is not None else None,
+            list(order.activeNic) if order is not None else [],
+            list(order.standbyNic) if order is not None else [])
+
+
+def change_uplinks(si: vim.ServiceInstance, changes: List[UplinkChange],
+                   max_concurrency: int = 20, logger: Logger = None) -> List[UplinkResult]:
+    """
+    Change the uplinks and the teaming policies of many vSwitches at once, for example to migrate
+    the uplinks of a cluster. The networks of the hosts are read with a single property retrieval,
+    the changes are merged into one UpdateVirtualSwitch call per vSwitch, the hosts run concurrently.
+    :param si: Connection to vCenter Server
+    :param changes: the UplinkChange, applied in order
+    :param max_concurrency: max number of hosts updated at the same time
+    :param logger: Logger
+    :return: an UplinkResult for each vSwitch, in the order of their first change
+    """
+    by_host = {}
+    for change in changes:
+        switch = getattr(change.switch, 'name', change.switch)
+        by_host.setdefault(change.host, {}).setdefault(switch, []).append(change)
+    # Read again, like in _update_switch
+    networks = get_host_networks(si, by_host, refresh=True)
+
+    def update(host):
+        network = networks.get(host)
+        results = []
+        try:
+            for switch, switch_changes in by_host[host].items():
+                try:
+                    if network is None:
+                        raise LookupError(host_network_missing(host))
+                    current = network.switches.get(switch)
+                    if current is None:
+                        raise LookupError("vSwitch %s not found on %s" % (switch, host.name))
+                    spec = merge_uplink_changes(current.spec, switch_changes)
+                    if _switch_state(spec) == _switch_state(current.spec):
+                        spec = None
+                    else:
+                        network.network_system.UpdateVirtualSwitch(switch, spec)
+                    results.append(UplinkResult(host, switch, spec, None))
+                except Exception as e:
+                    results.append(UplinkResult(host, switch, None, e))
+        finally:
+            invalidate_host_network(host)
+        return results
+
+    with ThreadPoolExecutor(max_concurrency, thread_name_prefix="vcs-uplinks") as pool:
+        results = [result for host_results in pool.map(update, by_host) for result in host_results]
+
+    changed = sum(1 for result in results if result.spec is not None)
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Uplinks: %d vSwitches changed, %d unchanged, %d failed." % (
+        changed, len(results) - changed - failed, failed), logger)
+    return results
+
+
+def _update_switch(host: vim.HostSystem, switch: vim.host.VirtualSwitch, changes: List[UplinkChange]):
+    # The spec is merged into the current one: a cached view could undo the changes made by others
+    network = get_host_network(host, refresh=True)
+    current = network.switches.get(switch.name)
+    if current is None:
+        raise LookupError("vSwitch %s not found on %s" % (switch.name, host.name))
+    spec = merge_uplink_changes(current.spec, changes)
+    network.network_system.UpdateVirtualSwitch(switch.name, spec)
+
+
+@invalidates_host_network
 def add_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitch, nic: vim.host.PhysicalNic, active = True):
     """
     Add a Nic to vSwitch
@@ -63,18 +216,10 @@ def add_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitch, nic: vim
     :param nic: Network Interface
     :param active: true for insert in Active, False for standby
     """
-    host_config = next(x for x in host.config.network.vswitch if x.name == switch.name)
-    nic_config = host_config.spec.policy.nicTeaming
-
-    if active:
-        nic_config.nicOrder.activeNic.append(nic.device)
-    else:
-        nic_config.nicOrder.standbyNic.append(nic.device)
-
-    host_config.spec.bridge.nicDevice.append(nic.device)
-    host.configManager.networkSystem.UpdateVirtualSwitch(switch.name, host_config.spec)
+    _update_switch(host, switch, [UplinkChange(host, switch.name, nic.device, 'active' if active else 'standby')])
 
 
+@invalidates_host_network
 def remove_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitch, nic: vim.host.PhysicalNic):
     """
     Remove a Nic from vSwitch
@@ -82,21 +227,10 @@ def remove_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitch, nic:
     :param switch: The Switch
     :param nic: Network Interface
     """
-    host_config = next(x for x in host.config.network.vswitch if x.name == switch.name)
-    nic_config = host_config.spec.policy.nicTeaming
-
-    if nic.device in nic_config.nicOrder.activeNic:
-        nic_config.nicOrder.activeNic.remove(nic.device)
-
-    if nic.device in nic_config.nicOrder.standbyNic:
-        nic_config.nicOrder.standbyNic.remove(nic.device)
-
-    if nic.device in host_config.spec.bridge.nicDevice:
-        host_config.spec.bridge.nicDevice.remove(nic.device)
-
-    host.configManager.networkSystem.UpdateVirtualSwitch(switch.name, host_config.spec)
+    _update_switch(host, switch, [UplinkChange(host, switch.name, nic.device, 'remove')])
 
 
+@invalidates_host_network
 def change_teaming_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitch, teaming: Nic_Teaming):
     """
     Change the teaming policy of a vSwitch
@@ -104,7 +238,7 @@ def change_teaming_nic_switch(host: vim.HostSystem, switch:vim.host.VirtualSwitc
     :param switch: Virtual Switch
     :param teaming: check nic_teaming Enum.
     """
-    host_config = next(x for x in host.config.network.vswitch if x.name == switch.name)
-    nic_config = host_config.spec.policy.nicTeaming
-    nic_config.policy = teaming.value
-    host.configManager.networkSystem.UpdateVirtualSwitch(switch.name, host_config.spec)
+    _update_switch(host, switch, [UplinkChange(host, switch.name, teaming=teaming)])
+
+
+instrument_module(__name__)
@@ -1,9 +1,111 @@
-from pyvim.task import WaitForTask
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, NamedTuple
+
 from pyVmomi import vim
 
-from vCenterScripter.common import list_obj_names, get_object
+from vCenterScripter.common import get_object, get_properties, iter_properties, list_obj_names
 from vCenterScripter.logger import Logger, print_
-from vCenterScripter.vm import refresh_vm
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.tasks import wait_task
+from vCenterScripter.vm import BatchResult, invalidate_vm_hardware, refresh_vm, run_batch
+
+# Standard max number of snapshot tasks running at the same time on VMs of the same datastore
+SNAPSHOT_TASKS_PER_DATASTORE = 4
+
+
+class SnapshotIndex:
+    """
+    Index of the snapshot tree of a VM by name, id and creation time, built in a single pass
+    """
+    def __init__(self, root_snapshots: list = None):
+        """
+        :param root_snapshots: rootSnapshotList of the VM, None if it has no snapshots
+        """
+        self.trees = []
+        self.by_name = {}
+        self.by_id = {}
+        self._parents = {}
+
+        # Depth-first, parents before children, in the order of the tree
+        stack = [(tree, None) for tree in reversed(root_snapshots or [])]
+        while stack:
+            tree, parent = stack.pop()
+            self.trees.append(tree)
+            self.by_name.setdefault(tree.name, []).append(tree)
+            self.by_id[tree.id] = tree
+            self._parents[tree.id] = parent
+            stack.extend((child, tree) for child in reversed(tree.childSnapshotList or []))
+
+        self.by_time = sorted(self.trees, key=lambda tree: tree.createTime)
+        self._times = [tree.createTime for tree in self.by_time]
+
+    def __len__(self) -> int:
+        return len(self.trees)
+
+    def __iter__(self) -> Iterator[vim.vm.SnapshotTree]:
+        return iter(self.trees)
+
+    def find(self, name: str) -> List[vim.vm.SnapshotTree]:
+        """
+        Get the snapshots with a name
+        :param name: Name of the snapshot
+        :return: list of SnapshotTree, in the order of the tree
+        """
+        return list(self.by_name.get(name, ()))
+
+    def get(self, snapshot_id: int) -> vim.vm.SnapshotTree:
+        """
+        Get a snapshot by id
+        :param snapshot_id: id of the snapshot
+        :return: the SnapshotTree, None if not found
+        """
+        return self.by_id.get(snapshot_id)
+
+    def parent(self, tree: vim.vm.SnapshotTree) -> vim.vm.SnapshotTree:
+        """
+        Get the parent of a snapshot
+        :param tree: SnapshotTree of the index
+        :return: the parent SnapshotTree, None for a root snapshot
+        """
+        return self._parents.get(tree.id)
+
+    def older_than(self, cutoff: datetime) -> List[vim.vm.SnapshotTree]:
+        """
+        Get the snapshots created before a time
+        :param cutoff: datetime with time zone
+        :return: list of SnapshotTree, oldest first
+        """
+        return self.by_time[:bisect_left(self._times, cutoff)]
+
+
+def get_snapshot_index(vm: vim.VirtualMachine) -> SnapshotIndex:
+    """
+    Read the snapshot tree of a VM
+    :param vm: Virtual Machine
+    :return: the SnapshotIndex
+    """
+    snapshot = vm.snapshot
+    return SnapshotIndex(snapshot.rootSnapshotList if snapshot is not None else None)
+
+
+def get_snapshot_indexes(si: vim.ServiceInstance, vms: list = None) -> Dict[vim.VirtualMachine, SnapshotIndex]:
+    """
+    Read the snapshot trees of many VMs with a single property retrieval
+    :param si: Connection to vCenter Server
+    :param vms: the Virtual Machines. Standard all the VMs of the vCenter
+    :return: a dict {vm: SnapshotIndex}
+    """
+    if vms is None:
+        properties = iter_properties(si, vim.VirtualMachine, ['snapshot'])
+    else:
+        properties = get_properties(si, vms, ['snapshot']).items()
+
+    indexes = {}
+    for vm, props in properties:
+        snapshot = props.get('snapshot')
+        indexes[vm] = SnapshotIndex(snapshot.rootSnapshotList if snapshot is not None else None)
+    return indexes
 
 
 def generate_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, name: str, desc: str = "", logger: Logger = None,
@@ -19,16 +121,20 @@ def generate_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, name: s
     :param memory: Memory
     :return: Virtual Machine refreshed
     """
-    WaitForTask(vm.CreateSnapshot_Task(name=name,
-                                       description=desc,
-                                       memory=memory,
-                                       quiesce=quiesce))
+    try:
+        # The disks move to new delta backings
+        wait_task(vm.CreateSnapshot_Task(name=name,
+                                         description=desc,
+                                         memory=memory,
+                                         quiesce=quiesce))
+    finally:
+        invalidate_vm_hardware(vm)
     print_("Snapshot %s generated" % name, logger)
     return refresh_vm(conn, vm)
 
 
 def delete_revert_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, name: str,
-                           delete: bool, logger: Logger = None) -> vim.VirtualMachine:
+                           delete: bool, logger: Logger = None, index: SnapshotIndex = None) -> vim.VirtualMachine:
     """
     Delete or revert a snapshot
     :param conn: To refresh VM once executed the operation
@@ -36,17 +142,27 @@ def delete_revert_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, na
     :param name: Name of the snapshot to revert or to be removed
     :param delete: True for deletion, False for revert
     :param logger: Logger
+    :param index: SnapshotIndex of the VM, to skip reading its snapshot tree
     :return: Virtual Machine refreshed
     """
-    snap_obj = get_snapshots_by_name_recursively(vm.snapshot.rootSnapshotList, name)
+    if index is None:
+        index = get_snapshot_index(vm)
+    snap_obj = index.find(name)
     if len(snap_obj) == 1:
         snap_obj = snap_obj[0].snapshot
-        if delete:
-            print_("Removing snapshot %s" % name, logger)
-            WaitForTask(snap_obj.RemoveSnapshot_Task(True))
-        else:
-            print_("Reverting to snapshot %s" % name, logger)
-            WaitForTask(snap_obj.RevertToSnapshot_Task())
+        # Both change the devices of the VM: a revert brings back the ones of the snapshot,
+        # a removal the backings of the disks
+        try:
+            if delete:
+                print_("Removing snapshot %s" % name, logger)
+                wait_task(snap_obj.RemoveSnapshot_Task(True))
+            else:
+                print_("Reverting to snapshot %s" % name, logger)
+                wait_task(snap_obj.RevertToSnapshot_Task())
+        finally:
+            invalidate_vm_hardware(vm)
+    elif snap_obj:
+        print_("%d snapshots named %s on VM: %s, none of them changed" % (len(snap_obj), name, vm.name), logger)
     else:
         print_("No snapshots found with name: %s on VM: %s" % (
             name, vm.name), logger)
@@ -54,16 +170,130 @@ def delete_revert_snapshot(conn: vim.ServiceInstance, vm: vim.VirtualMachine, na
     return refresh_vm(conn, vm)
 
 
-def get_snapshots_by_name_recursively(snapshots, snapname: str):
-    """"""
-    snap_obj = []
-    for snapshot in snapshots:
-        if snapshot.name == snapname:
-            snap_obj.append(snapshot)
-        else:
-            snap_obj = snap_obj + get_snapshots_by_name_recursively(
-                snapshot.childSnapshotList, snapname)
-    return snap_obj
+def get_snapshots_by_name_recursively(snapshots, snapname: str) -> List[vim.vm.SnapshotTree]:
+    """
+    Get the snapshots with a name in a snapshot tree, also the ones below another match
+    :param snapshots: rootSnapshotList of a VM
+    :param snapname: Name of the snapshot
+    :return: list of SnapshotTree
+    """
+    return SnapshotIndex(snapshots).find(snapname)
+
+
+def create_snapshots(vms: List[vim.VirtualMachine], name: str, desc: str = "",
+                     quiesce: bool = False, memory: bool = False,
+                     max_concurrency: int = 10,
+                     max_per_datastore: int = SNAPSHOT_TASKS_PER_DATASTORE,
+                     logger: Logger = None) -> List[BatchResult]:
+    """
+    Generate a snapshot on many VMs at once
+    :param vms: The Virtual Machines
+    :param name: Name of snapshot
+    :param desc: Description of the snapshot
+    :param quiesce: Quiesce
+    :param memory: Memory
+    :param max_concurrency: max number of tasks running at the same time
+    :param max_per_datastore: max number of tasks running at the same time on VMs of the same datastore
+    :param logger: Logger
+    :return: a BatchResult for each VM, the result is the Snapshot
+    """
+    results = run_batch(lambda vm: vm.CreateSnapshot_Task(name=name, description=desc,
+                                                          memory=memory, quiesce=quiesce),
+                        vms, max_concurrency=max_concurrency, max_per_datastore=max_per_datastore)
+    for result in results:
+        invalidate_vm_hardware(result.vm)
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Snapshot %s generated on %d VMs, %d failed." % (name, len(results) - failed, failed), logger)
+    return results
+
+
+class SnapshotRemoval(NamedTuple):
+    """
+    Result of delete_snapshots_older_than on a single snapshot
+    """
+    vm: vim.VirtualMachine
+    name: str
+    create_time: datetime
+    error: Exception
+
+
+def delete_snapshots_older_than(si: vim.ServiceInstance, older_than, vms: list = None,
+                                name: str = None, consolidate: bool = True,
+                                max_concurrency: int = 10,
+                                max_per_datastore: int = SNAPSHOT_TASKS_PER_DATASTORE,
+                                logger: Logger = None) -> List[SnapshotRemoval]:
+    """
+    Delete the snapshots created before a time, across the inventory.
+    The snapshot trees are read with a single property retrieval. A VM runs one task at a time:
+    its snapshots are removed oldest first, one per round, the VMs of a round run concurrently.
+    :param si: Connection to vCenter Server
+    :param older_than: datetime with time zone, or timedelta before now
+    :param vms: the Virtual Machines. Standard all the VMs of the vCenter
+    :param name: only the snapshots with this name. None for all
+    :param consolidate: True to consolidate the disks after each removal
+    :param max_concurrency: max number of tasks running at the same time
+    :param max_per_datastore: max number of tasks running at the same time on VMs of the same datastore
+    :param logger: Logger
+    :return: a SnapshotRemoval for each snapshot, in the order of removal
+    :raise ValueError: if older_than is a datetime without time zone
+    """
+    if isinstance(older_than, timedelta):
+        cutoff = datetime.now(timezone.utc) - older_than
+    elif older_than.tzinfo is None or older_than.utcoffset() is None:
+        raise ValueError("older_than must have a time zone, for example datetime(..., tzinfo=timezone.utc)")
+    else:
+        cutoff = older_than
+    pending = {}
+    for vm, index in get_snapshot_indexes(si, vms).items():
+        trees = [tree for tree in index.older_than(cutoff) if name is None or tree.name == name]
+        if trees:
+            pending[vm] = trees
+
+    removals = []
+    while pending:
+        round_vms = list(pending)
+        trees = {vm: pending[vm].pop(0) for vm in round_vms}
+        results = run_batch(lambda vm: trees[vm].snapshot.RemoveSnapshot_Task(removeChildren=False, consolidate=consolidate),
+                            round_vms, max_concurrency=max_concurrency, max_per_datastore=max_per_datastore)
+        for result in results:
+            invalidate_vm_hardware(result.vm)
+            tree = trees[result.vm]
+            removals.append(SnapshotRemoval(result.vm, tree.name, tree.createTime, result.error))
+        pending = {vm: remaining for vm, remaining in pending.items() if remaining}
+
+    failed = sum(1 for removal in removals if removal.error is not None)
+    print_("Snapshots older than %s: %d removed, %d failed." % (cutoff.isoformat(), len(removals) - failed, failed),
+           logger)
+    return removals
+
+
+def consolidate_vms(si: vim.ServiceInstance, vms: list = None,
+                    max_concurrency: int = 10,
+                    max_per_datastore: int = SNAPSHOT_TASKS_PER_DATASTORE,
+                    logger: Logger = None) -> List[BatchResult]:
+    """
+    Consolidate the disks of the VMs that need it, found with a single property retrieval
+    :param si: Connection to vCenter Server
+    :param vms: the Virtual Machines. Standard all the VMs of the vCenter
+    :param max_concurrency: max number of tasks running at the same time
+    :param max_per_datastore: max number of tasks running at the same time on VMs of the same datastore
+    :param logger: Logger
+    :return: a BatchResult for each consolidated VM
+    """
+    path = 'runtime.consolidationNeeded'
+    if vms is None:
+        properties = iter_properties(si, vim.VirtualMachine, [path])
+    else:
+        properties = get_properties(si, vms, [path]).items()
+    needed = [vm for vm, props in properties if props.get(path)]
+
+    results = run_batch('ConsolidateVMDisks_Task', needed,
+                        max_concurrency=max_concurrency, max_per_datastore=max_per_datastore)
+    for result in results:
+        invalidate_vm_hardware(result.vm)
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Consolidate: %d VMs consolidated, %d failed." % (len(results) - failed, failed), logger)
+    return results
 
 
 def list_datastores(si: vim.ServiceInstance) -> set:
@@ -84,4 +314,7 @@ def get_datastore(si: vim.ServiceInstance, name: str = "") -> vim.Datastore:
     """
     return get_object(si, vim.Datastore, name)
 
-# TODO Add - Remove a Datastore
\ No newline at end of file
+# TODO Add - Remove a Datastore
+
+
+instrument_module(__name__)
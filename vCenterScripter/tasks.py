@@ -0,0 +1,446 @@
+import asyncio
+import threading
+from concurrent.futures import Future, FIRST_COMPLETED, InvalidStateError, wait
+from typing import Callable, List, NamedTuple
+
+from vCenterScripter.common import *
+from vCenterScripter.metrics import task_wait
+
+TASK_PROPERTIES = ['info.state', 'info.result', 'info.error', 'info.progress']
+
+# Failed waits retried on a new filter before the pending tasks are failed
+WAIT_RETRIES = 5
+# Seconds before the first retry, doubled at each following one
+RETRY_INTERVAL = 1.0
+# Errors meaning that the session is gone: the pending tasks can't be waited anymore
+SESSION_ERRORS = (vim.fault.NotAuthenticated,)
+
+
+class TaskOutcome(NamedTuple):
+    """
+    Final state of a Task
+    """
+    task: vim.Task
+    state: str
+    result: object
+    error: Exception
+
+
+class TaskWatcher:
+    """
+    Wait on many Tasks with a single PropertyCollector filter.
+    The filter traverses a ListView: tasks are added to and removed from the view, the filter
+    and the WaitForUpdatesEx loop are shared by all of them.
+    add() can be called from any thread while another one is blocked in wait().
+    """
+    def __init__(self, si: vim.ServiceInstance, on_progress: Callable = None):
+        """
+        :param si: Connection to vCenter Server
+        :param on_progress: called as on_progress(task, percent) when the progress of a task changes
+        """
+        self.on_progress = on_progress
+        self._lock = threading.Lock()
+        self._collector = get_property_collector(si).CreatePropertyCollector()
+        self._view = get_manager(si, 'viewManager').CreateListView([])
+        self._version = None
+        self._info = {}
+        self._pending = set()
+        self._finished = []
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseTasks', path='view', skip=False, type=vim.view.ListView)
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(
+            obj=self._view, skip=True, selectSet=[traversal_spec])
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(
+            type=vim.Task, pathSet=TASK_PROPERTIES, all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=[property_spec])
+        self._filter = self._collector.CreateFilter(filter_spec, True)
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of tasks not yet completed
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, tasks: list):
+        """
+        Start watching tasks. The completed tasks are removed from the view in the same call.
+        :param tasks: list of Tasks
+        """
+        with self._lock:
+            tasks = [task for task in tasks if task not in self._pending]
+            finished = [task for task in self._finished if task not in tasks]
+            if not tasks and not finished:
+                return
+            self._view.ModifyListView(add=tasks, remove=finished)
+            self._finished = []
+            self._pending.update(tasks)
+
+    def wait(self, max_wait_seconds: int = 60) -> List[TaskOutcome]:
+        """
+        Wait for the next tasks to complete, with a single WaitForUpdatesEx call
+        :param max_wait_seconds: max seconds to wait
+        :return: the tasks completed meanwhile, possibly none
+        """
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max_wait_seconds)
+        update_set = self._collector.WaitForUpdatesEx(self._version, options)
+        if update_set is None:
+            return []
+
+        completed = []
+        progress = []
+        with self._lock:
+            self._version = update_set.version
+            for filter_update in update_set.filterSet or []:
+                for object_update in filter_update.objectSet or []:
+                    task = object_update.obj
+                    if task not in self._pending:
+                        continue
+                    info = self._info.setdefault(task, {})
+                    for change in object_update.changeSet or []:
+                        info[change.name] = change.val
+                        if change.name == 'info.progress' and change.val is not None:
+                            progress.append((task, change.val))
+
+                    state = info.get('info.state')
+                    if state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+                        self._pending.discard(task)
+                        self._finished.append(task)
+                        del self._info[task]
+                        completed.append(TaskOutcome(task, state, info.get('info.result'), info.get('info.error')))
+
+        if self.on_progress is not None:
+            for task, percent in progress:
+                self.on_progress(task, percent)
+        return completed
+
+    def cancel_wait(self):
+        """
+        Wake up a thread blocked in wait()
+        """
+        self._collector.CancelWaitForUpdates()
+
+    def close(self):
+        """
+        Destroy the filter, the view and the PropertyCollector
+        """
+        self._filter.DestroyPropertyFilter()
+        self._view.DestroyView()
+        self._collector.DestroyPropertyCollector()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TaskFuture(Future):
+    """
+    Future of a Task tracked by a TaskTracker. It can also be awaited in asyncio.
+    """
+    def __init__(self, task: vim.Task):
+        super().__init__()
+        self.task = task
+
+    def waiter(self) -> Future:
+        """
+        Get a new Future resolved like this one, for a single waiter: cancelling it, for example
+        at the timeout of asyncio.wait_for, leaves this shared TaskFuture and its other waiters untouched
+        :return: the Future
+        """
+        waiter = Future()
+
+        def resolve(future):
+            try:
+                if future.cancelled():
+                    waiter.cancel()
+                elif future.exception() is not None:
+                    waiter.set_exception(future.exception())
+                else:
+                    waiter.set_result(future.result())
+            except InvalidStateError:
+                # The waiter was cancelled meanwhile
+                pass
+
+        self.add_done_callback(resolve)
+        return waiter
+
+    def __await__(self):
+        return asyncio.wrap_future(self.waiter()).__await__()
+
+
+class TaskTracker:
+    """
+    Tracker of all the outstanding Tasks of a connection.
+    A single background thread waits on a single TaskWatcher filter and resolves a TaskFuture
+    for each tracked task: thousands of tasks can be in flight without a thread each.
+    A failed wait is retried on a new filter up to WAIT_RETRIES times, the futures fail
+    only when the session is lost or the retries are exhausted.
+    """
+    def __init__(self, si: vim.ServiceInstance, max_wait_seconds: int = 30):
+        """
+        :param si: Connection to vCenter Server
+        :param max_wait_seconds: max duration of a single WaitForUpdatesEx call
+        """
+        self.si = si
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        # Held while tasks are added to the watcher, so that a new watcher gets all of them
+        self._add_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._futures = {}
+        self._progress = {}
+        self._watcher = None
+        self._thread = None
+        self._closed = False
+
+    def track(self, task: vim.Task, on_progress: Callable = None) -> TaskFuture:
+        """
+        Track a task
+        :param task: the Task
+        :param on_progress: called as on_progress(task, percent) when the progress of the task changes
+        :return: a TaskFuture resolved with the result of the task, or failed with its error
+        """
+        return self.track_all([task], on_progress)[0]
+
+    def track_all(self, tasks: list, on_progress: Callable = None) -> List[TaskFuture]:
+        """
+        Track many tasks, adding them to the filter with a single call
+        :param tasks: list of Tasks
+        :param on_progress: called as on_progress(task, percent) when the progress of a task changes
+        :return: a TaskFuture for each task
+        """
+        futures = []
+        with self._add_lock:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("TaskTracker closed")
+                for task in tasks:
+                    future = self._futures.get(task)
+                    if future is None:
+                        future = TaskFuture(task)
+                        self._futures[task] = future
+                    if on_progress is not None:
+                        self._progress.setdefault(task, []).append(on_progress)
+                    futures.append(future)
+
+                if self._watcher is None:
+                    self._watcher = TaskWatcher(self.si, self._notify_progress)
+                watcher = self._watcher
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="vcs-task-tracker", daemon=True)
+                    self._thread.start()
+
+            watcher.add(tasks)
+        self._wakeup.set()
+        return futures
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of tasks not yet completed
+        """
+        with self._lock:
+            return len(self._futures)
+
+    def _notify_progress(self, task: vim.Task, percent: int):
+        with self._lock:
+            callbacks = list(self._progress.get(task, []))
+        for callback in callbacks:
+            callback(task, percent)
+
+    def _run(self):
+        failures = 0
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if self._closed:
+                    return
+                watcher = self._watcher
+                if not self._futures:
+                    self._wakeup.clear()
+                    continue
+
+            try:
+                outcomes = watcher.wait(self.max_wait_seconds)
+            except SESSION_ERRORS as e:
+                failures = 0
+                self._fail_all(watcher, e)
+                continue
+            except Exception as e:
+                # A dropped connection or a filter lost on the server: the tasks go on, wait on a new filter
+                failures += 1
+                if failures > WAIT_RETRIES:
+                    failures = 0
+                    self._fail_all(watcher, e)
+                elif not self._stop.wait(min(RETRY_INTERVAL * 2 ** (failures - 1), self.max_wait_seconds)):
+                    try:
+                        self._rebuild(watcher)
+                    except SESSION_ERRORS as session_error:
+                        failures = 0
+                        self._fail_all(watcher, session_error)
+                    except Exception:
+                        # Retried at the next failed wait
+                        pass
+                continue
+            failures = 0
+
+            for outcome in outcomes:
+                with self._lock:
+                    future = self._futures.pop(outcome.task, None)
+                    self._progress.pop(outcome.task, None)
+                if future is None or future.cancelled():
+                    continue
+                if outcome.error is not None:
+                    future.set_exception(outcome.error)
+                else:
+                    future.set_result(outcome.result)
+
+    def _rebuild(self, watcher: TaskWatcher):
+        # Replace the watcher with a new filter over all the tracked tasks,
+        # the ones completed meanwhile are reported by its first wait
+        with self._add_lock:
+            with self._lock:
+                if self._closed or self._watcher is not watcher:
+                    return
+                tasks = list(self._futures)
+            new_watcher = TaskWatcher(self.si, self._notify_progress)
+            try:
+                new_watcher.add(tasks)
+            except Exception:
+                new_watcher.close()
+                raise
+            with self._lock:
+                closed = self._closed
+                if not closed:
+                    self._watcher = new_watcher
+        if closed:
+            # close() took the old watcher meanwhile
+            new_watcher.close()
+            return
+        try:
+            watcher.close()
+        except Exception:
+            pass
+
+    def _fail_all(self, watcher: TaskWatcher, error: Exception):
+        # The filter is lost, for example with the session: the next track() creates a new one
+        with self._lock:
+            if self._closed:
+                return
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._progress.clear()
+            if self._watcher is watcher:
+                self._watcher = None
+        try:
+            watcher.close()
+        except Exception:
+            pass
+        for future in futures:
+            if not future.cancelled():
+                future.set_exception(error)
+
+    def close(self):
+        """
+        Stop the tracker thread and destroy the filter. The pending futures are cancelled.
+        """
+        with self._lock:
+            self._closed = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+            watcher = self._watcher
+            self._watcher = None
+        self._stop.set()
+        self._wakeup.set()
+        for future in futures:
+            future.cancel()
+        if watcher is not None:
+            try:
+                watcher.cancel_wait()
+            except Exception:
+                pass
+            if self._thread is not None:
+                self._thread.join(self.max_wait_seconds)
+            watcher.close()
+
+
+def get_task_tracker(obj) -> TaskTracker:
+    """
+    Get the TaskTracker of a connection, creating it if needed
+    :param obj: Connection to vCenter Server or any managed object retrieved from it, like a Task
+    :return: the TaskTracker
+    """
+    state = connection_state(obj)
+    with state.lock:
+        if state.tasks is None:
+            state.tasks = TaskTracker(service_instance(obj))
+        return state.tasks
+
+
+def track_task(task: vim.Task, on_progress: Callable = None) -> TaskFuture:
+    """
+    Track a task with the shared TaskTracker of its connection
+    :param task: the Task
+    :param on_progress: called as on_progress(task, percent) when the progress of the task changes
+    :return: a TaskFuture, resolved with the result of the task. It can be awaited in asyncio.
+    """
+    return get_task_tracker(task).track(task, on_progress)
+
+
+def wait_task(task: vim.Task, timeout: float = None, on_progress: Callable = None):
+    """
+    Wait for a task to complete
+    :param task: the Task
+    :param timeout: max seconds to wait. None to wait forever
+    :param on_progress: called as on_progress(task, percent) when the progress of the task changes
+    :return: the result of the task
+    :raise: the error of the task if it failed, TimeoutError if timeout expired
+    """
+    future = track_task(task, on_progress)
+    with task_wait():
+        return future.result(timeout)
+
+
+def wait_for_tasks(si: vim.ServiceInstance, tasks: list, raise_on_error: bool = True,
+                   on_progress: Callable = None) -> List[TaskOutcome]:
+    """
+    Wait for all the tasks to complete with the shared TaskTracker of the connection
+    :param si: Connection to vCenter Server
+    :param tasks: list of Tasks
+    :param raise_on_error: True to raise the error of the first failed task
+    :param on_progress: called as on_progress(task, percent) when the progress of a task changes
+    :return: the outcome of each task, in the same order of tasks
+    """
+    futures = get_task_tracker(si).track_all(tasks, on_progress)
+    with task_wait():
+        wait(futures)
+
+    outcomes = []
+    for future in futures:
+        error = future.exception()
+        if error is not None:
+            outcomes.append(TaskOutcome(future.task, vim.TaskInfo.State.error, None, error))
+        else:
+            outcomes.append(TaskOutcome(future.task, vim.TaskInfo.State.success, future.result(), None))
+
+    if raise_on_error:
+        for outcome in outcomes:
+            if outcome.error is not None:
+                raise outcome.error
+    return outcomes
+
+
+def wait_first(futures: list, timeout: float = None) -> tuple:
+    """
+    Wait for the first of the futures to complete
+    :param futures: list of TaskFuture
+    :param timeout: max seconds to wait. None to wait forever
+    :return: (done, not_done) sets of futures
+    """
+    with task_wait():
+        return wait(futures, timeout, FIRST_COMPLETED)
@@ -0,0 +1,181 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from pyVmomi import vim
+
+# Max number of ContainerViews kept alive on the server for each connection
+MAX_VIEWS = 32
+
+
+class ViewManager:
+    """
+    Shared ContainerViews of a connection.
+    At most one view exists for each (container, types, recursive): it is created at the first
+    request and handed out again to the following ones. The least recently used views are
+    destroyed beyond max_views, the others by close() or at the exit of the with block.
+    A view taken with acquire() or using() is counted: when it is evicted, released or closed
+    while still in use, it is destroyed only once its last user releases it.
+    """
+    def __init__(self, si: vim.ServiceInstance, max_views: int = MAX_VIEWS,
+                 content: vim.ServiceInstanceContent = None):
+        """
+        :param si: Connection to vCenter Server
+        :param max_views: max number of views kept alive
+        :param content: ServiceContent of si. Standard retrieved at the first view
+        """
+        self.si = si
+        self.max_views = max_views
+        self._content = content
+        self._lock = threading.Lock()
+        self._views = OrderedDict()
+        self._users = {}
+        self._retired = {}
+
+    @property
+    def content(self) -> vim.ServiceInstanceContent:
+        """
+        ServiceContent of the connection
+        """
+        if self._content is None:
+            self._content = self.si.RetrieveContent()
+        return self._content
+
+    @staticmethod
+    def _key(container, types: list, recursive: bool) -> tuple:
+        return container._moId, frozenset(type_obj.__name__ for type_obj in types), recursive
+
+    def get_view(self, types: list, container=None, recursive: bool = True) -> vim.view.ContainerView:
+        """
+        Get the shared ContainerView of types under container.
+        The view is not counted as in use: prefer using() when it is read more times.
+        :param types: list of types, for example [vim.VirtualMachine]
+        :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+        :param recursive: True to look also into the children of container
+        :return: the ContainerView
+        """
+        return self._get_view(types, container, recursive, False)
+
+    def acquire(self, types: list, container=None, recursive: bool = True) -> vim.view.ContainerView:
+        """
+        Get the shared ContainerView of types under container and count it as in use
+        until release_view(): it is not destroyed in the meantime
+        :param types: list of types, for example [vim.VirtualMachine]
+        :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+        :param recursive: True to look also into the children of container
+        :return: the ContainerView
+        """
+        return self._get_view(types, container, recursive, True)
+
+    def release_view(self, view: vim.view.ContainerView):
+        """
+        Stop using a view got from acquire(). The view is destroyed if it was evicted,
+        released or closed in the meantime and this was its last user.
+        :param view: the ContainerView
+        """
+        with self._lock:
+            users = self._users.get(view._moId, 0) - 1
+            if users > 0:
+                self._users[view._moId] = users
+                return
+            self._users.pop(view._moId, None)
+            view = self._retired.pop(view._moId, None)
+        if view is not None:
+            self._destroy(view)
+
+    @contextmanager
+    def using(self, types: list, container=None, recursive: bool = True):
+        """
+        Use the shared ContainerView of types under container in a with block:
+            with views.using([vim.VirtualMachine]) as view:
+        :param types: list of types, for example [vim.VirtualMachine]
+        :param container: Folder, Datacenter or ComputeResource to look into. Standard rootFolder
+        :param recursive: True to look also into the children of container
+        :return: the ContainerView, in use until the end of the block
+        """
+        view = self.acquire(types, container, recursive)
+        try:
+            yield view
+        finally:
+            self.release_view(view)
+
+    def _get_view(self, types: list, container, recursive: bool, use: bool) -> vim.view.ContainerView:
+        content = self.content
+        if container is None:
+            container = content.rootFolder
+        key = self._key(container, types, recursive)
+
+        evicted = []
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+            else:
+                view = content.viewManager.CreateContainerView(container, list(types), recursive)
+                self._views[key] = view
+                while len(self._views) > self.max_views:
+                    evicted.append(self._views.popitem(last=False)[1])
+                evicted = [old_view for old_view in evicted if self._retire(old_view)]
+            if use:
+                self._users[view._moId] = self._users.get(view._moId, 0) + 1
+
+        for old_view in evicted:
+            self._destroy(old_view)
+        return view
+
+    def _retire(self, view: vim.view.ContainerView) -> bool:
+        # Called with the lock held: True if the view can be destroyed now,
+        # else it is destroyed by the release of its last user
+        if self._users.get(view._moId):
+            self._retired[view._moId] = view
+            return False
+        return True
+
+    def release(self, types: list, container=None, recursive: bool = True):
+        """
+        Destroy the shared ContainerView of types under container, if any.
+        A view still in use is destroyed by the release of its last user.
+        :param types: list of types, for example [vim.VirtualMachine]
+        :param container: Folder, Datacenter or ComputeResource. Standard rootFolder
+        :param recursive: True if the view looks also into the children of container
+        """
+        if container is None:
+            container = self.content.rootFolder
+        with self._lock:
+            view = self._views.pop(self._key(container, types, recursive), None)
+            if view is not None and not self._retire(view):
+                view = None
+        if view is not None:
+            self._destroy(view)
+
+    @property
+    def live_views(self) -> int:
+        """
+        Number of views alive on the server
+        """
+        with self._lock:
+            return len(self._views) + len(self._retired)
+
+    def close(self):
+        """
+        Destroy all the views, the ones in use once they are released
+        """
+        with self._lock:
+            views = [view for view in self._views.values() if self._retire(view)]
+            self._views.clear()
+        for view in views:
+            self._destroy(view)
+
+    @staticmethod
+    def _destroy(view: vim.view.ContainerView):
+        try:
+            view.DestroyView()
+        except Exception:
+            # Already gone with the session
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,11 +1,14 @@
-import re
+import threading
 import time
-from typing import List
-
-from pyvim.task import WaitForTask
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple
 
 from vCenterScripter.common import *
+from vCenterScripter.guest import GuestProcessWaiter, ProcessResult, backoff_intervals
 from vCenterScripter.logger import Logger, print_
+from vCenterScripter.metrics import instrument_module
+from vCenterScripter.tasks import get_task_tracker, track_task, wait_first, wait_task
 
 
 def list_vm_names(si: vim.ServiceInstance) -> set:
@@ -25,6 +28,7 @@ def refresh_vm(si: vim.ServiceInstance, vm: vim.VirtualMachine) -> vim.VirtualMa
     :return: The new VM
     """
     name = vm.config.name
+    forget_object(vm)
     del vm
     return get_vm(si, name)
 
@@ -35,6 +39,7 @@ def get_vm(si: vim.ServiceInstance, name: str = "") -> vim.VirtualMachine:
     :param si: Connection to vCenter Server
     :param name: Name of the VM
     :return: Virtual Machine
+    :raise DuplicateNameError: if more VMs have that name
     """
     return get_object(si, vim.VirtualMachine, name)
 
@@ -67,7 +72,8 @@ def run_program(si: vim.ServiceInstance,
                 program_arguments: str = None,
                 working_directory: str = "",
                 envVariables=None,
-                async_run: bool = False):
+                async_run: bool = False,
+                timeout: float = None) -> int:
     """
     Run a program inside the VM using VMWare tools
     :param si: Connection to Vcenter
@@ -79,12 +85,13 @@ def run_program(si: vim.ServiceInstance,
     :param async_run: True if you want it non-blocking
     :param working_directory: Where to run the program
     :param envVariables: Environment Variables.
-    :return: The PID of the process.
+    :param timeout: max seconds to wait for the program. None to wait forever
+    :return: The PID of the process. Use run_program_result to get its exit code.
+    :raise TimeoutError: if the program is still running at timeout
     """
 
     check_vmware_tools(virtual_machine, logger, blocking=True)
-    content = si.RetrieveContent()
-    profile_manager = content.guestOperationsManager.processManager
+    profile_manager = get_process_manager(si)
 
     if program_arguments:
         program_spec = vim.vm.guest.ProcessManager.ProgramSpec(
@@ -100,30 +107,174 @@ def run_program(si: vim.ServiceInstance,
             programPath=program_path)
 
     res = profile_manager.StartProgramInGuest(virtual_machine, credentials, program_spec)
+    print_("Program submitted, PID is %d" % res, logger)
+    if not async_run:
+        _wait_program(si, virtual_machine, credentials, res, logger, timeout)
+    return res
 
-    if res > 0:
-        print_("Program submitted, PID is %d" % res, logger)
-        pid_exitcode = \
-            profile_manager.ListProcessesInGuest(virtual_machine, credentials, [res]).pop().exitCode
-
-        if not async_run:
-            while re.match('[^0-9]+', str(pid_exitcode)):
-                print_("Program running,   PID is %d" % res, logger)
-                time.sleep(5)
-                pid_exitcode = \
-                    profile_manager.ListProcessesInGuest(virtual_machine, credentials, [res]).pop().exitCode
-                if pid_exitcode == 0:
-                    print_("Program %d completed with success" % res, logger)
-                    break
-                elif re.match('[1-9]+', str(pid_exitcode)):
-                    print_("ERROR: Program %d completed with Failure" % res, logger)
-                    print_("  tip: Try running this on guest %r to debug"
-                           % virtual_machine.summary.guest.ipAddress, logger)
-                    print_("ERROR: More info on process", logger)
-                    print_(profile_manager.ListProcessesInGuest(virtual_machine, credentials, [res]), logger)
+
+def run_program_result(si: vim.ServiceInstance,
+                       virtual_machine: vim.VirtualMachine,
+                       credentials: vim.vm.guest.NamePasswordAuthentication,
+                       program_path: str,
+                       logger: Logger = None,
+                       program_arguments: str = None,
+                       working_directory: str = "",
+                       envVariables=None,
+                       timeout: float = None) -> ProcessResult:
+    """
+    Run a program inside the VM using VMWare tools and wait for its end
+    :param si: Connection to Vcenter
+    :param virtual_machine: The virtual Machine
+    :param credentials: The credentials of the VM
+    :param program_path: Path of the program to run
+    :param logger: Logger
+    :param program_arguments: Program Arguments if needed
+    :param working_directory: Where to run the program
+    :param envVariables: Environment Variables.
+    :param timeout: max seconds to wait for the program. None to wait forever
+    :return: the ProcessResult of the program
+    :raise TimeoutError: if the program is still running at timeout
+    """
+    pid = run_program(si, virtual_machine, credentials, program_path, logger, program_arguments,
+                      working_directory, envVariables, async_run=True)
+    return _wait_program(si, virtual_machine, credentials, pid, logger, timeout)
+
+
+def _wait_program(si: vim.ServiceInstance, virtual_machine: vim.VirtualMachine,
+                  credentials: vim.vm.guest.NamePasswordAuthentication, pid: int,
+                  logger: Logger, timeout: float) -> ProcessResult:
+    waiter = GuestProcessWaiter(get_process_manager(si), virtual_machine, credentials)
+    result = waiter.wait([pid], timeout)[pid]
+    print_process_result(result, logger)
+    if result.exit_code not in (0, None):
+        print_("  tip: Try running this on guest %r to debug"
+               % virtual_machine.summary.guest.ipAddress, logger)
+        print_("ERROR: More info on process: %s" % str(result), logger)
+    return result
+
+
+def print_process_result(result: ProcessResult, logger: Logger = None):
+    """
+    Print the outcome of a program run in a guest
+    :param result: ProcessResult
+    :param logger: Logger
+    """
+    if result.exit_code == 0:
+        print_("Program %d completed with success in %.2fs" % (result.pid, result.duration or 0), logger)
+    elif result.exit_code is None:
+        print_("WARNING: Program %d no longer listed by the guest, exit code unknown" % result.pid, logger)
+    else:
+        print_("ERROR: Program %d completed with Failure, exit code %s" % (result.pid, result.exit_code), logger)
+
+
+class GuestRunResult(NamedTuple):
+    """
+    Outcome of run_program_many on a single VM.
+    status is one of 'completed', 'tools_not_running', 'start_failed', 'poll_failed', 'timeout'
+    """
+    vm: vim.VirtualMachine
+    status: str
+    pid: int
+    result: ProcessResult
+    error: Exception
+
+
+def run_program_many(si: vim.ServiceInstance,
+                     vms: List[vim.VirtualMachine],
+                     credentials,
+                     program_path: str,
+                     program_arguments: str = None,
+                     working_directory: str = "",
+                     envVariables=None,
+                     max_concurrency: int = 20,
+                     timeout: float = None,
+                     logger: Logger = None) -> Iterator[GuestRunResult]:
+    """
+    Run the same program inside many VMs using VMWare tools.
+    The VMs without VMware Tools running are reported first, then the program is started on the
+    others concurrently and each result is yielded as soon as its process completes.
+    All the processes are polled at each cycle, with one ListProcessesInGuest call per VM.
+    :param si: Connection to Vcenter
+    :param vms: The Virtual Machines
+    :param credentials: The credentials of the VMs, or a dict {vm: credentials}
+    :param program_path: Path of the program to run
+    :param program_arguments: Program Arguments if needed
+    :param working_directory: Where to run the program
+    :param envVariables: Environment Variables.
+    :param max_concurrency: max number of SOAP calls running at the same time
+    :param timeout: max seconds to wait for the programs. The ones still running are reported as 'timeout'
+    :param logger: Logger
+    :return: an iterator of GuestRunResult, one per VM
+    """
+    vms = list(vms)
+    process_manager = get_process_manager(si)
+    program_spec = vim.vm.guest.ProcessManager.ProgramSpec(
+        envVariables=envVariables,
+        workingDirectory=working_directory,
+        programPath=program_path,
+        arguments=program_arguments or "")
+
+    def credentials_of(virtual_machine):
+        return credentials[virtual_machine] if isinstance(credentials, dict) else credentials
+
+    ready = []
+    tools = get_properties(si, vms, ['guest.toolsRunningStatus'])
+    for virtual_machine in vms:
+        if tools[virtual_machine].get('guest.toolsRunningStatus') == 'guestToolsRunning':
+            ready.append(virtual_machine)
+        else:
+            yield GuestRunResult(virtual_machine, 'tools_not_running', None, None, None)
+    print_("Guest: %d of %d VMs have VMware Tools running." % (len(ready), len(vms)), logger)
+
+    def start(virtual_machine):
+        try:
+            return process_manager.StartProgramInGuest(virtual_machine, credentials_of(virtual_machine), program_spec), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_concurrency, thread_name_prefix="vcs-guest") as pool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        running = {}
+        for virtual_machine, (pid, error) in zip(ready, pool.map(start, ready)):
+            if error is not None:
+                yield GuestRunResult(virtual_machine, 'start_failed', None, None, error)
+            else:
+                running[virtual_machine] = pid
+        print_("Guest: program started on %d VMs." % len(running), logger)
+
+        waiters = {virtual_machine: GuestProcessWaiter(process_manager, virtual_machine, credentials_of(virtual_machine))
+                   for virtual_machine in running}
+        intervals = backoff_intervals()
+        while running:
+            polls = {virtual_machine: pool.submit(waiters[virtual_machine].poll, [pid])
+                     for virtual_machine, pid in running.items()}
+            for virtual_machine, poll in polls.items():
+                pid = running[virtual_machine]
+                try:
+                    completed = waiters[virtual_machine].completed([pid], poll.result())
+                except Exception as e:
+                    del running[virtual_machine]
+                    yield GuestRunResult(virtual_machine, 'poll_failed', pid, None, e)
+                    continue
+                if completed:
+                    del running[virtual_machine]
+                    yield GuestRunResult(virtual_machine, 'completed', pid, completed[0], None)
+            if not running:
+                break
+
+            interval = next(intervals)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     break
+                interval = min(interval, remaining)
+            time.sleep(interval)
 
-    return res
+        if running:
+            print_("Guest: %d programs still running at timeout." % len(running), logger)
+        for virtual_machine, pid in running.items():
+            yield GuestRunResult(virtual_machine, 'timeout', pid, None, None)
 
 
 def terminate_pid(pid: int,
@@ -141,8 +292,7 @@ def terminate_pid(pid: int,
     :param logger: Logger
     """
     check_vmware_tools(virtual_machine, logger, blocking=True)
-    content = si.RetrieveContent()
-    profile_manager = content.guestOperationsManager.processManager
+    profile_manager = get_process_manager(si)
     profile_manager.TerminateProcessInGuest(virtual_machine, credentials, pid)
 
 
@@ -163,8 +313,7 @@ def get_info_pid(
     :return: Info about the selected PID or None.
     """
     check_vmware_tools(virtual_machine, logger, blocking=True)
-    content = si.RetrieveContent()
-    profile_manager = content.guestOperationsManager.processManager
+    profile_manager = get_process_manager(si)
     return profile_manager.ListProcessesInGuest(virtual_machine, credentials, [pid]).pop()
 
 
@@ -183,8 +332,7 @@ def get_info_processes(si: vim.ServiceInstance,
     """
 
     check_vmware_tools(virtual_machine, logger, blocking=True)
-    content = si.RetrieveContent()
-    profile_manager = content.guestOperationsManager.processManager
+    profile_manager = get_process_manager(si)
     processes = profile_manager.ListProcessesInGuest(virtual_machine, credentials, [])
     return processes
 
@@ -207,7 +355,12 @@ def relocate_vm(virtual_machine: vim.VirtualMachine,
     """
 
     relocate_spec = vim.vm.RelocateSpec(host=dest_host, datastore=dest_datastore, pool=dest_pool)
-    virtual_machine.Relocate(relocate_spec)
+    try:
+        virtual_machine.Relocate(relocate_spec)
+    finally:
+        if dest_datastore is not None:
+            # The disks have new backings
+            invalidate_vm_hardware(virtual_machine)
     print_("VM:" + virtual_machine.name + " relocated.", logger)
 
 
@@ -218,7 +371,7 @@ def power_off_vm(virtual_machine: vim.VirtualMachine,
     :param virtual_machine: The VM
     :param logger: Logger
     """
-    WaitForTask(virtual_machine.PowerOffVM_Task())
+    wait_task(virtual_machine.PowerOffVM_Task())
     print_("VM" + virtual_machine.name + "Powered off", logger)
 
 
@@ -232,9 +385,9 @@ def power_on_vm(virtual_machine: vim.VirtualMachine,
     :param host The host were to power on the machine. None if were is registered
     """
     if host is not None:
-        WaitForTask(virtual_machine.PowerOnVM_Task(host))
+        wait_task(virtual_machine.PowerOnVM_Task(host))
     else:
-        WaitForTask(virtual_machine.PowerOnVM_Task())
+        wait_task(virtual_machine.PowerOnVM_Task())
 
     print_("VM " + virtual_machine.name + "Powered on.", logger)
 
@@ -247,7 +400,10 @@ def reload_vm(virtual_machine: vim.VirtualMachine, datastore_path: str,
     :param virtual_machine: The VM
     :param logger: Logger
     """
-    WaitForTask(virtual_machine.reloadVirtualMachineFromPath_Task(datastore_path))
+    try:
+        wait_task(virtual_machine.reloadVirtualMachineFromPath_Task(datastore_path))
+    finally:
+        invalidate_vm_hardware(virtual_machine)
     print_("VM " + virtual_machine.name + "reloaded.", logger)
 
 
@@ -260,9 +416,141 @@ def unregister_vm(virtual_machine: vim.VirtualMachine,
     """
 
     virtual_machine.UnregisterVM()
+    forget_object(virtual_machine)
     print_("VM " + virtual_machine.name + "unregistered.", logger)
 
 
+class VmPathIndex:
+    """
+    Index of the VMs of a connection by summary.config.vmPathName, with the set of the orphaned ones.
+    It is built with a single property retrieval, the lookups don't hit the network.
+    """
+    def __init__(self, si: vim.ServiceInstance):
+        """
+        :param si: Connection to vCenter Server
+        """
+        self.si = si
+        self._lock = threading.Lock()
+        self._vms = {}
+        self._orphans = set()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Load again the paths and the connection states of the VMs
+        """
+        vms = {}
+        orphans = set()
+        path_set = ['summary.config.vmPathName', 'summary.runtime.connectionState']
+        for vm, props in iter_properties(self.si, vim.VirtualMachine, path_set):
+            path = props.get('summary.config.vmPathName')
+            if path:
+                vms.setdefault(path, []).append(vm)
+            if props.get('summary.runtime.connectionState') == 'orphaned':
+                orphans.add(vm)
+        with self._lock:
+            self._vms = vms
+            self._orphans = orphans
+
+    def refresh_path(self, datastore_path: str):
+        """
+        Load again the connection states of the VMs registered with a path
+        :param datastore_path: Path to the VMX, for example '[ds1] vm1/vm1.vmx'
+        """
+        try:
+            states = get_properties(self.si, self.vms(datastore_path), ['summary.runtime.connectionState'])
+        except vmodl.fault.ManagedObjectNotFound:
+            # One of them was unregistered since the load
+            self.refresh()
+            return
+        with self._lock:
+            for vm, props in states.items():
+                if props.get('summary.runtime.connectionState') == 'orphaned':
+                    self._orphans.add(vm)
+                else:
+                    self._orphans.discard(vm)
+
+    def vms(self, datastore_path: str) -> List[vim.VirtualMachine]:
+        """
+        Get the VMs registered with a path
+        :param datastore_path: Path to the VMX, for example '[ds1] vm1/vm1.vmx'
+        :return: a list of VMs
+        """
+        with self._lock:
+            return list(self._vms.get(datastore_path, []))
+
+    def orphans(self, datastore_path: str = None) -> List[vim.VirtualMachine]:
+        """
+        Get the orphaned VMs
+        :param datastore_path: Path to the VMX. None for all the orphaned VMs
+        :return: a list of VMs
+        """
+        with self._lock:
+            if datastore_path is None:
+                return list(self._orphans)
+            return [vm for vm in self._vms.get(datastore_path, []) if vm in self._orphans]
+
+    def add(self, datastore_path: str, virtual_machine: vim.VirtualMachine):
+        """
+        Add a VM just registered with a path
+        :param datastore_path: Path to the VMX
+        :param virtual_machine: The VM
+        """
+        with self._lock:
+            self._vms.setdefault(datastore_path, []).append(virtual_machine)
+
+    def discard(self, virtual_machine: vim.VirtualMachine):
+        """
+        Remove a VM no longer registered
+        :param virtual_machine: The VM
+        """
+        with self._lock:
+            self._orphans.discard(virtual_machine)
+            for path, vms in list(self._vms.items()):
+                if virtual_machine in vms:
+                    vms.remove(virtual_machine)
+                    if not vms:
+                        del self._vms[path]
+
+
+def get_vm_path_index(si: vim.ServiceInstance, refresh: bool = False) -> VmPathIndex:
+    """
+    Get the VmPathIndex of the connection, building it if needed
+    :param si: Connection to vCenter Server
+    :param refresh: True to load again the paths of the VMs
+    :return: the VmPathIndex
+    """
+    state = connection_state(si)
+    with state.lock:
+        index = state.indexes.get('vm_paths')
+    if index is None:
+        index = VmPathIndex(si)
+        with state.lock:
+            index = state.indexes.setdefault('vm_paths', index)
+    elif refresh:
+        index.refresh()
+    return index
+
+
+def unregister_orphans(si: vim.ServiceInstance, datastore_path: str, logger: Logger = None,
+                       index: VmPathIndex = None):
+    """
+    Unregister the orphaned VMs registered with the path datastore_path
+    :param si: Connection to the vCenter
+    :param datastore_path: Path to the VM Disk
+    :param logger: Logger
+    :param index: VmPathIndex to look into. Standard the one of the connection, loaded again
+    """
+    if index is None:
+        index = get_vm_path_index(si, refresh=True)
+    for vm in index.orphans(datastore_path):
+        try:
+            unregister_vm(vm, logger)
+        except Exception:
+            pass
+        index.discard(vm)
+
+
 def register_vm(si: vim.ServiceInstance,
                 folder: vim.Folder,
                 datastore_path: str,
@@ -284,19 +572,113 @@ def register_vm(si: vim.ServiceInstance,
     """
 
     # TODO Check if path is accessible from the host
-    vms = list_obj(si, vim.VirtualMachine)
-    for vm in vms:
-        if vm.summary.config.vmPathName == datastore_path and vm.summary.runtime.connectionState == 'orphaned':
-            try:
-                unregister_vm(vm, logger)
-            except Exception:
-                pass
-
-    WaitForTask(folder.RegisterVM_Task(path=datastore_path, name=name_vm, asTemplate=as_Template, host=dest_host,
-                                       pool=dest_pool))
+    index = get_vm_path_index(si)
+    if index.vms(datastore_path):
+        # The VMs may have become orphaned or been recovered since the index was loaded
+        index.refresh_path(datastore_path)
+    else:
+        # Unknown path: it may have been registered since the index was loaded
+        index.refresh()
+    unregister_orphans(si, datastore_path, logger, index)
+
+    try:
+        vm = wait_task(folder.RegisterVM_Task(path=datastore_path, name=name_vm, asTemplate=as_Template,
+                                              host=dest_host, pool=dest_pool))
+    finally:
+        # The name may have been remembered as missing
+        invalidate_inventory(si, vim.VirtualMachine)
+    index.add(datastore_path, vm)
     print_("VM " + datastore_path + "registered.", logger)
 
 
+class VmRegistration(NamedTuple):
+    """
+    A VMX to be registered by register_vms. The fields left None take the defaults of register_vms.
+    """
+    datastore_path: str
+    name: str = None
+    folder: vim.Folder = None
+    host: vim.HostSystem = None
+    pool: vim.ResourcePool = None
+
+
+class RegisterResult(NamedTuple):
+    """
+    Result of register_vms on a single VMX
+    """
+    datastore_path: str
+    vm: vim.VirtualMachine
+    error: Exception
+
+
+def register_vms(si: vim.ServiceInstance,
+                 registrations: list,
+                 folder: vim.Folder = None,
+                 dest_host: vim.HostSystem = None,
+                 dest_pool: vim.ResourcePool = None,
+                 as_Template: bool = False,
+                 max_concurrency: int = 10,
+                 logger: Logger = None) -> List[RegisterResult]:
+    """
+    Register many VMs at once, for example after a storage failover.
+    The orphans of all the paths are found with a single property retrieval, the RegisterVM
+    tasks run concurrently and are waited by the shared TaskTracker of the connection.
+    :param si: Connection to the vCenter
+    :param registrations: list of VMX paths or of VmRegistration
+    :param folder: folder of Destination
+    :param dest_host: Destination host for the VMs
+    :param dest_pool: Destination Pool for the VMs
+    :param as_Template: True if they are templates
+    :param max_concurrency: max number of tasks running at the same time
+    :param logger: Logger
+    :return: a RegisterResult for each registration, in the same order
+    """
+    registrations = [VmRegistration(item) if isinstance(item, str) else item for item in registrations]
+    index = get_vm_path_index(si, refresh=True)
+    tracker = get_task_tracker(si)
+    results = [None] * len(registrations)
+    queue = deque(range(len(registrations)))
+    running = {}
+
+    def submit(registration):
+        unregister_orphans(si, registration.datastore_path, logger, index)
+        return (registration.folder or folder).RegisterVM_Task(
+            path=registration.datastore_path, name=registration.name, asTemplate=as_Template,
+            host=registration.host or dest_host, pool=registration.pool or dest_pool)
+
+    while queue or running:
+        submitted = []
+        while queue and len(running) + len(submitted) < max_concurrency:
+            i = queue.popleft()
+            try:
+                submitted.append((i, submit(registrations[i])))
+            except Exception as e:
+                results[i] = RegisterResult(registrations[i].datastore_path, None, e)
+
+        futures = tracker.track_all([task for _, task in submitted])
+        for (i, _), future in zip(submitted, futures):
+            running[future] = i
+        if not running:
+            continue
+
+        done, _ = wait_first(list(running))
+        for future in done:
+            i = running.pop(future)
+            path = registrations[i].datastore_path
+            error = future.exception()
+            if error is not None:
+                results[i] = RegisterResult(path, None, error)
+                continue
+            index.add(path, future.result())
+            results[i] = RegisterResult(path, future.result(), None)
+
+    # The names may have been remembered as missing
+    invalidate_inventory(si, vim.VirtualMachine)
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Register: %d VMs registered, %d failed." % (len(results) - failed, failed), logger)
+    return results
+
+
 def get_config_info_vm(virtual_machine: vim.VirtualMachine) -> vim.vm.ConfigInfo:
     """
     Get the configuration of a vm
@@ -310,7 +692,7 @@ def reconfig_spec_vm(virtual_machine: vim.VirtualMachine, name: str = None,
                      num_cpus: int = None, num_cores_per_socket: int = None,
                      memory_gb: int = None,
                      cpu_hot_add_enabled: bool = None, memory_hot_add_enabled: bool = None,
-                     annotation: str = None):
+                     annotation: str = None) -> vim.Task:
     """
     Reconfig the specs of a VM
     :param memory_hot_add_enabled: Whether memory can be added to the virtual machine while it is running. This attribute can only be set when the virtual machine is powered-off
@@ -321,7 +703,7 @@ def reconfig_spec_vm(virtual_machine: vim.VirtualMachine, name: str = None,
     :param cpu_hot_add_enabled: Whether virtual processors can be added to the virtual machine while it is running
     :param virtual_machine: The Virtual Machine
     :param annotation:  User-provided description of the virtual machine
-
+    :return: the ReconfigVM Task, still running
     """
     config = vim.vm.ConfigSpec()
     if name is not None:
@@ -339,7 +721,129 @@ def reconfig_spec_vm(virtual_machine: vim.VirtualMachine, name: str = None,
     if annotation is not None:
         config.annotation = annotation
 
-    virtual_machine.ReconfigVM_Task(config)
+    task = virtual_machine.ReconfigVM_Task(config)
+
+    def invalidate(future):
+        # The new name and devices are visible only once the task completes
+        invalidate_vm_hardware(virtual_machine)
+        if name is not None:
+            invalidate_inventory(virtual_machine, vim.VirtualMachine)
+
+    track_task(task).add_done_callback(invalidate)
+    return task
+
+
+# Unit numbers of each kind of controller
+CONTROLLER_UNITS = {
+    vim.vm.device.VirtualSCSIController: 16,
+    vim.vm.device.VirtualNVMEController: 15,
+    vim.vm.device.VirtualAHCIController: 30,
+    vim.vm.device.VirtualIDEController: 2,
+}
+
+
+class VmHardware:
+    """
+    Indexed view of the devices of a VM, virtual_machine.config.hardware.device.
+    Disks are indexed by label and key, controllers by bus and key, NICs by MAC address.
+    """
+    def __init__(self, virtual_machine: vim.VirtualMachine, devices: list):
+        """
+        :param virtual_machine: The Virtual Machine
+        :param devices: virtual_machine.config.hardware.device
+        """
+        self.vm = virtual_machine
+        self.devices = list(devices or [])
+        self.by_key = {device.key: device for device in self.devices}
+        self.disks = {}
+        self.controllers = {}
+        self.nics = {}
+        self.used_units = {}
+        for device in self.devices:
+            if isinstance(device, vim.vm.device.VirtualDisk):
+                self.disks[device.deviceInfo.label] = device
+            elif isinstance(device, vim.vm.device.VirtualController):
+                self.controllers[device.key] = device
+                self.used_units.setdefault(device.key, set())
+                if isinstance(device, vim.vm.device.VirtualSCSIController):
+                    self.used_units[device.key].add(
+                        device.scsiCtlrUnitNumber if device.scsiCtlrUnitNumber is not None else 7)
+            elif isinstance(device, vim.vm.device.VirtualEthernetCard) and device.macAddress:
+                self.nics[device.macAddress] = device
+        for device in self.devices:
+            if device.controllerKey is not None and device.unitNumber is not None:
+                self.used_units.setdefault(device.controllerKey, set()).add(device.unitNumber)
+
+    def disk(self, label: str) -> vim.vm.device.VirtualDisk:
+        """
+        Get a disk by label
+        :param label: label of the disk, like 'Hard disk 1'
+        :return: the VirtualDisk, None if not found
+        """
+        return self.disks.get(label)
+
+    def controllers_by_bus(self, type_obj=vim.vm.device.VirtualSCSIController) -> Dict[int, vim.vm.device.VirtualController]:
+        """
+        Get the controllers of a kind by bus number
+        :param type_obj: kind of controller. Standard SCSI
+        :return: a dict {busNumber: controller}, sorted by bus number
+        """
+        return {controller.busNumber: controller for controller in
+                sorted(self.controllers.values(), key=lambda controller: controller.busNumber)
+                if isinstance(controller, type_obj)}
+
+    def free_units(self, controller_key: int) -> List[int]:
+        """
+        Get the unit numbers still free on a controller
+        :param controller_key: key of the controller
+        :return: list of unit numbers
+        """
+        controller = self.controllers[controller_key]
+        units = next((units for type_obj, units in CONTROLLER_UNITS.items() if isinstance(controller, type_obj)), 0)
+        used = self.used_units.get(controller_key, ())
+        return [unit for unit in range(units) if unit not in used]
+
+
+def get_vm_hardwares(si: vim.ServiceInstance, vms: list, refresh: bool = False) -> Dict[vim.VirtualMachine, VmHardware]:
+    """
+    Get the hardware views of many VMs, the ones not cached are read with a single property retrieval
+    :param si: Connection to vCenter Server
+    :param vms: the Virtual Machines
+    :param refresh: True to read all of them again
+    :return: a dict {vm: VmHardware}
+    """
+    vms = list(vms)
+    state = connection_state(si)
+    with state.lock:
+        cache = state.indexes.setdefault('vm_hardware', {})
+        hardwares = {} if refresh else {vm: cache[vm._moId] for vm in vms if vm._moId in cache}
+    missing = [vm for vm in vms if vm not in hardwares]
+
+    properties = get_properties(si, missing, ['config.hardware.device'])
+    with state.lock:
+        for vm in missing:
+            hardwares[vm] = cache[vm._moId] = VmHardware(vm, properties[vm].get('config.hardware.device'))
+    return hardwares
+
+
+def get_vm_hardware(virtual_machine: vim.VirtualMachine, refresh: bool = False) -> VmHardware:
+    """
+    Get the hardware view of a VM, read once and cached until a helper changes the devices of the VM
+    :param virtual_machine: The Virtual Machine
+    :param refresh: True to read it again
+    :return: the VmHardware
+    """
+    return get_vm_hardwares(service_instance(virtual_machine), [virtual_machine], refresh)[virtual_machine]
+
+
+def invalidate_vm_hardware(virtual_machine: vim.VirtualMachine):
+    """
+    Forget the cached hardware view of a VM
+    :param virtual_machine: The Virtual Machine
+    """
+    state = connection_state(virtual_machine)
+    with state.lock:
+        state.indexes.get('vm_hardware', {}).pop(virtual_machine._moId, None)
 
 
 def get_names_disk_vm(virtual_machine: vim.VirtualMachine) -> set:
@@ -348,116 +852,184 @@ def get_names_disk_vm(virtual_machine: vim.VirtualMachine) -> set:
     :param virtual_machine: The Virtual Machine
     :return: A set of Hard disk Names of a specific VM
     """
-    names = set(device.deviceInfo.label for device in virtual_machine.config.hardware.device if
-                hasattr(device.backing, 'fileName'))
-    return names
+    return set(get_vm_hardware(virtual_machine).disks)
 
 
-def resize_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, disk_size_gb: int):
+class DiskChange(NamedTuple):
     """
-    Resize the disk of a VM
+    A disk change of plan_disk_changes.
+    operation is 'add', 'resize' or 'remove'; label is the disk to resize or remove, like 'Hard disk 2'.
+    """
+    operation: str
+    label: str = None
+    size_gb: int = None
+    delete_disk: bool = False
+    controller_key: int = None
+    thin: bool = None
+
+
+def plan_disk_changes(hardware: VmHardware, changes: List[DiskChange]) -> vim.vm.ConfigSpec:
+    """
+    Compute all the disk changes of a VM in a single ConfigSpec.
+    The new disks take the free unit numbers of the SCSI controllers, by bus number.
+    :param hardware: VmHardware of the VM
+    :param changes: the DiskChange
+    :return: the ConfigSpec, with a deviceChange for each change
+    """
+    disks = hardware.disks
+    controllers = list(hardware.controllers_by_bus().values())
+    taken = set()
+
+    def free_unit(controller_key):
+        candidates = [controller.key for controller in controllers
+                      if controller_key is None or controller.key == controller_key]
+        if controller_key is not None and not candidates:
+            raise LookupError("SCSI controller %d not found" % controller_key)
+        for key in candidates:
+            for unit in hardware.free_units(key):
+                if (key, unit) not in taken:
+                    taken.add((key, unit))
+                    return key, unit
+        raise LookupError("No free unit number on the SCSI controllers")
+
+    device_changes = []
+    changed = set()
+    new_key = -100
+    for change in changes:
+        if change.operation == 'add':
+            controller_key, unit_number = free_unit(change.controller_key)
+            new_key -= 1
+            disk = vim.vm.device.VirtualDisk(key=new_key, controllerKey=controller_key, unitNumber=unit_number,
+                                             capacityInKB=int(change.size_gb) * 1024 * 1024)
+            disk.backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo(diskMode='persistent',
+                                                                         thinProvisioned=change.thin)
+            device_changes.append(vim.vm.device.VirtualDeviceSpec(
+                operation=vim.vm.device.VirtualDeviceSpec.Operation.add,
+                fileOperation=vim.vm.device.VirtualDeviceSpec.FileOperation.create,
+                device=disk))
+            continue
+
+        disk = disks.get(change.label)
+        if disk is None:
+            raise LookupError("Disk %s not found" % change.label)
+        if disk.key in changed:
+            raise ValueError("Disk %s changed twice" % change.label)
+        changed.add(disk.key)
+
+        if change.operation == 'resize':
+            capacity = int(change.size_gb) * 1024 * 1024
+            if capacity < disk.capacityInKB:
+                raise ValueError("Disk %s can't shrink" % change.label)
+            disk_mod = vim.vm.device.VirtualDisk(key=disk.key, controllerKey=disk.controllerKey,
+                                                 unitNumber=disk.unitNumber, backing=disk.backing,
+                                                 capacityInKB=capacity)
+            device_changes.append(vim.vm.device.VirtualDeviceSpec(
+                operation=vim.vm.device.VirtualDeviceSpec.Operation.edit, device=disk_mod))
+        elif change.operation == 'remove':
+            disk_spec = vim.vm.device.VirtualDeviceSpec(
+                operation=vim.vm.device.VirtualDeviceSpec.Operation.remove, device=disk)
+            if change.delete_disk:
+                disk_spec.fileOperation = vim.vm.device.VirtualDeviceSpec.FileOperation.destroy
+            device_changes.append(disk_spec)
+        else:
+            raise ValueError("Unknown disk operation %r" % change.operation)
+
+    return vim.vm.ConfigSpec(deviceChange=device_changes)
+
+
+def _disk_spec(virtual_machine: vim.VirtualMachine, change: DiskChange, logger: Logger = None) -> vim.vm.ConfigSpec:
+    # The errors of the planning, like a missing disk or a shrink, are logged and give None
+    try:
+        return plan_disk_changes(get_vm_hardware(virtual_machine), [change])
+    except (LookupError, ValueError) as e:
+        print_("VM %s: %s" % (virtual_machine.name, e), logger)
+        return None
+
+
+def _reconfig_devices(virtual_machine: vim.VirtualMachine, spec: vim.vm.ConfigSpec):
+    try:
+        wait_task(virtual_machine.ReconfigVM_Task(spec=spec))
+    finally:
+        invalidate_vm_hardware(virtual_machine)
+
+
+def resize_disk_spec(virtual_machine: vim.VirtualMachine, disk_name: str, disk_size_gb: int,
+                     logger: Logger = None) -> vim.vm.ConfigSpec:
+    """
+    Build the ConfigSpec resizing the disk of a VM
     :param disk_name: The name of the disk
     :param virtual_machine: Virtual Machine
     :param disk_size_gb: size in GB
+    :param logger: Logger
+    :return: the ConfigSpec, None if the disk is not found or would shrink
     """
+    return _disk_spec(virtual_machine, DiskChange('resize', disk_name, disk_size_gb), logger)
 
-    disk = None
-    for device in virtual_machine.config.hardware.device:
-        if hasattr(device.backing, 'fileName') and device.deviceInfo.label == disk_name:
-            disk = device
-
-    if disk is not None:
-        disk_spec = vim.vm.device.VirtualDeviceSpec()
-        disk_mod = vim.vm.device.VirtualDisk()
 
-        disk_mod.controllerKey = disk.controllerKey
-        disk_mod.unitNumber = disk.unitNumber
-        disk_mod.backing = disk.backing
-        disk_mod.key = disk.key
-        disk_mod.capacityInKB = disk_size_gb * 1024 * 1024
+def resize_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, disk_size_gb: int, logger: Logger = None):
+    """
+    Resize the disk of a VM
+    :param disk_name: The name of the disk
+    :param virtual_machine: Virtual Machine
+    :param disk_size_gb: size in GB
+    :param logger: Logger
+    """
+    spec = resize_disk_spec(virtual_machine, disk_name, disk_size_gb, logger)
+    if spec is not None:
+        _reconfig_devices(virtual_machine, spec)
 
-        disk_spec.device = disk_mod
-        disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
 
-        dev_changes = []
-        spec = vim.vm.ConfigSpec()
-        dev_changes.append(disk_spec)
-        spec.deviceChange = dev_changes
-        WaitForTask(virtual_machine.ReconfigVM_Task(spec=spec))
+def remove_disk_spec(virtual_machine: vim.VirtualMachine, disk_name: str, delete_disk: bool = False,
+                     logger: Logger = None) -> vim.vm.ConfigSpec:
+    """
+    Build the ConfigSpec removing a disk from a VM
+    :param disk_name: The name of the disk
+    :param virtual_machine: Virtual Machine
+    :param delete_disk: True if you want also to delete it from the Datastore
+    :param logger: Logger
+    :return: the ConfigSpec, None if the disk is not found
+    """
+    return _disk_spec(virtual_machine, DiskChange('remove', disk_name, delete_disk=delete_disk), logger)
 
 
-def remove_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, delete_disk: bool = False):
+def remove_disk_vm(virtual_machine: vim.VirtualMachine, disk_name: str, delete_disk: bool = False,
+                   logger: Logger = None):
     """
     Remove a disk from a VM
     :param disk_name: The name of the disk
     :param virtual_machine: Virtual Machine
     :param delete_disk: True if you want also to delete it from the Datastore
+    :param logger: Logger
     """
+    spec = remove_disk_spec(virtual_machine, disk_name, delete_disk, logger)
+    if spec is not None:
+        _reconfig_devices(virtual_machine, spec)
 
-    disk = None
-    for device in virtual_machine.config.hardware.device:
-        if hasattr(device.backing, 'fileName') and device.deviceInfo.label == disk_name:
-            disk = device
 
-    if disk is not None:
-        disk_spec = vim.vm.device.VirtualDeviceSpec()
-        disk_spec.device = disk
-        # Action on the VM -> Remove the Disk
-        disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.remove
-        if delete_disk:
-            # Action on the Disk -> Delete File
-            disk_spec.fileOperation = vim.vm.device.VirtualDeviceSpec.FileOperation.destroy
-
-        dev_changes = []
-        spec = vim.vm.ConfigSpec()
-        dev_changes.append(disk_spec)
-        spec.deviceChange = dev_changes
-        WaitForTask(virtual_machine.ReconfigVM_Task(spec=spec))
+def add_disk_spec(virtual_machine: vim.VirtualMachine, disk_size_gb: int, logger: Logger = None) -> vim.vm.ConfigSpec:
+    """
+    Build the ConfigSpec adding a disk to a VM of size disk_size_gb
+    :param virtual_machine: Virtual Machine
+    :param disk_size_gb: size in GB
+    :param logger: Logger
+    :return: the ConfigSpec, None if no unit number or SCSI controller is available
+    """
+    return _disk_spec(virtual_machine, DiskChange('add', size_gb=disk_size_gb), logger)
 
 
-def add_disk_to_vm(virtual_machine: vim.VirtualMachine, disk_size_gb: int):
+def add_disk_to_vm(virtual_machine: vim.VirtualMachine, disk_size_gb: int, logger: Logger = None):
     """
     Add a disk to a VM of size disk_size_mb
     :param virtual_machine: Virtual Machine
     :param disk_size_gb: size in GB
+    :param logger: Logger
     """
-    spec = vim.vm.ConfigSpec()
-
-    # Get all disks on a VM, set unit_number to the next available
-    unit_number = 0
-    controller = None
-    for device in virtual_machine.config.hardware.device:
-        if hasattr(device.backing, 'fileName'):
-            unit_number = int(device.unitNumber) + 1
-            # unit_number 7 reserved for scsi controller
-            if unit_number == 7:
-                unit_number += 1
-            if unit_number >= 16:
-                print("we don't support this many disks")
-                return -1
-        if isinstance(device, vim.vm.device.VirtualSCSIController):
-            controller = device
-    if controller is None:
-        print("Disk SCSI controller not found!")
+    spec = add_disk_spec(virtual_machine, disk_size_gb, logger)
+    if spec is None:
         return -1
 
-    # Prepare to add the disk to the VM
-    dev_changes = []
-    new_disk_kb = int(disk_size_gb) * 1024 * 1024
-    disk_spec = vim.vm.device.VirtualDeviceSpec()
-    disk_spec.fileOperation = vim.vm.device.VirtualDeviceSpec.FileOperation.create  # Action on the datastore -> Create the Disk
-    disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add  # Action on the VM -> Add the Disk
-    disk_spec.device = vim.vm.device.VirtualDisk()
-    disk_spec.device.backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo()
-    disk_spec.device.backing.diskMode = 'persistent'
-    disk_spec.device.unitNumber = unit_number
-    disk_spec.device.capacityInKB = new_disk_kb
-    disk_spec.device.controllerKey = controller.key
-    dev_changes.append(disk_spec)
-    spec.deviceChange = dev_changes
-
-    WaitForTask(virtual_machine.ReconfigVM_Task(spec=spec))
-    print("%sGB disk added to %s" % (disk_size_gb, virtual_machine.config.name))
+    _reconfig_devices(virtual_machine, spec)
+    print_("%sGB disk added to %s" % (disk_size_gb, virtual_machine.name), logger)
 
 
 def destroy_vm(virtual_machine: vim.VirtualMachine):
@@ -465,28 +1037,25 @@ def destroy_vm(virtual_machine: vim.VirtualMachine):
     Destroy a VM
     """
     virtual_machine.Destroy_Task()
+    forget_object(virtual_machine)
 
 
-def clone_vm(virtual_machine: vim.VirtualMachine,
-             datastore: vim.Datastore,
-             folder:vim.Folder,
-             dest_host: vim.HostSystem,
-             dest_pool: vim.ResourcePool,
-             name: str,
-             num_cpus: int, num_cores_per_socket: int,
-             memory_gb: int
-            ):
+def clone_spec_vm(datastore: vim.Datastore,
+                  dest_host: vim.HostSystem,
+                  dest_pool: vim.ResourcePool,
+                  name: str,
+                  num_cpus: int, num_cores_per_socket: int,
+                  memory_gb: int) -> vim.vm.CloneSpec:
     """
-    Clone a VM. #TODO Test
-    :param virtual_machine: Virtual Machine to be cloned.
+    Build the CloneSpec of a VM.
     :param datastore: Datastore of destination.
-    :param folder: Folder of destination.
     :param dest_host: Host of destination.
     :param dest_pool: Pool of destination.
     :param name: Name of VM.
     :param num_cpus: Number of CPUs.
     :param num_cores_per_socket: Number of cores for socket.
     :param memory_gb: GB of RAM Memory.
+    :return: the CloneSpec
     """
 
     # Create the virtual machine config spec
@@ -505,6 +1074,187 @@ def clone_vm(virtual_machine: vim.VirtualMachine,
     clone_spec.location.pool = dest_pool
     clone_spec.location.host = dest_host
     clone_spec.location.datastore = datastore
+    return clone_spec
+
+
+def clone_vm(virtual_machine: vim.VirtualMachine,
+             datastore: vim.Datastore,
+             folder:vim.Folder,
+             dest_host: vim.HostSystem,
+             dest_pool: vim.ResourcePool,
+             name: str,
+             num_cpus: int, num_cores_per_socket: int,
+             memory_gb: int
+            ):
+    """
+    Clone a VM. #TODO Test
+    :param virtual_machine: Virtual Machine to be cloned.
+    :param datastore: Datastore of destination.
+    :param folder: Folder of destination.
+    :param dest_host: Host of destination.
+    :param dest_pool: Pool of destination.
+    :param name: Name of VM.
+    :param num_cpus: Number of CPUs.
+    :param num_cores_per_socket: Number of cores for socket.
+    :param memory_gb: GB of RAM Memory.
+    """
+    clone_spec = clone_spec_vm(datastore, dest_host, dest_pool, name, num_cpus, num_cores_per_socket, memory_gb)
 
     # Clone the VM to create the new virtual machine
-    WaitForTask(virtual_machine.CloneVM_Task(folder=folder, name=name, spec=clone_spec))
+    try:
+        wait_task(virtual_machine.CloneVM_Task(folder=folder, name=name, spec=clone_spec))
+    finally:
+        # The name may have been remembered as missing
+        invalidate_inventory(virtual_machine, vim.VirtualMachine)
+
+
+class BatchResult(NamedTuple):
+    """
+    Result of an operation of run_batch on a single VM
+    """
+    vm: vim.VirtualMachine
+    result: object
+    error: Exception
+
+
+def run_batch(operation, vms: List[vim.VirtualMachine],
+              max_concurrency: int = 10,
+              max_per_host: int = None,
+              max_per_datastore: int = None,
+              logger: Logger = None) -> List[BatchResult]:
+    """
+    Run an operation returning a Task on many VMs at once.
+    All the running tasks are waited by the shared TaskTracker of the connection, with a single filter.
+    For example: run_batch('PowerOnVM_Task', vms, max_concurrency=50, max_per_datastore=5)
+    :param operation: Name of the VM method returning a Task, like 'PowerOffVM_Task', or a callable vm -> Task
+    :param vms: The Virtual Machines
+    :param max_concurrency: max number of tasks running at the same time
+    :param max_per_host: max number of tasks running at the same time on VMs of the same host. None for no limit
+    :param max_per_datastore: max number of tasks running at the same time on VMs of the same datastore. None for no limit
+    :param logger: Logger
+    :return: a BatchResult for each VM, in the same order of vms
+    :raise ValueError: if a limit is lower than 1
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1, not %r" % max_concurrency)
+    for limit_name, limit in (('max_per_host', max_per_host), ('max_per_datastore', max_per_datastore)):
+        if limit is not None and limit < 1:
+            raise ValueError("%s must be at least 1 or None, not %r" % (limit_name, limit))
+
+    vms = list(vms)
+    if not vms:
+        return []
+    si = service_instance(vms[0])
+
+    if isinstance(operation, str):
+        method_name = operation
+
+        def operation(virtual_machine):
+            return getattr(virtual_machine, method_name)()
+
+    placement = {}
+    if max_per_host is not None or max_per_datastore is not None:
+        placement = get_properties(si, vms, ['runtime.host', 'datastore'])
+
+    tracker = get_task_tracker(si)
+    results = [None] * len(vms)
+    queue = deque(range(len(vms)))
+    running = {}
+    host_load = Counter()
+    datastore_load = Counter()
+
+    def locate(i):
+        props = placement.get(vms[i], {})
+        return props.get('runtime.host'), list(props.get('datastore') or [])
+
+    while queue or running:
+        submitted = []
+        # VMs waiting for a busy host or datastore keep their place at the head of the queue
+        skipped = []
+        while queue and len(running) + len(submitted) < max_concurrency:
+            i = queue.popleft()
+            host, datastores = locate(i)
+            if max_per_host is not None and host is not None and host_load[host] >= max_per_host:
+                skipped.append(i)
+                continue
+            if max_per_datastore is not None and any(datastore_load[ds] >= max_per_datastore for ds in datastores):
+                skipped.append(i)
+                continue
+
+            try:
+                task = operation(vms[i])
+            except Exception as e:
+                results[i] = BatchResult(vms[i], None, e)
+                continue
+            if task is None:
+                results[i] = BatchResult(vms[i], None, None)
+                continue
+
+            submitted.append((i, task))
+            host_load[host] += 1
+            for ds in datastores:
+                datastore_load[ds] += 1
+        queue.extendleft(reversed(skipped))
+
+        futures = tracker.track_all([task for _, task in submitted])
+        for (i, _), future in zip(submitted, futures):
+            running[future] = i
+        if not running:
+            continue
+
+        done, _ = wait_first(list(running))
+        for future in done:
+            i = running.pop(future)
+            error = future.exception()
+            results[i] = BatchResult(vms[i], None if error is not None else future.result(), error)
+            host, datastores = locate(i)
+            host_load[host] -= 1
+            for ds in datastores:
+                datastore_load[ds] -= 1
+
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Batch: %d VMs completed, %d failed." % (len(vms) - failed, failed), logger)
+    return results
+
+
+def change_disks(si: vim.ServiceInstance,
+                 changes: Dict[vim.VirtualMachine, List[DiskChange]],
+                 max_concurrency: int = 10,
+                 max_per_datastore: int = None,
+                 logger: Logger = None) -> List[BatchResult]:
+    """
+    Add, resize and remove disks on many VMs at once, for example:
+        change_disks(si, {vm: [DiskChange('add', size_gb=50), DiskChange('resize', 'Hard disk 1', 80)] for vm in vms})
+    The devices of the VMs not cached are read with a single property retrieval, the changes of each VM
+    are planned into one ReconfigVM_Task, the tasks run concurrently through run_batch.
+    :param si: Connection to vCenter Server
+    :param changes: {vm: [DiskChange]}
+    :param max_concurrency: max number of tasks running at the same time
+    :param max_per_datastore: max number of tasks running at the same time on VMs of the same datastore. None for no limit
+    :param logger: Logger
+    :return: a BatchResult for each VM, in the order of changes. The error of a VM can also come from the planning.
+    """
+    vms = list(changes)
+    hardwares = get_vm_hardwares(si, vms)
+    specs = {}
+    planned = {}
+    for virtual_machine in vms:
+        try:
+            specs[virtual_machine] = plan_disk_changes(hardwares[virtual_machine], changes[virtual_machine])
+        except Exception as e:
+            planned[virtual_machine] = BatchResult(virtual_machine, None, e)
+
+    batch = run_batch(lambda virtual_machine: virtual_machine.ReconfigVM_Task(spec=specs[virtual_machine]),
+                      [virtual_machine for virtual_machine in vms if virtual_machine in specs],
+                      max_concurrency=max_concurrency, max_per_datastore=max_per_datastore)
+    for result in batch:
+        planned[result.vm] = result
+        invalidate_vm_hardware(result.vm)
+
+    results = [planned[virtual_machine] for virtual_machine in vms]
+    failed = sum(1 for result in results if result.error is not None)
+    print_("Disks: %d VMs reconfigured, %d failed." % (len(results) - failed, failed), logger)
+    return results
+
+
+instrument_module(__name__)